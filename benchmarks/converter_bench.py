@@ -0,0 +1,131 @@
+"""
+Benchmarks core/converter.py across backends and settings on synthetic fixtures.
+
+Every run happens in a fresh child process so CPU time and peak RSS (including the
+ffmpeg processes it spawns) are measured per run. Results can be saved and compared:
+
+    python -m benchmarks.converter_bench --json baseline.json
+    python -m benchmarks.converter_bench --json current.json --compare baseline.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import generate_fixtures, CODECS, DEFAULT_DURATIONS, DEFAULT_BITRATES
+from benchmarks.results import write_results, load_results, compare, report_regressions
+
+# name -> environment for the child process and keyword arguments for convert_mp3_to_mp4
+SETTINGS = {
+    "ffmpeg": ({"PREENCODED_VIDEO": "0"}, {"backend": "ffmpeg"}),
+    "ffmpeg-preencoded": ({"PREENCODED_VIDEO": "1"}, {"backend": "ffmpeg"}),
+    "ffmpeg-transcode-audio": ({"PREENCODED_VIDEO": "1"}, {"backend": "ffmpeg", "copy_audio": False}),
+    "ffmpeg-fps2": ({"PREENCODED_VIDEO": "0"}, {"backend": "ffmpeg", "fps": 2}),
+    "ffmpeg-waveform": ({"PREENCODED_VIDEO": "1"}, {"backend": "ffmpeg", "visual": "waveform"}),
+    "moviepy": ({}, {"backend": "moviepy"}),
+}
+DEFAULT_SETTINGS = ("ffmpeg", "ffmpeg-preencoded", "ffmpeg-transcode-audio", "moviepy")
+KEYS = ("fixture", "setting")
+# +1: higher is worse, -1: lower is worse
+METRICS = {"wall_seconds": 1, "cpu_seconds": 1, "peak_rss_mb": 1, "output_bytes": 1, "realtime_factor": -1}
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def run_single(fixture, setting, workdir):
+    """Runs inside the child process: one conversion, measured."""
+    from core.converter import convert_mp3_to_mp4, probe_audio
+
+    _, kwargs = SETTINGS[setting]
+    output = os.path.join(workdir, f"{setting}_{os.path.basename(fixture)}.mp4")
+    duration = probe_audio(fixture)["duration"]
+    cpu_start = _cpu_seconds()
+    start = time.perf_counter()
+    ok = convert_mp3_to_mp4(fixture, output, logger=None, **kwargs)
+    wall = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu_start
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    size = os.path.getsize(output) if ok and os.path.exists(output) else 0
+    if os.path.exists(output):
+        os.remove(output)
+    return {
+        "ok": bool(ok),
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "output_bytes": size,
+        "realtime_factor": round(duration / wall, 1) if wall > 0 else None,
+    }
+
+def measure(fixture, setting, workdir, repeat):
+    """Runs a setting `repeat` times in child processes and keeps the median of each metric."""
+    env_overrides, _ = SETTINGS[setting]
+    env = dict(os.environ, **env_overrides, SEGMENT_CACHE_DIR=os.path.join(workdir, "segments"),
+               FRAME_CACHE_DIR=os.path.join(workdir, "frames"))
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.converter_bench", "--single", fixture, setting, workdir],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        lines = result.stdout.strip().splitlines()
+        if result.returncode != 0 or not lines:
+            return {"ok": False}
+        runs.append(json.loads(lines[-1]))
+    row = {"ok": all(run["ok"] for run in runs)}
+    for metric in METRICS:
+        values = [run[metric] for run in runs if run.get(metric) is not None]
+        row[metric] = statistics.median(values) if values else None
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=int, nargs="+", default=list(DEFAULT_DURATIONS), help="fixture lengths in seconds")
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS))
+    parser.add_argument("--bitrates", nargs="+", default=list(DEFAULT_BITRATES))
+    parser.add_argument("--settings", nargs="+", default=list(DEFAULT_SETTINGS), choices=list(SETTINGS))
+    parser.add_argument("--repeat", type=int, default=1, help="runs per combination (median is kept)")
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "mp3_to_mp4_fixtures"))
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline results file; exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative slowdown before flagging")
+    parser.add_argument("--single", nargs=3, metavar=("FIXTURE", "SETTING", "WORKDIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(*args.single)))
+        return 0
+
+    fixtures = generate_fixtures(args.fixtures_dir, args.durations, args.codecs, args.bitrates)
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, path in fixtures.items():
+            for setting in args.settings:
+                row = dict(fixture=name, setting=setting, **measure(path, setting, workdir, args.repeat))
+                rows.append(row)
+                if row["ok"]:
+                    print(f"{name:>22} {setting:>24}: {row['wall_seconds']:7.2f}s wall  {row['cpu_seconds']:7.2f}s cpu  "
+                          f"{row['peak_rss_mb']:7.1f} MB  {row['output_bytes'] / 1e6:7.2f} MB out  {row['realtime_factor']:8.1f}x")
+                else:
+                    print(f"{name:>22} {setting:>24}: FAILED")
+
+    if args.json:
+        write_results(args.json, "converter", rows, durations=args.durations, codecs=args.codecs,
+                      bitrates=args.bitrates, repeat=args.repeat)
+    if args.compare:
+        regressions = compare(load_results(args.compare), {"results": rows}, KEYS, METRICS, args.threshold)
+        return report_regressions(regressions)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Synthetic audio fixtures for the benchmarks, generated offline with ffmpeg.
+
+Each fixture is a tone sweep with a little noise so encoders can't cheat on silence.
+Files are cached in the fixture directory and only generated once.
+"""
+import os
+import subprocess
+
+from core.converter import get_ffmpeg_exe
+
+# name -> (ffmpeg encoder arguments, file extension, mime type)
+CODECS = {
+    "mp3": (["-c:a", "libmp3lame"], "mp3", "audio/mpeg"),
+    "aac": (["-c:a", "aac"], "m4a", "audio/mp4"),
+    "opus": (["-c:a", "libopus"], "ogg", "audio/ogg"),
+}
+DEFAULT_DURATIONS = (30, 300, 1800)
+DEFAULT_BITRATES = ("128k",)
+
+def fixture_name(duration, codec, bitrate):
+    return f"{codec}_{bitrate}_{duration}s.{CODECS[codec][1]}"
+
+def generate_fixture(directory, duration, codec="mp3", bitrate="128k"):
+    """Returns the path of a `duration`-second fixture, generating it if needed."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, fixture_name(duration, codec, bitrate))
+    if os.path.exists(path):
+        return path
+    encoder_args, _, _ = CODECS[codec]
+    source = (
+        f"sine=frequency=220:sample_rate=44100:duration={duration},"
+        f"volume='0.3+0.2*sin(t/5)':eval=frame"
+    )
+    cmd = [
+        get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", source,
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.02:sample_rate=44100:duration={duration}",
+        "-filter_complex", "amix=inputs=2:duration=first,aformat=channel_layouts=stereo",
+        *encoder_args, "-b:a", bitrate, path + ".tmp." + CODECS[codec][1]
+    ]
+    subprocess.run(cmd, check=True)
+    os.replace(path + ".tmp." + CODECS[codec][1], path)
+    return path
+
+def generate_fixtures(directory, durations=DEFAULT_DURATIONS, codecs=tuple(CODECS), bitrates=DEFAULT_BITRATES):
+    """Every combination of duration, codec and bitrate, as {name: path}."""
+    fixtures = {}
+    for codec in codecs:
+        for bitrate in bitrates:
+            for duration in durations:
+                path = generate_fixture(directory, duration, codec, bitrate)
+                fixtures[os.path.basename(path)] = path
+    return fixtures
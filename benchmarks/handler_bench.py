@@ -0,0 +1,287 @@
+"""
+Benchmarks the full audio_handler path (download -> convert -> upload, progress edits,
+task bookkeeping) with a mocked Telethon client and a null database.
+
+Transfers are simulated at a fixed latency/bandwidth; conversion is real. Each
+scenario runs in a fresh child process so CPU time and peak RSS are per scenario:
+
+    python -m benchmarks.handler_bench --users 1 4 --json handler.json
+    python -m benchmarks.handler_bench --users 1 4 --compare handler.json
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import math
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from benchmarks.fixtures import generate_fixture, CODECS
+from benchmarks.results import write_results, load_results, compare, report_regressions
+
+KEYS = ("fixture", "users")
+METRICS = {
+    "wall_seconds": 1, "p50_latency": 1, "p95_latency": 1, "cpu_seconds": 1,
+    "peak_rss_mb": 1, "jobs_per_minute": -1,
+}
+CHUNK_SIZE = 512 * 1024
+
+class NullCursor:
+    """Accepts every statement and returns no rows."""
+    rowcount = 0
+    connection = types.SimpleNamespace(encoding="UTF8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, *args):
+        pass
+
+    def mogrify(self, template, args=None):
+        return b"()"
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+class NullConnection:
+    def cursor(self, *args, **kwargs):
+        return NullCursor()
+
+    def commit(self):
+        pass
+
+class MockMessage:
+    _ids = iter(range(1_000_000, 10_000_000))
+
+    def __init__(self, chat_id, client, document=None):
+        self.chat_id = chat_id
+        self.id = next(self._ids)
+        self.client = client
+        self.stats = client.stats
+        self.document = document
+
+    async def get_input_chat(self):
+        from telethon.tl.types import InputPeerUser
+        return InputPeerUser(self.chat_id, 0)
+
+    async def edit(self, *args, **kwargs):
+        self.stats["edits"] += 1
+
+    async def delete(self):
+        pass
+
+class MockClient:
+    """The parts of TelegramClient the handler uses, with simulated transfer times."""
+
+    def __init__(self, fixtures, latency, bandwidth):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = {"edits": 0, "uploads": 0, "uploaded_bytes": 0}
+
+    def on(self, event):
+        return lambda handler: handler
+
+    async def __call__(self, request, flood_sleep_threshold=None):
+        # Only progress edits are sent as raw requests
+        self.stats["edits"] += 1
+
+    def build_reply_markup(self, buttons):
+        return None
+
+    async def _transfer(self, size, progress_callback):
+        done = 0
+        while done < size:
+            chunk = min(CHUNK_SIZE, size - done)
+            await asyncio.sleep(self.latency + chunk / self.bandwidth)
+            done += chunk
+            if progress_callback:
+                result = progress_callback(done, size)
+                if inspect.isawaitable(result):
+                    await result
+
+    async def download_media(self, message, file, progress_callback=None):
+        await self._transfer(message.file.size, progress_callback)
+        shutil.copy(self.fixtures[message.id], file)
+        return file
+
+    async def send_file(self, chat_id, file, progress_callback=None, **kwargs):
+        size = os.path.getsize(file)
+        await self._transfer(size, progress_callback)
+        self.stats["uploads"] += 1
+        self.stats["uploaded_bytes"] += size
+        return MockMessage(chat_id, self)
+
+    async def send_message(self, chat_id, *args, **kwargs):
+        return MockMessage(chat_id, self)
+
+    async def edit_message(self, *args, **kwargs):
+        self.stats["edits"] += 1
+
+class MockEvent:
+    def __init__(self, client, user_id, message):
+        self.client = client
+        self.sender_id = user_id
+        self.chat_id = user_id
+        self.message = message
+        self.file = message.file
+
+    async def reply(self, *args, **kwargs):
+        return MockMessage(self.chat_id, self.client)
+
+def make_audio_message(message_id, path, duration, mime_type):
+    from telethon.tl.types import DocumentAttributeAudio
+    return types.SimpleNamespace(
+        id=message_id,
+        grouped_id=None,
+        photo=None,
+        file=types.SimpleNamespace(id=f"bench{message_id}", size=os.path.getsize(path), mime_type=mime_type, name=os.path.basename(path)),
+        document=types.SimpleNamespace(id=message_id, attributes=[DocumentAttributeAudio(duration=int(duration))]),
+    )
+
+def install_mocks(client, workers, download_dir):
+    """Stands in for bot/client.py (which needs real Telegram credentials) and for Postgres."""
+    # Measure the conversions, not the rate limits and daily quota in front of them
+    os.environ.update(RATE_LIMIT_JOBS="0", GLOBAL_JOBS_PER_MINUTE="0", DAILY_QUOTA_MB="0", DAILY_QUOTA_MINUTES="0")
+    from core.scheduler import ConversionScheduler
+    from core.admission import AdmissionController
+    from core.ratelimit import UserLimits
+    import database.manager as manager
+
+    module = types.ModuleType("bot.client")
+    module.client = client
+    module.ongoing_tasks = {}
+    module.conversion_scheduler = ConversionScheduler(workers=workers, max_queue=1000)
+    module.OWNER_ID = 0
+    module.BOT_MODE = "all"
+    module.WORKER_ID = "bench"
+    module.DOWNLOAD_DIR = download_dir
+    module.admission = AdmissionController(download_dir)
+    module.limits = UserLimits()
+    sys.modules["bot.client"] = module
+    manager.get_connection = lambda: NullConnection()
+    manager.put_connection = lambda conn: None
+    return module.conversion_scheduler
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+async def run_scenario(fixture, users, workers, latency, bandwidth, workdir):
+    """Runs inside the child process: `users` users each send the fixture at the same time."""
+    from core.converter import probe_audio
+
+    duration = probe_audio(fixture)["duration"]
+    mime_type = CODECS[os.path.basename(fixture).split("_")[0]][2]
+    fixtures = {user: fixture for user in range(1, users + 1)}
+    client = MockClient(fixtures, latency, bandwidth)
+    scheduler = install_mocks(client, workers, workdir)
+    from bot.handlers import audio_handler
+    from database.manager import shutdown_db
+
+    async def one(user_id):
+        message = make_audio_message(user_id, fixture, duration, mime_type)
+        start = time.perf_counter()
+        await audio_handler(MockEvent(client, user_id, message))
+        return time.perf_counter() - start
+
+    cpu_start = _cpu_seconds()
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(user_id) for user_id in fixtures))
+    wall = time.perf_counter() - start
+    if scheduler._pool is not None:
+        scheduler._pool.shutdown(wait=True)
+        scheduler._manager.shutdown()
+    shutdown_db()
+    cpu = _cpu_seconds() - cpu_start
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    latencies.sort()
+    return {
+        "ok": client.stats["uploads"] == users,
+        "wall_seconds": round(wall, 3),
+        "p50_latency": round(statistics.median(latencies), 3),
+        "p95_latency": round(latencies[math.ceil(len(latencies) * 0.95) - 1], 3),
+        "cpu_seconds": round(cpu, 3),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "jobs_per_minute": round(users / wall * 60, 1),
+        "edits": client.stats["edits"],
+    }
+
+def measure(fixture, users, args, workdir):
+    env = dict(os.environ, SEGMENT_CACHE_DIR=os.path.join(workdir, "segments"), STREAM_PIPELINE="0")
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.handler_bench", "--single", fixture, str(users),
+         "--workers", str(args.workers), "--latency-ms", str(args.latency_ms),
+         "--bandwidth-mb", str(args.bandwidth_mb)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"ok": False}
+    return json.loads(lines[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=int, default=300, help="fixture length in seconds")
+    parser.add_argument("--codec", default="mp3", choices=list(CODECS))
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4], help="concurrent users per scenario")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="conversion worker processes")
+    parser.add_argument("--latency-ms", type=float, default=60, help="simulated round-trip per transfer chunk")
+    parser.add_argument("--bandwidth-mb", type=float, default=4, help="simulated transfer bandwidth (MB/s)")
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "mp3_to_mp4_fixtures"))
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline results file; exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--single", nargs=2, metavar=("FIXTURE", "USERS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        fixture, users = args.single[0], int(args.single[1])
+        with tempfile.TemporaryDirectory() as workdir:
+            row = asyncio.run(run_scenario(
+                fixture, users, args.workers, args.latency_ms / 1000, args.bandwidth_mb * 1024 * 1024, workdir
+            ))
+        # Handler output goes to stdout too; the result is always the last line
+        print(json.dumps(row))
+        return 0
+
+    fixture = generate_fixture(args.fixtures_dir, args.duration, args.codec)
+    name = os.path.basename(fixture)
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for users in args.users:
+            row = dict(fixture=name, users=users, **measure(fixture, users, args, workdir))
+            rows.append(row)
+            if row["ok"]:
+                print(f"{name:>22} x{users:<3}: {row['wall_seconds']:7.2f}s wall  p50 {row['p50_latency']:6.2f}s  "
+                      f"p95 {row['p95_latency']:6.2f}s  {row['jobs_per_minute']:7.1f} jobs/min  "
+                      f"{row['cpu_seconds']:6.2f}s cpu  {row['peak_rss_mb']:6.1f} MB  {row['edits']} edits")
+            else:
+                print(f"{name:>22} x{users:<3}: FAILED")
+
+    if args.json:
+        write_results(args.json, "handler", rows, workers=args.workers, latency_ms=args.latency_ms,
+                      bandwidth_mb=args.bandwidth_mb)
+    if args.compare:
+        return report_regressions(compare(load_results(args.compare), {"results": rows}, KEYS, METRICS, args.threshold))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
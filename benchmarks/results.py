@@ -0,0 +1,55 @@
+"""
+Machine-readable benchmark results and the regression check shared by the benchmarks.
+
+A results file is JSON: {"benchmark": ..., "meta": {...}, "results": [row, ...]}.
+Rows are matched between two files by their key fields; a metric regresses when it is
+worse than the baseline by more than the threshold (a fraction, e.g. 0.15 = 15%).
+"""
+import json
+import os
+import platform
+import time
+
+def write_results(path, benchmark, rows, **meta):
+    meta = dict(meta, time=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+                machine=platform.machine(), cpus=os.cpu_count())
+    with open(path, "w") as f:
+        json.dump({"benchmark": benchmark, "meta": meta, "results": rows}, f, indent=2)
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare(baseline, current, keys, metrics, threshold=0.15):
+    """
+    Returns a list of regressions: (row key, metric, baseline value, current value, change).
+    `metrics` maps a metric name to +1 if higher is worse (time, memory) or -1 if lower
+    is worse (throughput).
+    """
+    def index(results):
+        return {tuple(row[key] for key in keys): row for row in results["results"]}
+
+    old_rows = index(baseline)
+    regressions = []
+    for row_key, row in index(current).items():
+        old = old_rows.get(row_key)
+        if old is None:
+            continue
+        for metric, direction in metrics.items():
+            before, after = old.get(metric), row.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change * direction > threshold:
+                regressions.append((row_key, metric, before, after, change))
+    return regressions
+
+def report_regressions(regressions):
+    """Prints regressions and returns a process exit code (1 if there were any)."""
+    if not regressions:
+        print("No regressions.")
+        return 0
+    print(f"{len(regressions)} regression(s):")
+    for row_key, metric, before, after, change in regressions:
+        print(f"  {' / '.join(map(str, row_key))}: {metric} {before} -> {after} ({change:+.0%})")
+    return 1
@@ -0,0 +1,138 @@
+"""
+Benchmarks bot/transfer.py against Telethon's default single-stream behaviour
+using a local mock of the Telegram file API (no network, no account needed).
+
+    python -m benchmarks.transfer_bench --size-mb 100 --connections 1 4 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types.upload import File
+from telethon.tl.types.storage import FileUnknown
+
+from bot.transfer import ParallelTransferrer, PART_SIZE
+
+class MockFileAPI:
+    """In-memory stand-in for upload.getFile / upload.saveFilePart with per-request latency."""
+
+    def __init__(self, data, latency, bandwidth):
+        self.data = data
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.uploaded = {}
+        self.requests = 0
+
+class MockSender:
+    """One simulated MTProto connection: requests on it are served one after another."""
+
+    def __init__(self, api):
+        self.api = api
+        self._lock = asyncio.Lock()
+
+    async def send(self, request):
+        api = self.api
+        async with self._lock:
+            api.requests += 1
+            if isinstance(request, GetFileRequest):
+                chunk = api.data[request.offset:request.offset + request.limit]
+                await asyncio.sleep(api.latency + len(chunk) / api.bandwidth)
+                return File(type=FileUnknown(), mtime=0, bytes=chunk)
+            if isinstance(request, (SaveBigFilePartRequest, SaveFilePartRequest)):
+                await asyncio.sleep(api.latency + len(request.bytes) / api.bandwidth)
+                api.uploaded[request.file_part] = request.bytes
+                return True
+            raise TypeError(f"Unsupported request {type(request).__name__}")
+
+    async def disconnect(self):
+        pass
+
+class MockTransferrer(ParallelTransferrer):
+    def __init__(self, api, connections):
+        super().__init__(client=None, dc_id=0, connections=connections)
+        self.api = api
+
+    async def _init_senders(self, count):
+        self.senders = [MockSender(self.api) for _ in range(count)]
+
+async def sequential_download(api, file_size, out_path):
+    """What client.download_media does today: one request in flight at a time."""
+    sender = MockSender(api)
+    with open(out_path, "wb") as out:
+        for offset in range(0, file_size, PART_SIZE):
+            result = await sender.send(GetFileRequest(None, offset=offset, limit=PART_SIZE))
+            out.write(result.bytes)
+
+async def sequential_upload(api, path):
+    sender = MockSender(api)
+    with open(path, "rb") as source:
+        index = 0
+        while True:
+            data = source.read(PART_SIZE)
+            if not data:
+                break
+            await sender.send(SaveBigFilePartRequest(0, index, -1, data))
+            index += 1
+
+async def run(size_mb, connections, latency, bandwidth):
+    data = os.urandom(int(size_mb * 1024 * 1024))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.bin")
+        with open(source, "wb") as f:
+            f.write(data)
+        target = os.path.join(tmp, "target.bin")
+
+        for n in connections:
+            for direction in ("download", "upload"):
+                api = MockFileAPI(data, latency, bandwidth)
+                start = time.perf_counter()
+                if n == 0:
+                    if direction == "download":
+                        await sequential_download(api, len(data), target)
+                    else:
+                        await sequential_upload(api, source)
+                else:
+                    transferrer = MockTransferrer(api, n)
+                    if direction == "download":
+                        await transferrer.download(None, len(data), target)
+                    else:
+                        await transferrer.upload(source)
+                elapsed = time.perf_counter() - start
+                if direction == "download":
+                    with open(target, "rb") as f:
+                        assert f.read() == data, "downloaded bytes differ"
+                else:
+                    assert b"".join(api.uploaded[i] for i in sorted(api.uploaded)) == data, "uploaded bytes differ"
+                results.append({
+                    "mode": "default" if n == 0 else f"parallel x{n}",
+                    "direction": direction,
+                    "seconds": round(elapsed, 3),
+                    "mb_per_s": round(len(data) / elapsed / 1024 / 1024, 2),
+                    "requests": api.requests,
+                })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=50)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4, 8], help="parallel degrees to compare (0 = default path)")
+    parser.add_argument("--latency-ms", type=float, default=60, help="simulated round-trip per request")
+    parser.add_argument("--bandwidth-mb", type=float, default=4, help="simulated per-connection bandwidth (MB/s)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    connections = [0] + [n for n in args.connections if n > 0]
+    results = asyncio.run(run(args.size_mb, connections, args.latency_ms / 1000, args.bandwidth_mb * 1024 * 1024))
+    for row in results:
+        print(f"{row['mode']:>12} {row['direction']:>8}: {row['seconds']:7.2f}s  {row['mb_per_s']:6.2f} MB/s  ({row['requests']} requests)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
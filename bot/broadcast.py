@@ -0,0 +1,152 @@
+import os
+import asyncio
+import time
+
+from telethon import utils
+from telethon.errors import (
+    FloodWaitError, UserIsBlockedError, InputUserDeactivatedError, PeerIdInvalidError
+)
+from telethon.tl.functions.messages import SendMessageRequest, SendMediaRequest
+from telethon.tl.types import MessageMediaWebPage
+
+from core.ratelimit import TokenBucket
+from core.metrics import observe_flood_wait
+from database.manager import (
+    run_db, iter_user_batches, count_users, create_broadcast, checkpoint_broadcast, get_unfinished_broadcasts
+)
+
+# Concurrent senders, and the global send rate (Telegram allows bots ~30 messages/s)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_BATCH_SIZE = 500
+# Users sent to between two checkpoints: at most this many get the message twice after a crash
+CHECKPOINT_USERS = 50
+# FloodWaits for one peer up to this long are retried; longer ones count as failures
+MAX_PEER_RETRY_WAIT = 60
+PROGRESS_INTERVAL = 5
+
+def _copy_request(peer, message):
+    """
+    The request send_message(peer, message) would make. Sent by hand so that Telethon
+    doesn't sleep through FloodWaits of up to a minute itself, hiding them from us.
+    """
+    if message.media and not isinstance(message.media, MessageMediaWebPage):
+        return SendMediaRequest(peer, utils.get_input_media(message.media), message.message or "", entities=message.entities)
+    return SendMessageRequest(
+        peer, message.message or "", entities=message.entities,
+        no_webpage=not isinstance(message.media, MessageMediaWebPage)
+    )
+
+async def _send_one(client, bucket, user_id, message, stats):
+    for _ in range(3):
+        await bucket.acquire()
+        try:
+            peer = await client.get_input_entity(user_id)
+            await client(_copy_request(peer, message), flood_sleep_threshold=0)
+            stats["sent"] += 1
+            return
+        except FloodWaitError as e:
+            # Bot-wide limit hit: every sender backs off, then this peer is retried
+            stats["flood_waits"] += 1
+            observe_flood_wait("broadcast", e.seconds)
+            bucket.pause(e.seconds + 1)
+            if e.seconds > MAX_PEER_RETRY_WAIT:
+                break
+        except (UserIsBlockedError, InputUserDeactivatedError, PeerIdInvalidError):
+            stats["blocked"] += 1
+            break
+        except Exception as e:
+            print(f"Broadcast to {user_id} failed: {e}")
+            break
+    stats["failed"] += 1
+
+def _progress_text(stats, total, started):
+    elapsed = max(time.time() - started, 1e-6)
+    done = stats["sent"] + stats["failed"]
+    rate = (done - stats["resumed_from"]) / elapsed
+    return (
+        f"📣 <b>Broadcasting...</b> {done}/{total}\n"
+        f"✅ Sent: {stats['sent']} | ❌ Failed: {stats['failed']} (blocked: {stats['blocked']})\n"
+        f"⚡ {rate:.1f} msg/s | FloodWaits: {stats['flood_waits']}"
+    )
+
+async def run_broadcast(client, broadcast_id, message, status_msg, last_user_id=0, sent=0, failed=0):
+    """
+    Sends `message` to every user above `last_user_id`, BROADCAST_CONCURRENCY at a time
+    under a shared token bucket. The position is checkpointed every CHECKPOINT_USERS users.
+    """
+    bucket = TokenBucket(BROADCAST_RATE)
+    stats = {"sent": sent, "failed": failed, "blocked": 0, "flood_waits": 0, "resumed_from": sent + failed}
+    total = await run_db(count_users)
+    started = time.time()
+    last_report = [0.0]
+
+    async def report(force=False):
+        now = time.time()
+        if not force and now - last_report[0] < PROGRESS_INTERVAL:
+            return
+        last_report[0] = now
+        try:
+            await status_msg.edit(_progress_text(stats, total, started), parse_mode='html')
+        except Exception:
+            pass
+
+    batches = iter_user_batches(last_user_id, BROADCAST_BATCH_SIZE)
+    try:
+        while True:
+            batch = await run_db(next, batches, None)
+            if not batch:
+                break
+            for start in range(0, len(batch), CHECKPOINT_USERS):
+                chunk = batch[start:start + CHECKPOINT_USERS]
+                queue = asyncio.Queue()
+                for user_id in chunk:
+                    queue.put_nowait(user_id)
+
+                async def sender():
+                    while not queue.empty():
+                        user_id = queue.get_nowait()
+                        await _send_one(client, bucket, user_id, message, stats)
+                        await report()
+
+                # Senders finish out of order, so the position only moves once the whole chunk is done
+                await asyncio.gather(*(sender() for _ in range(min(BROADCAST_CONCURRENCY, len(chunk)))))
+                last_user_id = chunk[-1]
+                await run_db(checkpoint_broadcast, broadcast_id, last_user_id, stats["sent"], stats["failed"])
+    finally:
+        await run_db(batches.close)
+
+    await run_db(checkpoint_broadcast, broadcast_id, last_user_id, stats["sent"], stats["failed"], "done")
+    elapsed = time.time() - started
+    try:
+        await status_msg.edit(
+            f"✅ <b>Broadcast Complete!</b> Sent to {stats['sent']} users.\n"
+            f"❌ Failed: {stats['failed']} | ⏱ {elapsed:.0f}s",
+            parse_mode='html'
+        )
+    except Exception:
+        pass
+    return stats
+
+async def start_broadcast(client, source_msg, status_msg):
+    broadcast_id = await run_db(
+        create_broadcast, source_msg.chat_id, source_msg.id, status_msg.chat_id, status_msg.id
+    )
+    return await run_broadcast(client, broadcast_id, source_msg, status_msg)
+
+async def resume_broadcasts(client):
+    """Picks up broadcasts that were still running when the process stopped."""
+    for row in await run_db(get_unfinished_broadcasts):
+        broadcast_id, source_chat_id, source_message_id, status_chat_id, status_message_id, last_user_id, sent, failed = row
+        try:
+            message = await client.get_messages(source_chat_id, ids=source_message_id)
+            status_msg = await client.get_messages(status_chat_id, ids=status_message_id)
+            if message is None:
+                await run_db(checkpoint_broadcast, broadcast_id, last_user_id, sent, failed, "failed")
+                continue
+            if status_msg is None:
+                status_msg = await client.send_message(status_chat_id, "📣 <b>Resuming broadcast...</b>", parse_mode='html')
+            print(f"Resuming broadcast {broadcast_id} after user {last_user_id}")
+            asyncio.create_task(run_broadcast(client, broadcast_id, message, status_msg, last_user_id, sent, failed))
+        except Exception as e:
+            print(f"Could not resume broadcast {broadcast_id}: {e}")
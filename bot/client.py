@@ -1,6 +1,11 @@
 import os
+import socket
 from telethon import TelegramClient
 from dotenv import load_dotenv
+from core.scheduler import ConversionScheduler
+from core.metrics import register_scheduler
+from core.admission import AdmissionController
+from core.ratelimit import UserLimits
 
 load_dotenv()
 
@@ -8,12 +13,27 @@ API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-# Initialize Telethon Client
+# all = single process; frontend = handle updates and enqueue jobs; worker = convert queued jobs
+BOT_MODE = os.getenv("BOT_MODE", "all").lower()
+# Owner of the jobs this process runs: unique per run unless WORKER_ID pins it
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# A worker's Telegram session outlives restarts (bot logins are FloodWait-limited), so no pid in it.
+# Workers sharing a host need their own WORKER_ID
+WORKER_SESSION = f"mp3_to_mp4_worker_{os.getenv('WORKER_ID') or socket.gethostname()}"
+
+# Initialize Telethon Client. Workers get their own session and never receive updates,
+# so only the frontend answers users while every node can send files.
+# It is connected by start_client(), which main runs alongside the rest of startup.
 client = TelegramClient(
-    "mp3_to_mp4_bot",
+    WORKER_SESSION if BOT_MODE == "worker" else "mp3_to_mp4_bot",
     api_id=API_ID,
-    api_hash=API_HASH
-).start(bot_token=BOT_TOKEN)
+    api_hash=API_HASH,
+    receive_updates=BOT_MODE != "worker"
+)
+
+async def start_client():
+    """Connects to Telegram and logs in as the bot."""
+    await client.start(bot_token=BOT_TOKEN)
 
 OWNER_ID = int(os.getenv("OWNER_ID", "1751433177"))
 DOWNLOAD_DIR = "downloads"
@@ -23,3 +43,18 @@ if not os.path.exists(DOWNLOAD_DIR):
 
 # Global dictionary for task tracking
 ongoing_tasks = {}
+
+# Conversions run on a fixed pool of worker processes (0 = one per CPU core)
+conversion_scheduler = ConversionScheduler(
+    workers=int(os.getenv("CONVERSION_WORKERS", "0")) or None,
+    max_queue=int(os.getenv("MAX_QUEUE_SIZE", "20"))
+)
+register_scheduler(conversion_scheduler)
+# Fork the worker processes and load the converter backend in them at startup, not on the first job
+PREWARM_WORKERS = os.getenv("PREWARM_WORKERS", "1") == "1"
+
+# Disk and memory reserved by jobs that are downloading or converting
+admission = AdmissionController(DOWNLOAD_DIR)
+
+# Per-user and global rate limits; the owner and VIP_USER_IDS skip them and jump the queue
+limits = UserLimits(vip_ids={OWNER_ID})
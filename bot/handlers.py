@@ -1,13 +1,26 @@
-import os
 import asyncio
+import html
+import io
 import time
 from telethon import events, Button
-from telethon.tl.types import DocumentAttributeAudio
+from telethon.errors import FileReferenceExpiredError, MediaEmptyError
+from telethon.tl.types import InputDocument
 
-from bot.client import client, ongoing_tasks, OWNER_ID, DOWNLOAD_DIR
-from bot.ui import progress_callback, TelegramLogger, create_progress_box
-from database.manager import add_task, remove_task, can_process, log_action, get_stats, get_all_users, clear_all_tasks
-from core.converter import convert_mp3_to_mp4, CancelledError
+from bot.client import client, ongoing_tasks, conversion_scheduler, admission, limits, OWNER_ID, BOT_MODE, WORKER_ID
+from bot.ui import create_progress_box, progress_editor, CANCEL_BUTTONS
+from bot.pipeline import run_conversion, run_batch, visual_variant, output_formats, get_audio_duration, TASK_NAME, RESULT_CAPTION, BATCH_MAX_FILES
+from database.manager import (
+    add_task, remove_task, forget_task, can_process, log_action, get_stats, clear_all_tasks, run_db,
+    usage_log_writer, enqueue_job, request_job_cancel, active_tasks, active_files, USER_FILE_QUOTA,
+    get_user_settings, save_user_settings, save_output_formats, journal_job, finish_job, write_behind
+)
+from database.cache import conversion_cache
+from core.converter import VIDEO_RESOLUTION, VIDEO_FPS
+from core.admission import estimate_job_bytes
+from core.formats import EXTRA_FORMATS
+from core.profiler import sample_stacks, folded, hottest, PROFILE_MAX_SECONDS
+from bot.broadcast import start_broadcast
+from bot.limits import limit_refusal, refund_quota, usage_text
 
 # BUTTONS
 START_BUTTONS = [
@@ -22,20 +35,107 @@ START_BUTTONS = [
 
 BACK_BUTTON = [[Button.inline("⬅️ Back", data=b"start_ui")]]
 
+MODE_BUTTONS = [
+    [
+        Button.inline("⬛ Black", data=b"mode_black"),
+        Button.inline("🖼 Album Art", data=b"mode_cover")
+    ],
+    [
+        Button.inline("〰️ Waveform", data=b"mode_waveform"),
+        Button.inline("📷 My Image", data=b"mode_image")
+    ]
+]
+MODE_NAMES = {"black": "Black", "cover": "Album art", "waveform": "Waveform", "image": "Your image"}
+
+def format_buttons(formats):
+    """One toggle per extra output format, ticked when it is on."""
+    return [
+        [Button.inline(f"{'✅' if name in formats else '➕'} {description}", data=f"format_{name}".encode())]
+        for name, (_, description) in EXTRA_FORMATS.items()
+    ]
+
+def formats_text(formats):
+    names = ["MP4"] + [EXTRA_FORMATS[name][1] for name in formats]
+    return f"🎞 <b>You get:</b> {', '.join(names)}"
+
+# Only one /profile runs at a time; two would sample each other
+profile_lock = asyncio.Lock()
+# Users collecting files with /batch: user_id -> list of audio messages
+batch_sessions = {}
+# Visual settings, read from the database once per user
+user_settings = {}
+
+async def load_settings(user_id):
+    if user_id not in user_settings:
+        user_settings[user_id] = await run_db(get_user_settings, user_id)
+    return user_settings[user_id]
+
+async def set_visual_mode(user_id, mode, image=None):
+    settings = dict(await load_settings(user_id), visual_mode=mode)
+    if image:
+        settings.update(image_chat_id=image.chat_id, image_message_id=image.id, image_id=image.photo.id)
+    await run_db(save_user_settings, user_id, mode, settings["image_chat_id"], settings["image_message_id"], settings["image_id"])
+    user_settings[user_id] = settings
+
+async def toggle_output_format(user_id, name):
+    """Switches an extra output format on or off. Returns the new extra formats."""
+    formats = set(output_formats(await load_settings(user_id))) ^ {name}
+    formats = tuple(extra for extra in EXTRA_FORMATS if extra in formats)
+    value = ",".join(("mp4",) + formats)
+    await run_db(save_output_formats, user_id, value)
+    user_settings[user_id] = dict(await load_settings(user_id), output_formats=value)
+    return formats
+
+def is_audio(message):
+    return bool(message.file and message.file.mime_type and message.file.mime_type.startswith('audio/'))
+
+async def cancel_queued_jobs(user_id):
+    """Frontend mode: cancel through the shared queue. Returns True if there was a job."""
+    cancelled = await run_db(request_job_cancel, user_id)
+    for chat_id, status_id in cancelled:
+        try: await client.edit_message(chat_id, status_id, "⚠️ Task cancelled.")
+        except: pass
+    if cancelled:
+        forget_task(user_id, len(cancelled))
+    # Running jobs are stopped by their worker, which then releases the task
+    return bool(cancelled) or not can_process(user_id)
+
 @client.on(events.CallbackQuery())
 async def callback_handler(event):
     data = event.data
     user_id = event.sender_id
     
     if data == b"cancel_task":
-        if user_id in ongoing_tasks:
-            ongoing_tasks[user_id].set()
+        if BOT_MODE == "frontend":
+            if await cancel_queued_jobs(user_id):
+                await event.answer("Cancelling task... ⏳", alert=True)
+            else:
+                await event.answer("No active task to cancel.", alert=True)
+        elif user_id in ongoing_tasks:
+            # New files get a fresh event while the cancelled ones wind down
+            ongoing_tasks.pop(user_id).set()
+            conversion_scheduler.cancel(user_id)
             await event.answer("Cancelling task... ⏳", alert=True)
         else:
             await event.answer("No active task to cancel.", alert=True)
             try: await event.delete()
             except: pass
             
+    elif data.startswith(b"mode_"):
+        mode = data[5:].decode()
+        if mode == "image" and not (await load_settings(user_id)).get("image_id"):
+            await event.answer("Send me a photo first and it becomes your video background.", alert=True)
+            return
+        await set_visual_mode(user_id, mode)
+        await event.edit(f"🎨 <b>Video style:</b> {MODE_NAMES[mode]}", parse_mode='html', buttons=MODE_BUTTONS)
+
+    elif data.startswith(b"format_"):
+        name = data[7:].decode()
+        if name not in EXTRA_FORMATS:
+            return
+        formats = await toggle_output_format(user_id, name)
+        await event.edit(formats_text(formats), parse_mode='html', buttons=format_buttons(formats))
+
     elif data == b"start_ui":
         await event.edit(
             "👋 <b>Welcome to MP3 to MP4 Bot!</b>\n\n"
@@ -65,12 +165,13 @@ async def callback_handler(event):
         await event.edit(help_text, parse_mode='html', buttons=BACK_BUTTON)
         
     elif data == b"status_ui":
-        stats = get_stats()
+        stats = await run_db(get_stats)
         status_text = (
             "🤖 <b>Bot Status Report</b>\n\n"
             f"📊 <b>Total Processed:</b> {stats['total_conversions']}\n"
             f"👥 <b>Unique Users:</b> {stats['unique_users']}\n"
-            f"⏳ <b>Current Load:</b> {stats['active_tasks']} active tasks\n\n"
+            f"⏳ <b>Current Load:</b> {stats['active_tasks']} active tasks"
+            f"{await usage_text(event.sender_id)}\n\n"
             "✨ <i>Running smoothly on Render!</i>"
         )
         await event.edit(status_text, parse_mode='html', buttons=BACK_BUTTON)
@@ -92,18 +193,22 @@ async def help_handler(event):
         "• /start - Restart the bot\n"
         "• /status - Check bot load and stats\n"
         "• /cancel - Cancel your active task\n"
+        "• /batch - Collect several files, then /done converts them together\n"
+        "• /mode - Choose the video background (black, album art, waveform or your photo)\n"
+        "• /formats - Also get a round video message or a WebM with each MP4\n"
         "• /help - Show this help message"
     )
     await event.reply(help_text, parse_mode='html', buttons=BACK_BUTTON)
 
 @client.on(events.NewMessage(pattern='/status'))
 async def status_handler(event):
-    stats = get_stats()
+    stats = await run_db(get_stats)
     status_text = (
         "🤖 <b>Bot Status Report</b>\n\n"
         f"📊 <b>Total Processed:</b> {stats['total_conversions']}\n"
         f"👥 <b>Unique Users:</b> {stats['unique_users']}\n"
         f"⏳ <b>Current Load:</b> {stats['active_tasks']} active tasks"
+        f"{await usage_text(event.sender_id)}"
     )
     await event.reply(status_text, parse_mode='html', buttons=BACK_BUTTON)
 
@@ -111,11 +216,18 @@ async def status_handler(event):
 async def cancel_command_handler(event):
     user_id = event.sender_id
     cancelled = False
-    if user_id in ongoing_tasks:
-        ongoing_tasks[user_id].set()
+    if BOT_MODE == "frontend":
+        cancelled = await cancel_queued_jobs(user_id)
+    elif user_id in ongoing_tasks:
+        ongoing_tasks.pop(user_id).set()
+        conversion_scheduler.cancel(user_id)
         cancelled = True
-    if not can_process(user_id):
-        remove_task(user_id)
+    elif user_id in active_tasks:
+        # Nothing runs here to release it (e.g. restored after a restart); the jobs
+        # stopped above release their own files as they wind down
+        remove_task(user_id, active_files.get(user_id, 1))
+        cancelled = True
+    if batch_sessions.pop(user_id, None) is not None:
         cancelled = True
         
     if cancelled:
@@ -126,7 +238,7 @@ async def cancel_command_handler(event):
 # ADMIN COMMANDS
 @client.on(events.NewMessage(pattern='/users', from_users=OWNER_ID))
 async def users_handler(event):
-    stats = get_stats()
+    stats = await run_db(get_stats)
     await event.reply(f"👥 <b>Total Unique Users:</b> {stats['unique_users']}", parse_mode='html')
 
 @client.on(events.NewMessage(pattern='/broadcast', from_users=OWNER_ID))
@@ -135,25 +247,24 @@ async def broadcast_handler(event):
         await event.reply("❌ Please reply to a message to broadcast it.")
         return
     reply_msg = await event.get_reply_message()
-    users = get_all_users()
-    count = 0
-    status_msg = await event.reply(f"📣 <b>Broadcasting to {len(users)} users...</b>", parse_mode='html')
-    for user_id in users:
-        try:
-            await client.send_message(user_id, reply_msg)
-            count += 1
-            await asyncio.sleep(0.05)
-        except: pass
-    await status_msg.edit(f"✅ <b>Broadcast Complete!</b> Sent to {count} users.", parse_mode='html')
+    stats = await run_db(get_stats)
+    status_msg = await event.reply(f"📣 <b>Broadcasting to {stats['unique_users']} users...</b>", parse_mode='html')
+    await start_broadcast(client, reply_msg, status_msg)
 
 @client.on(events.NewMessage(pattern='/stats', from_users=OWNER_ID))
 async def admin_stats_handler(event):
-    stats = get_stats()
+    stats = await run_db(get_stats)
+    cache_stats = conversion_cache.stats()
+    log_stats = usage_log_writer.stats()
+    edit_stats = progress_editor.stats()
     admin_text = (
         "👑 <b>Admin Dashboard</b>\n\n"
         f"✅ <b>Conversions:</b> {stats['total_conversions']}\n"
         f"👥 <b>Total Users:</b> {stats['unique_users']}\n"
-        f"⏳ <b>Active Tasks:</b> {stats['active_tasks']}"
+        f"⏳ <b>Active Tasks:</b> {stats['active_tasks']}\n"
+        f"♻️ <b>Cache:</b> {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%})\n"
+        f"📝 <b>Log Buffer:</b> {log_stats['buffered']} queued, {log_stats['dropped']} dropped\n"
+        f"✏️ <b>Progress Edits:</b> {edit_stats['edits']} sent, {edit_stats['skipped']} coalesced, {edit_stats['flood_waits']} FloodWaits"
     )
     await event.reply(admin_text, parse_mode='html')
 
@@ -163,95 +274,241 @@ async def clear_all_handler(event):
     ongoing_tasks.clear()
     await event.reply("🚨 <b>Emergency Reset Complete.</b>", parse_mode='html')
 
+@client.on(events.NewMessage(pattern=r'/profile(?:\s+(\d+))?$', from_users=OWNER_ID))
+async def profile_handler(event):
+    """Samples this process's stacks for a while and sends them back as a flame graph input."""
+    seconds = min(int(event.pattern_match.group(1) or 10), PROFILE_MAX_SECONDS)
+    if profile_lock.locked():
+        await event.reply("🔬 A profile is already running.")
+        return
+    async with profile_lock:
+        status_msg = await event.reply(f"🔬 <b>Profiling for {seconds}s...</b>", parse_mode='html')
+        counts = await asyncio.to_thread(sample_stacks, seconds)
+    dump = io.BytesIO(folded(counts).encode())
+    dump.name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    top = "\n".join(f"{share:.0%} <code>{html.escape(frame)}</code>" for frame, share in hottest(counts))
+    await client.send_file(
+        event.chat_id, dump, force_document=True, parse_mode='html',
+        caption=f"🔥 <b>{sum(counts.values())} samples over {seconds}s.</b> Busiest frames:\n{top or 'none, all idle'}\n\n"
+                "Open in speedscope.app or run flamegraph.pl on it."
+    )
+    await status_msg.delete()
+
+async def send_cached_result(event, cache_key):
+    """Re-sends an already converted video by reference. Returns False on a miss or stale entry."""
+    media = await conversion_cache.get(cache_key)
+    if media is None:
+        return False
+    media_id, access_hash, file_reference = media
+    try:
+        await client.send_file(
+            event.chat_id,
+            InputDocument(id=media_id, access_hash=access_hash, file_reference=file_reference),
+            caption=RESULT_CAPTION
+        )
+        return True
+    except (FileReferenceExpiredError, MediaEmptyError):
+        conversion_cache.invalidate(cache_key)
+        return False
+
+def admission_refusal(messages):
+    """Why these files can't be converted on this node at all, or None. Frontends don't download."""
+    if BOT_MODE == "frontend":
+        return None
+    # Files of a batch are reserved one at a time, so only the largest has to fit
+    return admission.refusal(max(estimate_job_bytes(message.file.size, get_audio_duration(message)) for message in messages))
+
+def get_cancel_event(user_id):
+    """One cancel flag per user, shared by all of their files in flight."""
+    if user_id not in ongoing_tasks:
+        ongoing_tasks[user_id] = asyncio.Event()
+    return ongoing_tasks[user_id]
+
+def release_files(user_id, cancel_event, files=1):
+    if remove_task(user_id, files) <= 0 and ongoing_tasks.get(user_id) is cancel_event:
+        del ongoing_tasks[user_id]
+
+async def open_journal(event, message, status_message_id, cache_key):
+    """Records a job run in this process so that a restarted bot resumes it. None if the DB is down."""
+    try:
+        return await run_db(journal_job, event.sender_id, event.chat_id, message.id, status_message_id, cache_key, WORKER_ID)
+    except Exception as e:
+        print(f"Job journal write failed: {e}")
+        return None
+
+def close_journal(job_ids, user_id, state):
+    for job_id in job_ids:
+        if job_id:
+            write_behind(finish_job, job_id, user_id, state)
+
+async def enqueue_files(event, messages):
+    """Frontend mode: one queued job (and status message) per file."""
+    for message in messages:
+        box = create_progress_box(0, 0, TASK_NAME, "Queued: waiting for a worker", time.time(), is_bytes=False)
+        status_msg = await client.send_message(event.chat_id, f"<code>{box}</code>", parse_mode='html', buttons=CANCEL_BUTTONS, reply_to=message.id)
+        settings = await load_settings(event.sender_id)
+        cache_key = conversion_cache.make_key(message.document.id, VIDEO_RESOLUTION, VIDEO_FPS, visual_variant(settings))
+        try:
+            await run_db(enqueue_job, event.sender_id, event.chat_id, message.id, status_msg.id, cache_key, limits.priority(event.sender_id))
+        except Exception as e:
+            print(f"Enqueue failed: {e}")
+            remove_task(event.sender_id)
+            refund_quota(event.sender_id, [message])
+            await status_msg.edit("❌ Could not queue your file, please try again.")
+
+async def start_batch(event, messages):
+    user_id = event.sender_id
+    messages = messages[:BATCH_MAX_FILES]
+    if not can_process(user_id, len(messages)):
+        await event.reply(f"⏳ <b>Too many files in progress.</b> You can have up to {USER_FILE_QUOTA} at once.", parse_mode='html')
+        return
+    if BOT_MODE != "frontend" and conversion_scheduler.is_full():
+        await event.reply("🚦 <b>Server is busy.</b> The conversion queue is full, please try again in a few minutes.", parse_mode='html')
+        return
+    refusal = admission_refusal(messages)
+    if refusal:
+        await event.reply(f"🚦 {refusal}")
+        return
+    refusal = await limit_refusal(user_id, messages)
+    if refusal:
+        await event.reply(refusal, parse_mode='html')
+        log_action(user_id, "CONVERSION_RATE_LIMITED")
+        return
+    for _ in messages:
+        log_action(user_id, "UPLOAD_MP3")
+    add_task(user_id, len(messages))
+    if BOT_MODE == "frontend":
+        await enqueue_files(event, messages)
+        return
+
+    cancel_event = get_cancel_event(user_id)
+    start_time = time.time()
+    box = create_progress_box(0, len(messages), f"Batch of {len(messages)} files", "Starting...", start_time, is_bytes=False, unit="Files")
+    status_msg = await event.reply(f"<code>{box}</code>", parse_mode='html', buttons=CANCEL_BUTTONS)
+    state, job_ids = "error", []
+    try:
+        settings = await load_settings(user_id)
+        # After a restart each file resumes as a job of its own, with its own status message
+        for message in messages:
+            cache_key = conversion_cache.make_key(message.document.id, VIDEO_RESOLUTION, VIDEO_FPS, visual_variant(settings))
+            job_ids.append(await open_journal(event, message, None, cache_key))
+        state = await run_batch(client, messages, event.chat_id, user_id, status_msg, cancel_event, start_time, settings)
+    finally:
+        release_files(user_id, cancel_event, len(messages))
+        if state != "done":
+            refund_quota(user_id, messages)
+        close_journal(job_ids, user_id, state)
+
+@client.on(events.NewMessage(pattern='/mode'))
+async def mode_handler(event):
+    settings = await load_settings(event.sender_id)
+    await event.reply(
+        f"🎨 <b>Video style:</b> {MODE_NAMES[settings['visual_mode']]}\n\n"
+        "Album art uses the cover embedded in your file, Waveform draws the audio, "
+        "and My Image uses the last photo you sent me.",
+        parse_mode='html', buttons=MODE_BUTTONS
+    )
+
+@client.on(events.NewMessage(pattern='/formats'))
+async def formats_handler(event):
+    formats = output_formats(await load_settings(event.sender_id))
+    await event.reply(
+        f"{formats_text(formats)}\n\n"
+        "Round video messages are made for files of up to a minute. "
+        "Files sent together with /batch come back as MP4 only.",
+        parse_mode='html', buttons=format_buttons(formats)
+    )
+
+@client.on(events.NewMessage(func=lambda e: e.is_private and e.photo))
+async def photo_handler(event):
+    await set_visual_mode(event.sender_id, "image", event.message)
+    await event.reply("📷 <b>Got it!</b> Your next videos will use this image. Use /mode to switch back.", parse_mode='html')
+
+@client.on(events.NewMessage(pattern='/batch'))
+async def batch_handler(event):
+    batch_sessions[event.sender_id] = []
+    await event.reply(
+        f"📦 <b>Batch mode.</b> Send up to {BATCH_MAX_FILES} audio files, then /done to convert them together.",
+        parse_mode='html'
+    )
+
+@client.on(events.NewMessage(pattern='/done'))
+async def batch_done_handler(event):
+    messages = batch_sessions.pop(event.sender_id, None)
+    if not messages:
+        await event.reply("❌ <b>No files collected.</b> Use /batch first, then send your audio files.", parse_mode='html')
+        return
+    await start_batch(event, messages)
+
+@client.on(events.Album(func=lambda e: any(is_audio(message) for message in e.messages)))
+async def album_handler(event):
+    messages = [message for message in event.messages if is_audio(message)]
+    session = batch_sessions.get(event.sender_id)
+    if session is not None:
+        session.extend(messages[:BATCH_MAX_FILES - len(session)])
+        await event.reply(f"📥 {len(session)}/{BATCH_MAX_FILES} files collected. Send /done to start.")
+        return
+    await start_batch(event, messages)
+
 # AUDIO HANDLER
-@client.on(events.NewMessage(func=lambda e: e.message.file and e.message.file.mime_type.startswith('audio/')))
+# Files sent as an album are handled together by album_handler
+@client.on(events.NewMessage(func=lambda e: is_audio(e.message) and not e.message.grouped_id))
 async def audio_handler(event):
     user_id = event.sender_id
+    session = batch_sessions.get(user_id)
+    if session is not None:
+        if len(session) < BATCH_MAX_FILES:
+            session.append(event.message)
+        await event.reply(f"📥 {len(session)}/{BATCH_MAX_FILES} files collected. Send /done to start.")
+        return
     if not can_process(user_id):
-        await event.reply("⏳ <b>Already processing.</b> Use /cancel if stuck.")
+        await event.reply(f"⏳ <b>Too many files in progress.</b> You can have up to {USER_FILE_QUOTA} at once. Use /cancel if stuck.", parse_mode='html')
+        return
+    if BOT_MODE != "frontend" and conversion_scheduler.is_full():
+        await event.reply("🚦 <b>Server is busy.</b> The conversion queue is full, please try again in a few minutes.", parse_mode='html')
         return
 
     log_action(user_id, "UPLOAD_MP3")
+    settings = await load_settings(user_id)
+    cache_key = conversion_cache.make_key(event.message.document.id, VIDEO_RESOLUTION, VIDEO_FPS, visual_variant(settings))
+    # The cache only holds MP4s, so users who want other formats too always convert
+    if not output_formats(settings) and await send_cached_result(event, cache_key):
+        log_action(user_id, "CONVERSION_SUCCESS")
+        return
+    refusal = admission_refusal([event.message])
+    if refusal:
+        await event.reply(f"🚦 {refusal}")
+        log_action(user_id, "CONVERSION_REJECTED")
+        return
+    refusal = await limit_refusal(user_id, [event.message])
+    if refusal:
+        await event.reply(refusal, parse_mode='html')
+        log_action(user_id, "CONVERSION_RATE_LIMITED")
+        return
+
     add_task(user_id)
-    ongoing_tasks[user_id] = asyncio.Event()
+    if BOT_MODE == "frontend":
+        # Hand the job to whichever worker node claims it first
+        await enqueue_files(event, [event.message])
+        return
+
     start_time = time.time()
-    last_update = [0]
-    task_name = "MP3 to MP4 Conversion"
-    
-    file_size = event.file.size
-    file_id = event.file.id
-    
-    initial_box = create_progress_box(0, file_size, task_name, "Downloading Audio...", start_time)
+    cancel_event = get_cancel_event(user_id)
+    initial_box = create_progress_box(0, event.file.size, TASK_NAME, "Downloading Audio...", start_time)
     status_msg = await event.reply(
         f"<code>{initial_box}</code>", 
         parse_mode='html',
-        buttons=[[Button.inline("Cancel ❌", data=b"cancel_task")]]
+        buttons=CANCEL_BUTTONS
     )
-    
-    file_path = None
-    output_file = None
+    state, job_id = "error", None
     try:
-        # Step 1: Download
-        file_path = os.path.join(DOWNLOAD_DIR, f"{file_id}.mp3")
-        await client.download_media(
-            event.message,
-            file=file_path,
-            progress_callback=lambda c, t: progress_callback(c, t, status_msg, task_name, "Downloading Audio...", start_time, last_update, user_id, ongoing_tasks)
+        job_id = await open_journal(event, event.message, status_msg.id, cache_key)
+        state = await run_conversion(
+            client, event.message, event.chat_id, user_id, status_msg,
+            cancel_event, cache_key, start_time, settings, job_id=job_id
         )
-        
-        output_file = file_path.replace(".mp3", ".mp4")
-        conv_current_total = {'current': 0, 'total': 0}
-        logger = TelegramLogger(conv_current_total, ongoing_tasks[user_id])
-        conv_done = asyncio.Event()
-
-        async def update_conv_ui():
-            while not conv_done.is_set():
-                if ongoing_tasks[user_id].is_set(): break
-                status_text = conv_current_total.get('status', "Processing Video...")
-                if conv_current_total['total'] > 0:
-                    box = create_progress_box(conv_current_total['current'], conv_current_total['total'], task_name, status_text, start_time, is_bytes=False)
-                else:
-                    box = create_progress_box(0, 100, task_name, status_text, start_time, is_bytes=False)
-                try: 
-                    await status_msg.edit(f"<code>{box}</code>", parse_mode='html', buttons=[[Button.inline("Cancel ❌", data=b"cancel_task")]])
-                except: pass
-                await asyncio.sleep(4)
-
-        ui_task = asyncio.create_task(update_conv_ui())
-        loop = asyncio.get_event_loop()
-        try:
-            success = await loop.run_in_executor(None, convert_mp3_to_mp4, file_path, output_file, logger)
-            if ongoing_tasks[user_id].is_set():
-                raise CancelledError("Task cancelled.")
-        finally:
-            conv_done.set()
-            await ui_task
-        
-        if success:
-            last_update[0] = 0
-            # Step 3: Upload
-            await client.send_file(
-                event.chat_id,
-                output_file,
-                caption="✅ Here is your MP4 video!",
-                progress_callback=lambda c, t: progress_callback(c, t, status_msg, task_name, "Uploading Result...", start_time, last_update, user_id, ongoing_tasks)
-            )
-            await status_msg.delete()
-            log_action(user_id, "CONVERSION_SUCCESS")
-        else:
-            await status_msg.edit("❌ Conversion failed.")
-            log_action(user_id, "CONVERSION_FAILED")
-
-    except CancelledError:
-        try: await status_msg.edit("⚠️ Task cancelled.")
-        except: pass
-        log_action(user_id, "CONVERSION_CANCELLED")
-    except Exception as e:
-        print(f"Error: {e}")
-        try: await event.reply(f"❌ Error: {str(e)}")
-        except: pass
     finally:
-        if file_path and os.path.exists(file_path): os.remove(file_path)
-        if output_file and os.path.exists(output_file): os.remove(output_file)
-        remove_task(user_id)
-        if user_id in ongoing_tasks: del ongoing_tasks[user_id]
+        release_files(user_id, cancel_event)
+        if state != "done":
+            refund_quota(user_id, [event.message])
+        close_journal([job_id], user_id, state)
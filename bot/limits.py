@@ -0,0 +1,67 @@
+from bot.client import limits
+from bot.ui import format_duration
+from bot.pipeline import get_audio_duration
+from database.manager import run_db, write_behind, charge_daily_usage, get_daily_usage
+from core.ratelimit import RATE_LIMIT_JOBS, RATE_LIMIT_WINDOW, DAILY_QUOTA_MB, DAILY_QUOTA_MINUTES
+from core.admission import MB
+from core.metrics import RATE_LIMITED
+
+def job_usage(messages):
+    """(input bytes, seconds of audio) the daily quota is charged for these files."""
+    return sum(message.file.size for message in messages), sum(get_audio_duration(message) for message in messages)
+
+async def limit_refusal(user_id, messages):
+    """
+    Why this user can't start these conversions now (rate limit or daily quota), or None.
+    Takes their rate-limit slots and charges the daily quota when they may; refund_quota
+    gives both back if the job fails.
+    """
+    refused = limits.check(user_id, len(messages))
+    if refused:
+        scope, wait = refused
+        if scope == "user":
+            return (
+                f"⏳ <b>Slow down.</b> You can start {RATE_LIMIT_JOBS} conversions every "
+                f"{format_duration(RATE_LIMIT_WINDOW)}. Try again in {format_duration(wait + 1)}."
+            )
+        return f"🚦 <b>Server is busy.</b> Too many files are arriving at once, please try again in {format_duration(wait + 1)}."
+    if limits.is_vip(user_id) or not (DAILY_QUOTA_MB or DAILY_QUOTA_MINUTES):
+        return None
+    nbytes, seconds = job_usage(messages)
+    try:
+        charged = await run_db(charge_daily_usage, user_id, nbytes, seconds, DAILY_QUOTA_MB * MB, DAILY_QUOTA_MINUTES * 60)
+    except Exception as e:
+        # Don't turn everybody away because the database is down
+        print(f"Daily quota check failed: {e}")
+        return None
+    if charged:
+        return None
+    limits.refund(user_id, len(messages))
+    RATE_LIMITED.labels("quota").inc()
+    return (
+        f"📅 <b>Daily limit reached.</b> You can convert up to {quota_text()} per day. "
+        "The limit resets at midnight (UTC)."
+    )
+
+def refund_quota(user_id, messages):
+    """Gives back the rate-limit slots and the quota taken for files that were not converted after all."""
+    limits.refund(user_id, len(messages))
+    if limits.is_vip(user_id) or not (DAILY_QUOTA_MB or DAILY_QUOTA_MINUTES):
+        return
+    nbytes, seconds = job_usage(messages)
+    write_behind(charge_daily_usage, user_id, -nbytes, -seconds)
+
+def quota_text():
+    parts = []
+    if DAILY_QUOTA_MB:
+        parts.append(f"{DAILY_QUOTA_MB} MB")
+    if DAILY_QUOTA_MINUTES:
+        parts.append(f"{DAILY_QUOTA_MINUTES} minutes of audio")
+    return " or ".join(parts)
+
+async def usage_text(user_id):
+    """The user's quota line for /status, or "" when they have no quota."""
+    if limits.is_vip(user_id) or not (DAILY_QUOTA_MB or DAILY_QUOTA_MINUTES):
+        return ""
+    nbytes, seconds = await run_db(get_daily_usage, user_id)
+    return f"\n📅 <b>Your Usage Today:</b> {nbytes / MB:.0f} MB, {seconds / 60:.0f} min (limit {quota_text()})"
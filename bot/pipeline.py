@@ -0,0 +1,564 @@
+import os
+import asyncio
+import time
+from collections import Counter
+from telethon.tl.types import DocumentAttributeAudio, DocumentAttributeVideo
+
+from bot.client import conversion_scheduler, admission, limits, DOWNLOAD_DIR
+from bot.ui import progress_callback, TelegramLogger, create_progress_box, progress_editor
+from bot.streaming import stream_convert, estimate_output_size, STREAM_PIPELINE
+from bot.transfer import parallel_download, parallel_upload, resume_download, use_parallel
+from database.manager import log_action, write_behind, set_job_stage, save_job_timing
+from database.cache import conversion_cache
+from core.converter import (
+    convert_mp3_to_mp4, probe_audio, split_points, CancelledError, OutputTooLargeError, VIDEO_RESOLUTION, VIDEO_FPS,
+    COPY_AUDIO, COPY_AUDIO_MIME_TYPES, MAX_OUTPUT_BYTES, PART_MAX_SECONDS
+)
+from core.scheduler import QueueFullError
+from core.metrics import observe_stage, ENCODE_REALTIME_FACTOR
+from core.visuals import photo_frame_path, frame_from_image_bytes, cache_hit
+from core.admission import AdmissionError, estimate_job_bytes
+from core.costmodel import cost_model, JobEstimate, COST_MODEL_HOST
+from core.formats import EXTRA_FORMATS, ROUND_VIDEO_SIZE, input_extension, is_streamable, parse_formats, format_paths
+
+TASK_NAME = "MP3 to MP4 Conversion"
+RESULT_CAPTION = "✅ Here is your MP4 video!"
+# Largest batch a user can submit, and how many of its files download at once
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "10"))
+BATCH_DOWNLOADS = int(os.getenv("BATCH_DOWNLOADS", "3"))
+# Telegram albums hold at most 10 items
+ALBUM_SIZE = 10
+
+def get_audio_duration(message):
+    """Duration in seconds from the document's audio attribute, or 0 if Telegram didn't send one."""
+    for attribute in message.document.attributes:
+        if isinstance(attribute, DocumentAttributeAudio):
+            return attribute.duration or 0
+    return 0
+
+def visual_variant(settings):
+    """Conversion-cache variant for a user's settings: black, cover, waveform or photo<id>."""
+    mode = (settings or {}).get("visual_mode") or "black"
+    if mode == "image":
+        return f"photo{settings['image_id']}" if settings.get("image_id") else "black"
+    return mode
+
+async def prepare_visual(client, settings):
+    """convert_mp3_to_mp4 keyword arguments (image= or visual=) for a user's settings."""
+    variant = visual_variant(settings)
+    if variant == "black":
+        return {}
+    if variant in ("cover", "waveform"):
+        return {"visual": variant}
+    path = photo_frame_path(settings["image_id"], VIDEO_RESOLUTION)
+    if not cache_hit(path):
+        photo_msg = await client.get_messages(settings["image_chat_id"], ids=settings["image_message_id"])
+        if photo_msg is None or not photo_msg.photo:
+            return {}
+        data = await client.download_media(photo_msg, file=bytes)
+        await asyncio.to_thread(frame_from_image_bytes, data, VIDEO_RESOLUTION, path)
+    return {"image": path}
+
+def output_formats(settings):
+    """Extra formats (besides the MP4) a user's conversions produce."""
+    return parse_formats((settings or {}).get("output_formats"))
+
+def input_path(message, stem):
+    """Where a message's audio is downloaded, with an extension ffmpeg can recognise it by."""
+    return os.path.join(DOWNLOAD_DIR, f"{stem}{input_extension(message.file.mime_type, message.file.name)}")
+
+def record_timing(stage, size, seconds):
+    """Feeds a finished stage to the cost model, and to the DB so it survives restarts."""
+    cost_model.add(stage, size, seconds)
+    write_behind(save_job_timing, COST_MODEL_HOST, stage, size, seconds)
+
+def estimate_job(message, duration):
+    """
+    Cost-model prediction for one file, from what Telegram tells us before downloading.
+    Returns (JobEstimate, encode stage name).
+    """
+    file_size = message.file.size
+    copy_audio = COPY_AUDIO and (message.file.mime_type or "") in COPY_AUDIO_MIME_TYPES
+    encode_stage = "encode" if copy_audio else "transcode"
+    estimate = JobEstimate(
+        download=cost_model.predict("download", file_size),
+        encode=cost_model.predict(encode_stage, duration),
+        upload=cost_model.predict("upload", estimate_output_size(duration, file_size, copy_audio)),
+    )
+    return estimate, encode_stage
+
+def job_file_stem(job_id):
+    """Name of a journaled job's files in DOWNLOAD_DIR, stable across restarts."""
+    return f"job{job_id}"
+
+async def download_audio(client, message, file_path, progress_callback, resume=False):
+    """
+    Downloads a message's file, in parallel when it is big enough to benefit. With
+    `resume`, a partial file left by an interrupted job is continued instead.
+    """
+    file_size = message.file.size
+    stage_start = time.perf_counter()
+    offset = 0
+    if resume and os.path.exists(file_path):
+        if os.path.getsize(file_path) >= file_size:
+            return
+        offset = await resume_download(client, message, file_path, progress_callback)
+    elif use_parallel(file_size):
+        # A parallel download keeps its progress in <file>.part and <file>.parts until it completes
+        offset = await parallel_download(client, message, file_path, progress_callback=progress_callback, resume=resume)
+    else:
+        await client.download_media(message, file=file_path, progress_callback=progress_callback)
+    observe_stage("download", time.perf_counter() - stage_start, file_size - offset)
+    record_timing("download", file_size - offset, time.perf_counter() - stage_start)
+
+async def convert_audio(user_id, file_path, output_file, cancel_event, progress, duration=0, on_position=None, on_start=None, visual_kwargs=None, estimate=None, encode_stage=None, extra_outputs=None, part=None):
+    """
+    Waits for the user's turn in the conversion queue, then converts in a worker process.
+    The predicted encode time from `estimate` lets short jobs go first. `extra_outputs`
+    ({format: path}) are written by the same ffmpeg run as the MP4. `part` is the
+    (start, length) of the audio to convert when a file is converted in parts.
+    """
+    queued_at = time.perf_counter()
+    cost = estimate.predicted["encode"] if estimate else None
+    if part and encode_stage:
+        cost = cost_model.predict(encode_stage, part[1])
+    start, length = part or (None, None)
+    async with conversion_scheduler.slot(user_id, on_position=on_position, cost=cost, priority=limits.priority(user_id)):
+        observe_stage("queue_wait", time.perf_counter() - queued_at)
+        if on_start:
+            on_start()
+        stage_start = time.perf_counter()
+        success = await conversion_scheduler.execute(
+            convert_mp3_to_mp4, file_path, output_file,
+            cancel_event=cancel_event,
+            progress=progress,
+            logger_factory=TelegramLogger,
+            threads=conversion_scheduler.threads_per_job,
+            extra_outputs=extra_outputs,
+            start=start,
+            length=length,
+            max_bytes=MAX_OUTPUT_BYTES,
+            **(visual_kwargs or {})
+        )
+        encode_seconds = time.perf_counter() - stage_start
+        observe_stage("encode", encode_seconds, os.path.getsize(file_path))
+        if success and duration:
+            ENCODE_REALTIME_FACTOR.observe(duration / max(encode_seconds, 1e-3))
+            # Extra formats make the run slower than the MP4 alone would be
+            if encode_stage and not extra_outputs:
+                record_timing(encode_stage, duration, encode_seconds)
+    return success
+
+async def send_extras(client, chat_id, extras, duration):
+    """Sends the extra formats a conversion wrote, after the MP4."""
+    for name, path in extras.items():
+        if not os.path.exists(path):
+            continue
+        size = os.path.getsize(path)
+        stage_start = time.perf_counter()
+        if name == "round":
+            await client.send_file(
+                chat_id, path, video_note=True,
+                attributes=[DocumentAttributeVideo(duration=int(min(duration, 60)), w=ROUND_VIDEO_SIZE, h=ROUND_VIDEO_SIZE, round_message=True)]
+            )
+        else:
+            await client.send_file(chat_id, path, caption=f"✅ {EXTRA_FORMATS[name][1]}", force_document=True)
+        observe_stage("upload", time.perf_counter() - stage_start, size)
+        record_timing("upload", size, time.perf_counter() - stage_start)
+
+def part_paths(stem, parts):
+    """Output path of each part of a conversion; a single part is just the MP4."""
+    if len(parts) == 1:
+        return [os.path.join(DOWNLOAD_DIR, f"{stem}.mp4")]
+    return [os.path.join(DOWNLOAD_DIR, f"{stem}.part{index}.mp4") for index in range(1, len(parts) + 1)]
+
+async def run_conversion(client, message, chat_id, user_id, status_msg, cancel_event, cache_key, start_time=None, settings=None, job_id=None, stage=None):
+    """
+    Download, convert and upload one audio message, reporting progress on `status_msg`.
+    Used by the in-process handler and by queue workers alike. Returns the final job
+    state: "done", "failed", "cancelled", "rejected" or "error".
+
+    A journaled job (`job_id`) records its stage as it goes. Run again with the last
+    recorded `stage` after a restart, it continues a partial download and reuses a
+    finished video instead of starting over.
+
+    Audio too long for one video under MAX_OUTPUT_MB (or longer than PART_MAX_SECONDS)
+    is converted in parts that encode in parallel and are sent in order.
+    """
+    start_time = start_time or time.time()
+    last_update = [0]
+    # progress_callback/stream_convert look the cancel flag up by user
+    tasks = {user_id: cancel_event}
+    file_size = message.file.size
+
+    estimate = None
+
+    async def show_queue_position(position):
+        eta = None
+        if estimate:
+            estimate.start("queued")
+            eta = conversion_scheduler.estimated_wait(position) + estimate.remaining()
+        box = create_progress_box(0, 0, TASK_NAME, f"Queued: you are #{position} in queue", start_time, is_bytes=False, eta=eta)
+        progress_editor.update(status_msg, box)
+
+    async def show_resource_wait(shortage):
+        box = create_progress_box(0, 0, TASK_NAME, f"Waiting for free {shortage}...", start_time, is_bytes=False)
+        progress_editor.update(status_msg, box)
+
+    def journal(stage):
+        if job_id:
+            write_behind(set_job_stage, job_id, stage)
+
+    stem = job_file_stem(job_id) if job_id else f"{message.file.id}_{message.id}"
+    file_path = input_path(message, stem)
+    extras = format_paths(os.path.join(DOWNLOAD_DIR, stem), output_formats(settings))
+    # One video, until the probed file says it needs to be split
+    outputs = part_paths(stem, [(0.0, 0.0)])
+    # Whatever a previous run of this job left on disk is picked up again below
+    resuming = job_id is not None and os.path.exists(file_path)
+    reservation = None
+    try:
+        result = None
+        duration = get_audio_duration(message)
+        estimate, encode_stage = estimate_job(message, duration)
+        visual_kwargs = await prepare_visual(client, settings)
+        # The streaming pipeline only makes one MP4, and only from formats ffmpeg can read from a pipe
+        fits_one_video = (
+            estimate_output_size(duration, file_size, encode_stage == "encode") <= MAX_OUTPUT_BYTES
+            and not (PART_MAX_SECONDS and duration > PART_MAX_SECONDS)
+        )
+        if STREAM_PIPELINE and duration and fits_one_video and not visual_kwargs and not resuming and not extras and is_streamable(message.file.mime_type):
+            # Download, encode and upload at the same time with nothing written to disk
+            try:
+                queued_at = time.perf_counter()
+                # The whole job holds the slot here, so its whole predicted time is the cost
+                cost = sum(estimate.predicted.values())
+                async with conversion_scheduler.slot(user_id, on_position=show_queue_position, cost=cost, priority=limits.priority(user_id)):
+                    observe_stage("queue_wait", time.perf_counter() - queued_at)
+                    stage_start = time.perf_counter()
+                    result = await stream_convert(
+                        client, message, chat_id, duration, status_msg, TASK_NAME,
+                        start_time, user_id, tasks, caption=RESULT_CAPTION
+                    )
+                    observe_stage("stream", time.perf_counter() - stage_start, file_size)
+            except (CancelledError, QueueFullError):
+                raise
+            except Exception as e:
+                print(f"Streaming pipeline failed, falling back to file mode: {e}")
+                last_update[0] = 0
+
+        if result is None:
+            # Step 1: Download
+            # Hold room for the input and the video before anything is written
+            reservation = os.path.join(DOWNLOAD_DIR, stem)
+            await admission.acquire(reservation, estimate_job_bytes(file_size, duration), show_resource_wait, cancel_event)
+            # The videos are only known to be complete once the job got as far as uploading them
+            uploading = resuming and stage == "uploading"
+            if not uploading:
+                journal("downloading")
+                estimate.start("download")
+                download_progress = lambda c, t: progress_callback(c, t, status_msg, TASK_NAME, "Downloading Audio...", start_time, last_update, user_id, tasks, estimate)
+                await download_audio(client, message, file_path, download_progress, resume=job_id is not None)
+                journal("converting")
+
+            # Plan the output from the real file before encoding anything, so a video that
+            # can't be uploaded is split up front instead of failing at the end
+            parts = split_points(await asyncio.to_thread(probe_audio, file_path))
+            outputs = part_paths(stem, parts)
+            if len(parts) > 1:
+                extras = {}
+            reuse_output = uploading and all(os.path.exists(path) for path in (*outputs, *extras.values()))
+
+            part_progress = [{'current': 0, 'total': 0} for _ in parts]
+            conv_done = asyncio.Event()
+
+            async def update_conv_ui():
+                while not conv_done.is_set():
+                    if cancel_event.is_set(): break
+                    status_text = part_progress[0].get('status', "Processing Video...")
+                    if len(parts) > 1:
+                        status_text = f"{status_text} ({len(parts)} parts)"
+                    # Until the converter reports progress, count seconds of audio
+                    current = sum(progress['current'] for progress in part_progress)
+                    total = sum(progress['total'] for progress in part_progress) or duration
+                    unit = part_progress[0].get('unit', "Seconds")
+                    eta = estimate.remaining(current / total if total else 0)
+                    box = create_progress_box(current, total, TASK_NAME, status_text, start_time, is_bytes=False, unit=unit, eta=eta)
+                    progress_editor.update(status_msg, box)
+                    await asyncio.sleep(1)
+
+            def on_convert_start():
+                # Parts start one by one as workers free up; the first one starts the UI
+                if not ui_tasks:
+                    estimate.start("encode")
+                    ui_tasks.append(asyncio.create_task(update_conv_ui()))
+
+            def convert_part(index):
+                return convert_audio(
+                    user_id, file_path, outputs[index], cancel_event, part_progress[index], parts[index][1] or duration,
+                    on_position=show_queue_position,
+                    on_start=on_convert_start,
+                    visual_kwargs=visual_kwargs,
+                    estimate=estimate,
+                    encode_stage=encode_stage,
+                    extra_outputs=extras,
+                    part=parts[index] if len(parts) > 1 else None
+                )
+
+            ui_tasks = []
+            try:
+                success = reuse_output
+                if not success:
+                    # Every part takes its own turn in the queue, so they encode side by side
+                    # on free workers; all of them settle before anything is cleaned up
+                    results = await asyncio.gather(*(convert_part(index) for index in range(len(parts))), return_exceptions=True)
+                    for outcome in results:
+                        if isinstance(outcome, BaseException):
+                            raise outcome
+                    success = all(results)
+                if cancel_event.is_set():
+                    raise CancelledError("Task cancelled.")
+            finally:
+                conv_done.set()
+                for ui_task in ui_tasks:
+                    await ui_task
+
+            if success:
+                journal("uploading")
+                last_update[0] = 0
+                # Step 3: Upload
+                sizes = [os.path.getsize(path) for path in outputs]
+                if max(sizes) > MAX_OUTPUT_BYTES:
+                    # Only the MoviePy fallback, which can't pick its bitrate, gets here
+                    raise OutputTooLargeError(f"The video came out at {max(sizes) / 1024 / 1024:.0f} MB.")
+                estimate.predicted["upload"] = cost_model.predict("upload", sum(sizes))
+                estimate.start("upload")
+                upload_progress = lambda c, t: progress_callback(c, t, status_msg, TASK_NAME, "Uploading Result...", start_time, last_update, user_id, tasks, estimate)
+                for index, (path, output_size) in enumerate(zip(outputs, sizes)):
+                    caption = RESULT_CAPTION if len(outputs) == 1 else f"{RESULT_CAPTION} (part {index + 1}/{len(outputs)})"
+                    length = parts[index][1] or duration
+                    stage_start = time.perf_counter()
+                    if use_parallel(output_size):
+                        uploaded = await parallel_upload(client, path, progress_callback=upload_progress)
+                        width, height = VIDEO_RESOLUTION
+                        result = await client.send_file(
+                            chat_id,
+                            uploaded,
+                            caption=caption,
+                            mime_type="video/mp4",
+                            attributes=[DocumentAttributeVideo(duration=int(length), w=width, h=height, supports_streaming=True)]
+                        )
+                    else:
+                        result = await client.send_file(
+                            chat_id,
+                            path,
+                            caption=caption,
+                            progress_callback=upload_progress
+                        )
+                    observe_stage("upload", time.perf_counter() - stage_start, output_size)
+                    record_timing("upload", output_size, time.perf_counter() - stage_start)
+                await send_extras(client, chat_id, extras, duration)
+
+        await progress_editor.forget(status_msg)
+        if result is not None:
+            # A cached MP4 alone wouldn't give back the extra formats or the other parts
+            if result.document and not extras and len(outputs) == 1:
+                conversion_cache.put(cache_key, result.document.id, result.document.access_hash, result.document.file_reference)
+            await status_msg.delete()
+            log_action(user_id, "CONVERSION_SUCCESS")
+            return "done"
+        await status_msg.edit("❌ Conversion failed.")
+        log_action(user_id, "CONVERSION_FAILED")
+        return "failed"
+
+    except QueueFullError:
+        await progress_editor.forget(status_msg)
+        try: await status_msg.edit("🚦 Server is busy. The conversion queue is full, please try again in a few minutes.")
+        except: pass
+        log_action(user_id, "CONVERSION_REJECTED")
+        return "rejected"
+    except AdmissionError as e:
+        await progress_editor.forget(status_msg)
+        try: await status_msg.edit(f"🚦 {e}")
+        except: pass
+        log_action(user_id, "CONVERSION_REJECTED")
+        return "rejected"
+    except CancelledError:
+        await progress_editor.forget(status_msg)
+        try: await status_msg.edit("⚠️ Task cancelled.")
+        except: pass
+        log_action(user_id, "CONVERSION_CANCELLED")
+        return "cancelled"
+    except OutputTooLargeError as e:
+        await progress_editor.forget(status_msg)
+        print(f"Output too large: {e}")
+        try: await status_msg.edit(f"❌ The video is too big for Telegram. {e}")
+        except: pass
+        log_action(user_id, "CONVERSION_FAILED")
+        return "failed"
+    except Exception as e:
+        print(f"Error: {e}")
+        try: await client.send_message(chat_id, f"❌ Error: {str(e)}", reply_to=message.id)
+        except: pass
+        return "error"
+    finally:
+        await progress_editor.forget(status_msg)
+        if file_path and os.path.exists(file_path): os.remove(file_path)
+        for path in (*outputs, *extras.values()):
+            if os.path.exists(path): os.remove(path)
+        if reservation: admission.release(reservation)
+
+async def run_batch(client, messages, chat_id, user_id, status_msg, cancel_event, start_time=None, settings=None):
+    """
+    Converts several audio messages as one job. Files download and convert concurrently
+    (conversions still take turns with other users in the fair queue), progress is shown
+    in one combined box and the videos come back as albums. Returns the final job state.
+    """
+    start_time = start_time or time.time()
+    task_name = f"Batch of {len(messages)} files"
+    download_slots = asyncio.Semaphore(BATCH_DOWNLOADS)
+    files = [{"message": message, "stage": "Queued", "done": 0.0, "conv": {'current': 0, 'total': 0}} for message in messages]
+    for entry in files:
+        entry["estimate"], entry["encode_stage"] = estimate_job(entry["message"], get_audio_duration(entry["message"]))
+    # Files overlap, but no more of them convert at once than there are workers
+    parallel = min(len(files), conversion_scheduler.workers)
+    finished = asyncio.Event()
+
+    def fraction(entry):
+        # Download is the first 40% of a file, conversion the next 50%, upload the rest
+        if entry["stage"] == "Converting" and entry["conv"]['total'] > 0:
+            return 0.4 + 0.5 * entry["conv"]['current'] / entry["conv"]['total']
+        return entry["done"]
+
+    def remaining(entry):
+        estimate = entry["estimate"]
+        if entry["stage"] in ("Done", "Failed"):
+            return 0.0
+        if entry["stage"] == "Converted":
+            return estimate.predicted["upload"]
+        if entry["stage"] == "Downloading":
+            return estimate.remaining(entry["done"] / 0.4)
+        if entry["stage"] == "Converting" and entry["conv"]['total'] > 0:
+            return estimate.remaining(entry["conv"]['current'] / entry["conv"]['total'])
+        return estimate.remaining()
+
+    async def update_batch_ui():
+        while not finished.is_set() and not cancel_event.is_set():
+            counts = Counter(entry["stage"] for entry in files)
+            status = " · ".join(f"{stage} {count}" for stage, count in counts.items())
+            left = [remaining(entry) for entry in files]
+            box = create_progress_box(
+                sum(fraction(entry) for entry in files), len(files), task_name, status,
+                start_time, is_bytes=False, unit="Files", eta=max(max(left), sum(left) / parallel)
+            )
+            progress_editor.update(status_msg, box)
+            await asyncio.sleep(1)
+
+    async def process(entry):
+        message = entry["message"]
+        stem = f"{message.file.id}_{message.id}"
+        file_path = input_path(message, stem)
+        entry["paths"] = (file_path, os.path.join(DOWNLOAD_DIR, f"{stem}.mp4"))
+
+        async def on_download(current, total):
+            if cancel_event.is_set():
+                raise CancelledError("Task cancelled by user.")
+            entry["done"] = 0.4 * current / max(total, 1)
+
+        try:
+            async def on_wait(shortage):
+                entry["stage"] = f"Waiting for {shortage}"
+
+            entry["reservation"] = os.path.join(DOWNLOAD_DIR, stem)
+            await admission.acquire(entry["reservation"], estimate_job_bytes(message.file.size, get_audio_duration(message)), on_wait, cancel_event)
+            async with download_slots:
+                entry["stage"] = "Downloading"
+                entry["estimate"].start("download")
+                await download_audio(client, message, file_path, on_download)
+            entry["stage"], entry["done"] = "Waiting", 0.4
+            entry["estimate"].start("queued")
+
+            def on_start():
+                entry["stage"] = "Converting"
+                entry["estimate"].start("encode")
+
+            success = await convert_audio(
+                user_id, file_path, entry["paths"][1], cancel_event, entry["conv"],
+                get_audio_duration(message), on_start=on_start, visual_kwargs=visual_kwargs,
+                estimate=entry["estimate"], encode_stage=entry["encode_stage"]
+            )
+            if cancel_event.is_set():
+                raise CancelledError("Task cancelled.")
+            entry["stage"], entry["done"] = ("Converted", 0.9) if success else ("Failed", 1.0)
+        except CancelledError:
+            raise
+        except Exception as e:
+            print(f"Batch file {message.id} failed: {e}")
+            entry["stage"], entry["done"] = "Failed", 1.0
+
+    ui_task = asyncio.create_task(update_batch_ui())
+    sent = 0
+    try:
+        visual_kwargs = await prepare_visual(client, settings)
+        # Let every file settle before anything is cleaned up, even when one was cancelled
+        outcomes = await asyncio.gather(*(process(entry) for entry in files), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        converted = [entry for entry in files if entry["stage"] == "Converted"]
+        for start in range(0, len(converted), ALBUM_SIZE):
+            album = converted[start:start + ALBUM_SIZE]
+            for entry in album:
+                entry["stage"] = "Uploading"
+                entry["estimate"].start("upload")
+            stage_start = time.perf_counter()
+            results = await client.send_file(
+                chat_id, [entry["paths"][1] for entry in album],
+                caption=RESULT_CAPTION, supports_streaming=True
+            )
+            album_bytes = sum(os.path.getsize(entry["paths"][1]) for entry in album)
+            observe_stage("upload", time.perf_counter() - stage_start, album_bytes)
+            record_timing("upload", album_bytes, time.perf_counter() - stage_start)
+            if not isinstance(results, list):
+                results = [results]
+            for entry, result in zip(album, results):
+                entry["stage"], entry["done"] = "Done", 1.0
+                if result.document:
+                    cache_key = conversion_cache.make_key(entry["message"].document.id, VIDEO_RESOLUTION, VIDEO_FPS, visual_variant(settings))
+                    conversion_cache.put(cache_key, result.document.id, result.document.access_hash, result.document.file_reference)
+            sent += len(album)
+
+        finished.set()
+        await ui_task
+        await progress_editor.forget(status_msg)
+        failed = len(files) - sent
+        for _ in range(sent):
+            log_action(user_id, "CONVERSION_SUCCESS")
+        for _ in range(failed):
+            log_action(user_id, "CONVERSION_FAILED")
+        if not failed:
+            await status_msg.delete()
+            return "done"
+        await status_msg.edit(f"⚠️ Converted {sent} of {len(files)} files. {failed} failed.")
+        return "done" if sent else "failed"
+
+    except CancelledError:
+        await progress_editor.forget(status_msg)
+        try: await status_msg.edit(f"⚠️ Batch cancelled after {sent} of {len(files)} files.")
+        except: pass
+        log_action(user_id, "CONVERSION_CANCELLED")
+        return "cancelled"
+    except Exception as e:
+        print(f"Batch error: {e}")
+        try: await status_msg.edit(f"❌ Error: {str(e)}")
+        except: pass
+        return "error"
+    finally:
+        finished.set()
+        if not ui_task.done():
+            ui_task.cancel()
+        await progress_editor.forget(status_msg)
+        for entry in files:
+            for path in entry.get("paths", ()):
+                if os.path.exists(path): os.remove(path)
+            if "reservation" in entry: admission.release(entry["reservation"])
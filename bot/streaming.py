@@ -0,0 +1,142 @@
+import os
+import asyncio
+import hashlib
+import random
+
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig, DocumentAttributeVideo
+
+from bot.ui import progress_callback, format_bytes
+from core.converter import build_ffmpeg_command, CancelledError, VIDEO_RESOLUTION, VIDEO_FPS
+
+# Download -> ffmpeg -> upload without touching the disk (opt-in)
+STREAM_PIPELINE = os.getenv("STREAM_PIPELINE", "0") == "1"
+# Telegram wants equal-sized upload parts; 512 KB is the maximum
+UPLOAD_PART_SIZE = 512 * 1024
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+# Files up to this size go through the small-file upload API, bigger ones through the big-file one
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+# ADTS AAC is the only input we can stream-copy without seeking
+STREAM_COPY_MIME_TYPES = {"audio/aac", "audio/x-aac"}
+
+def estimate_output_size(duration, input_size, copy_audio):
+    """Rough MP4 size: audio track + ~50 kbit/s of video + container overhead."""
+    audio_bytes = input_size if copy_audio else duration * 128_000 / 8
+    return int(audio_bytes + duration * 50_000 / 8 + 64 * 1024)
+
+async def _read_part(stream):
+    try:
+        return await stream.readexactly(UPLOAD_PART_SIZE)
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+
+async def stream_convert(client, message, chat_id, duration, status_msg, task_name, start_time, user_id, ongoing_tasks, caption):
+    """
+    Feeds Telethon's chunked download straight into ffmpeg's stdin and uploads the
+    fragmented MP4 from its stdout part by part while it is still being produced.
+    `duration` is what the sender's client reported and only drives the progress UI;
+    the encode runs until the input ends. Returns the sent message.
+    """
+    file_size = message.file.size
+    mime_type = message.file.mime_type or ""
+    copy_audio = mime_type in STREAM_COPY_MIME_TYPES
+    cancel_event = ongoing_tasks[user_id]
+    cmd = build_ffmpeg_command(
+        "pipe:0", "pipe:1",
+        resolution=VIDEO_RESOLUTION, fps=VIDEO_FPS,
+        copy_audio=copy_audio,
+        fragmented=True, progress="pipe:2"
+    )
+    cmd[1:1] = ["-loglevel", "error"]
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    state = {"downloaded": 0, "uploaded": 0, "encoded": 0.0, "errors": []}
+    last_update = [0]
+
+    async def feed():
+        try:
+            async for chunk in client.iter_download(message.media, request_size=DOWNLOAD_CHUNK_SIZE):
+                if cancel_event.is_set():
+                    raise CancelledError("Task cancelled by user.")
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+                state["downloaded"] += len(chunk)
+                status = f"Streaming... {int(state['encoded'])}s encoded, {format_bytes(state['uploaded'])} sent"
+                await progress_callback(
+                    state["downloaded"], file_size, status_msg, task_name, status,
+                    start_time, last_update, user_id, ongoing_tasks
+                )
+        finally:
+            process.stdin.close()
+
+    async def read_progress():
+        async for raw in process.stderr:
+            key, _, value = raw.decode(errors="replace").strip().partition("=")
+            if key == "out_time_us" and value.isdigit():
+                state["encoded"] = int(value) / 1_000_000
+            elif key and not value:
+                state["errors"].append(key)
+
+    async def upload():
+        """
+        The output's size is only known once ffmpeg is done, so parts start out as a
+        small file and are kept. Once the output outgrows BIG_FILE_THRESHOLD, those
+        parts are sent again as a big file (at most BIG_FILE_THRESHOLD held in memory).
+        """
+        file_id = random.getrandbits(63)
+        md5 = hashlib.md5()
+        small_parts = []
+        part_index = 0
+        pending = await _read_part(process.stdout)
+        while pending:
+            if cancel_event.is_set():
+                raise CancelledError("Task cancelled by user.")
+            following = await _read_part(process.stdout)
+            if small_parts is not None and state["uploaded"] + len(pending) > BIG_FILE_THRESHOLD:
+                file_id = random.getrandbits(63)
+                for index, part in enumerate(small_parts):
+                    await client(SaveBigFilePartRequest(file_id, index, -1, part))
+                small_parts = None
+            if small_parts is None:
+                # Total is unknown while ffmpeg is still writing; -1 until the last part
+                total_parts = part_index + 1 if not following else -1
+                await client(SaveBigFilePartRequest(file_id, part_index, total_parts, pending))
+            else:
+                md5.update(pending)
+                small_parts.append(pending)
+                await client(SaveFilePartRequest(file_id, part_index, pending))
+            state["uploaded"] += len(pending)
+            part_index += 1
+            pending = following
+        if part_index == 0:
+            raise RuntimeError("ffmpeg produced no output")
+        if small_parts is None:
+            return InputFileBig(file_id, part_index, "video.mp4")
+        return InputFile(file_id, part_index, "video.mp4", md5.hexdigest())
+
+    feeder = asyncio.create_task(feed())
+    progress_reader = asyncio.create_task(read_progress())
+    try:
+        uploaded_file = await upload()
+        await feeder
+        await progress_reader
+        if await process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}: {' '.join(state['errors'][-5:])}")
+    except BaseException:
+        for task in (feeder, progress_reader):
+            task.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+    width, height = VIDEO_RESOLUTION
+    return await client.send_file(
+        chat_id,
+        uploaded_file,
+        caption=caption,
+        mime_type="video/mp4",
+        # ffmpeg's own count of what it encoded, not the sender's claim
+        attributes=[DocumentAttributeVideo(duration=int(state["encoded"] or duration), w=width, h=height, supports_streaming=True)]
+    )
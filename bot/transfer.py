@@ -0,0 +1,215 @@
+import os
+import math
+import asyncio
+import hashlib
+import random
+
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+
+# Parallel connections per transfer; 1 disables the parallel path
+TRANSFER_CONNECTIONS = int(os.getenv("TRANSFER_CONNECTIONS", "4"))
+# Smaller files go through Telethon's default single-stream transfer
+PARALLEL_MIN_SIZE = int(os.getenv("PARALLEL_MIN_SIZE", str(10 * 1024 * 1024)))
+PART_SIZE = 512 * 1024
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+
+class _ClientSender:
+    """Fallback sender that just uses the main client connection."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def send(self, request):
+        return await self.client(request)
+
+    async def disconnect(self):
+        pass
+
+class ParallelTransferrer:
+    """
+    Moves a file in 512 KB parts over several MTProto connections at once, in the
+    spirit of the FastTelethon helpers. Parts are handed out from a shared queue so
+    a slow connection never holds up the others.
+    """
+
+    def __init__(self, client, dc_id=None, connections=TRANSFER_CONNECTIONS):
+        self.client = client
+        self.dc_id = dc_id
+        self.connections = max(connections, 1)
+        self.senders = []
+        self.auth_key = None
+
+    async def _create_sender(self):
+        client = self.client
+        dc = await client._get_dc(self.dc_id)
+        sender = MTProtoSender(self.auth_key, loggers=client._log)
+        await sender.connect(client._connection(dc.ip_address, dc.port, dc.id, loggers=client._log, proxy=client._proxy))
+        if not self.auth_key:
+            # Another DC: borrow our authorization there once, then reuse its key
+            auth = await client(ExportAuthorizationRequest(self.dc_id))
+            client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+            self.auth_key = sender.auth_key
+        return sender
+
+    async def _init_senders(self, count):
+        if self.dc_id is None:
+            self.dc_id = self.client.session.dc_id
+        if self.dc_id == self.client.session.dc_id:
+            self.auth_key = AuthKey(self.client.session.auth_key.key)
+        try:
+            first = await self._create_sender()
+            rest = await asyncio.gather(*(self._create_sender() for _ in range(count - 1)))
+            self.senders = [first, *rest]
+        except Exception as e:
+            print(f"Parallel transfer falling back to the main connection: {e}")
+            await self.close()
+            self.senders = [_ClientSender(self.client)]
+
+    async def close(self):
+        await asyncio.gather(*(sender.disconnect() for sender in self.senders), return_exceptions=True)
+        self.senders = []
+
+    async def _run_parts(self, indices, handle_part):
+        parts = asyncio.Queue()
+        for index in indices:
+            parts.put_nowait(index)
+
+        async def worker(sender):
+            while not parts.empty():
+                await handle_part(sender, parts.get_nowait())
+
+        # The first failure (or our own cancellation) stops the other senders before the
+        # caller removes the file or closes their connections under them
+        tasks = [asyncio.create_task(worker(sender)) for sender in self.senders]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def download(self, location, file_size, out_path, progress_callback=None, resume=False):
+        """
+        Downloads to `out_path`. With `resume`, the parts an interrupted download already
+        finished are kept. Returns the number of bytes that were already there.
+        """
+        part_count = max(math.ceil(file_size / PART_SIZE), 1)
+        # Parts land out of order, so the file only gets its real name once it is complete;
+        # the sidecar has one byte per part, set once that part is on disk
+        part_path = out_path + ".part"
+        map_path = out_path + ".parts"
+        finished = bytearray(part_count)
+        if resume and os.path.exists(part_path) and os.path.exists(map_path):
+            with open(map_path, "rb") as f:
+                finished = bytearray(f.read()).ljust(part_count, b"\0")[:part_count]
+        else:
+            with open(part_path, "wb") as out:
+                out.truncate(file_size)
+        with open(map_path, "wb") as f:
+            f.write(finished)
+        missing = [index for index in range(part_count) if not finished[index]]
+        existing = file_size - sum(min(PART_SIZE, file_size - index * PART_SIZE) for index in missing)
+        done = [existing]
+        if missing:
+            await self._init_senders(min(self.connections, len(missing)))
+        with open(part_path, "r+b") as out, open(map_path, "r+b") as part_map:
+
+            async def fetch(sender, index):
+                result = await sender.send(GetFileRequest(location, offset=index * PART_SIZE, limit=PART_SIZE))
+                out.seek(index * PART_SIZE)
+                out.write(result.bytes)
+                out.flush()
+                part_map.seek(index)
+                part_map.write(b"\1")
+                part_map.flush()
+                done[0] += len(result.bytes)
+                if progress_callback:
+                    await progress_callback(done[0], file_size)
+
+            try:
+                await self._run_parts(missing, fetch)
+            except BaseException:
+                os.remove(part_path)
+                os.remove(map_path)
+                raise
+            finally:
+                await self.close()
+        os.replace(part_path, out_path)
+        os.remove(map_path)
+        return existing
+
+    async def upload(self, path, progress_callback=None):
+        file_size = os.path.getsize(path)
+        part_count = max(math.ceil(file_size / PART_SIZE), 1)
+        is_big = file_size > BIG_FILE_THRESHOLD
+        file_id = random.getrandbits(63)
+        await self._init_senders(min(self.connections, part_count))
+        done = [0]
+        with open(path, "rb") as source:
+
+            async def send(sender, index):
+                source.seek(index * PART_SIZE)
+                data = source.read(PART_SIZE)
+                if is_big:
+                    await sender.send(SaveBigFilePartRequest(file_id, index, part_count, data))
+                else:
+                    await sender.send(SaveFilePartRequest(file_id, index, data))
+                done[0] += len(data)
+                if progress_callback:
+                    await progress_callback(done[0], file_size)
+
+            try:
+                await self._run_parts(range(part_count), send)
+            finally:
+                await self.close()
+
+        name = os.path.basename(path)
+        if is_big:
+            return InputFileBig(file_id, part_count, name)
+        with open(path, "rb") as source:
+            md5 = hashlib.md5(source.read()).hexdigest()
+        return InputFile(file_id, part_count, name, md5)
+
+async def parallel_download(client, message, out_path, progress_callback=None, connections=TRANSFER_CONNECTIONS, resume=False):
+    """
+    Downloads a message's document with several connections. With `resume`, continues
+    an interrupted one. Returns the number of bytes that were already there.
+    """
+    dc_id, location = utils.get_input_location(message.media)
+    transferrer = ParallelTransferrer(client, dc_id, connections)
+    return await transferrer.download(location, message.file.size, out_path, progress_callback, resume)
+
+async def resume_download(client, message, out_path, progress_callback=None):
+    """
+    Continues a partial single-stream download from the last whole part on disk.
+    Returns the number of bytes that were already there.
+    """
+    file_size = message.file.size
+    offset = os.path.getsize(out_path)
+    offset -= offset % PART_SIZE
+    with open(out_path, "r+b") as out:
+        out.truncate(offset)
+        out.seek(offset)
+        done = offset
+        async for chunk in client.iter_download(message.media, offset=offset, request_size=PART_SIZE, file_size=file_size):
+            out.write(chunk)
+            done += len(chunk)
+            if progress_callback:
+                await progress_callback(done, file_size)
+    return offset
+
+async def parallel_upload(client, path, progress_callback=None, connections=TRANSFER_CONNECTIONS):
+    """Uploads a local file with several connections; returns an InputFile for send_file."""
+    transferrer = ParallelTransferrer(client, None, connections)
+    return await transferrer.upload(path, progress_callback)
+
+def use_parallel(file_size):
+    return TRANSFER_CONNECTIONS > 1 and file_size >= PARALLEL_MIN_SIZE
@@ -1,8 +1,21 @@
+import os
 import time
 import math
+import asyncio
 import proglog
 from telethon import Button
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+from telethon.extensions import html
+from telethon.tl.functions.messages import EditMessageRequest
 from core.converter import CancelledError
+from core.ratelimit import TokenBucket
+from core.metrics import TELEGRAM_EDITS, observe_flood_wait
+
+CANCEL_BUTTONS = [[Button.inline("Cancel ❌", data=b"cancel_task")]]
+# Bot-wide budget for progress edits (edits/second) shared by every active job
+PROGRESS_EDIT_RATE = float(os.getenv("PROGRESS_EDIT_RATE", "10"))
+# Never edit the same progress message more often than this (seconds)
+MIN_EDIT_INTERVAL = 4
 
 def format_bytes(size):
     if not size:
@@ -13,15 +26,10 @@ def format_bytes(size):
     s = round(size / p, 2)
     return f"{s} {units[i]}"
 
-def get_eta(current, total, start_time):
-    elapsed_time = time.time() - start_time
-    if current <= 0:
-        return "Calculating..."
-    speed = current / elapsed_time
-    eta_seconds = (total - current) / speed
-    if eta_seconds < 0:
+def format_duration(seconds):
+    if seconds < 0:
         return "0s"
-    minutes, seconds = divmod(int(eta_seconds), 60)
+    minutes, seconds = divmod(int(seconds), 60)
     hours, minutes = divmod(minutes, 60)
     if hours:
         return f"{hours}h {minutes}m {seconds}s"
@@ -29,18 +37,27 @@ def get_eta(current, total, start_time):
         return f"{minutes}m {seconds}s"
     return f"{seconds}s"
 
-def create_progress_box(current, total, task_name, status, start_time, is_bytes=True):
+def get_eta(current, total, start_time):
+    """Linear extrapolation from the start, for boxes without a cost-model estimate."""
+    elapsed_time = time.time() - start_time
+    if current <= 0:
+        return "Calculating..."
+    speed = current / elapsed_time
+    return format_duration((total - current) / speed)
+
+def create_progress_box(current, total, task_name, status, start_time, is_bytes=True, unit="Frames", eta=None):
+    """`eta` (seconds, e.g. from a JobEstimate) replaces the linear guess when given."""
     percentage = (current / total) * 100 if total > 0 else 0
     percentage = min(percentage, 100)
     filled_blocks = int(percentage / (100 / 15))
     bar = "▤" * filled_blocks + "□" * (15 - filled_blocks)
-    eta = get_eta(current, total, start_time)
+    eta = format_duration(eta) if eta is not None else get_eta(current, total, start_time)
     if is_bytes:
         processed = format_bytes(current)
         total_size = format_bytes(total)
     else:
         processed = f"{int(current)}"
-        total_size = f"{int(total)} (Frames)"
+        total_size = f"{int(total)} ({unit})"
     
     return (
         f"┏ 🏷️ Name: {task_name}\n"
@@ -49,7 +66,136 @@ def create_progress_box(current, total, task_name, status, start_time, is_bytes=
         f"┠ ✨ Status: {status} | ETA: {eta}"
     )
 
-async def progress_callback(current, total, status_msg, task_name, status_text, start_time, last_update, user_id, ongoing_tasks):
+class ProgressEditor:
+    """
+    Central scheduler for progress-message edits.
+    Jobs hand it the latest rendered text; it only sends an edit when the text
+    changed, spaces edits per message according to how many jobs share the
+    bot-wide rate, and backs off everything after a FloodWait.
+    """
+
+    def __init__(self, rate=PROGRESS_EDIT_RATE, min_interval=MIN_EDIT_INTERVAL):
+        self.rate = rate
+        self.min_interval = min_interval
+        self.backoff = 1.0
+        self.bucket = TokenBucket(rate)
+        self._active = set()
+        self._pending = {}
+        self._last_text = {}
+        self._last_edit = {}
+        self._in_flight = {}
+        self._task = None
+        self.edits = 0
+        self.skipped = 0
+        self.flood_waits = 0
+
+    @staticmethod
+    def _key(message):
+        return (message.chat_id, message.id)
+
+    def interval(self):
+        """Seconds between edits of one message, given how many messages share the budget."""
+        return max(self.min_interval, max(len(self._active), 1) / self.rate) * self.backoff
+
+    def update(self, message, text, buttons=CANCEL_BUTTONS):
+        """Record the latest progress text for a message; the edit happens later, if at all."""
+        key = self._key(message)
+        self._active.add(key)
+        if self._last_text.get(key) == text:
+            self.skipped += 1
+            self._pending.pop(key, None)
+            return
+        if key in self._pending:
+            self.skipped += 1
+        self._pending[key] = (message, text, buttons)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def forget(self, message):
+        """
+        Stop managing a message, e.g. right before it gets its final text or is deleted.
+        Waits for an edit already on its way, so it can't land after the final text.
+        """
+        key = self._key(message)
+        self._active.discard(key)
+        self._pending.pop(key, None)
+        self._last_text.pop(key, None)
+        self._last_edit.pop(key, None)
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            await asyncio.shield(in_flight)
+
+    @staticmethod
+    async def _send_edit(message, text, buttons):
+        """
+        What message.edit() sends, but with FloodWaits raised straight away; Telethon
+        would otherwise sleep through those up to a minute long inside the call, and
+        every other job's progress with it.
+        """
+        client = message.client
+        text, entities = html.parse(f"<code>{text}</code>")
+        request = EditMessageRequest(
+            await message.get_input_chat(), message.id, message=text, entities=entities,
+            reply_markup=client.build_reply_markup(buttons)
+        )
+        await client(request, flood_sleep_threshold=0)
+
+    async def _edit(self, key, message, text, buttons):
+        await self.bucket.acquire()
+        if key not in self._active:
+            # Forgotten while waiting for budget
+            return
+        # A newer text may have arrived while we waited
+        message, text, buttons = self._pending.pop(key, (message, text, buttons))
+        self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            await self._send_edit(message, text, buttons)
+            self.edits += 1
+            self.backoff = max(1.0, self.backoff * 0.9)
+            TELEGRAM_EDITS.labels("ok").inc()
+        except MessageNotModifiedError:
+            TELEGRAM_EDITS.labels("not_modified").inc()
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            TELEGRAM_EDITS.labels("flood_wait").inc()
+            observe_flood_wait("progress_edit", e.seconds)
+            self.bucket.pause(e.seconds)
+            self.backoff = min(self.backoff * 2, 8.0)
+            if key in self._active:
+                self._pending.setdefault(key, (message, text, buttons))
+            return
+        except Exception as e:
+            TELEGRAM_EDITS.labels("error").inc()
+            print(f"Progress edit failed: {e}")
+        finally:
+            self._in_flight.pop(key).set_result(None)
+        if key not in self._active:
+            return
+        self._last_text[key] = text
+        self._last_edit[key] = time.monotonic()
+
+    async def _run(self):
+        while self._pending:
+            now = time.monotonic()
+            interval = self.interval()
+            due = [key for key in self._pending if now - self._last_edit.get(key, 0) >= interval]
+            for key in due:
+                entry = self._pending.pop(key, None)
+                if entry is not None:
+                    await self._edit(key, *entry)
+            await asyncio.sleep(0.5)
+
+    def stats(self):
+        return {
+            "edits": self.edits,
+            "skipped": self.skipped,
+            "flood_waits": self.flood_waits,
+            "interval": self.interval(),
+        }
+
+progress_editor = ProgressEditor()
+
+async def progress_callback(current, total, status_msg, task_name, status_text, start_time, last_update, user_id, ongoing_tasks, estimate=None):
     """
     Telethon progress callback wrapper. 
     Note: Telethon calls this with (current, total).
@@ -58,20 +204,14 @@ async def progress_callback(current, total, status_msg, task_name, status_text,
     if user_id in ongoing_tasks and ongoing_tasks[user_id].is_set():
         raise CancelledError("Task cancelled by user.")
     
+    # Rendering once a second is plenty; progress_editor decides when to actually edit
     now = time.time()
-    if now - last_update[0] < 4:
+    if now - last_update[0] < 1:
         return
     last_update[0] = now
-    box = create_progress_box(current, total, task_name, status_text, start_time)
-    
-    try:
-        await status_msg.edit(
-            f"<code>{box}</code>",
-            parse_mode='html',
-            buttons=[[Button.inline("Cancel ❌", data=b"cancel_task")]]
-        )
-    except:
-        pass
+    eta = estimate.remaining(current / total if total else 0) if estimate else None
+    box = create_progress_box(current, total, task_name, status_text, start_time, eta=eta)
+    progress_editor.update(status_msg, box)
 
 class TelegramLogger(proglog.ProgressBarLogger):
     def __init__(self, progress_dict, cancel_event):
@@ -88,8 +228,9 @@ class TelegramLogger(proglog.ProgressBarLogger):
                 if bar_data['total'] > 1:
                     self.progress_dict['current'] = bar_data['index']
                     self.progress_dict['total'] = bar_data['total']
+                    # The ffmpeg backend counts seconds of audio, MoviePy counts frames
+                    self.progress_dict['unit'] = "Seconds" if bar_name == "encode" else "Frames"
         
         if 'message' in changes:
             msg = changes['message'].replace("MoviePy - ", "")
             self.progress_dict['status'] = msg
-            print(f"DEBUG: Status Update: {msg}")
@@ -0,0 +1,153 @@
+import os
+import asyncio
+
+from bot.client import client, conversion_scheduler, ongoing_tasks, WORKER_ID
+from bot.pipeline import run_conversion
+from bot.limits import refund_quota
+from database.manager import (
+    run_db, claim_job, heartbeat_jobs, finish_job, requeue_stale_jobs, requeue_worker_jobs, track_task,
+    forget_task, get_user_settings, active_files, heartbeat_worker_jobs, claim_interrupted_jobs
+)
+from database.notify import listen
+
+# Seconds between heartbeats; a job silent for JOB_STALE_SECONDS is handed to another worker
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))
+# Fallback poll in case a NOTIFY is missed (e.g. while the LISTEN connection reconnects)
+JOB_POLL_SECONDS = 5
+
+class JobWorker:
+    """Claims jobs from the shared queue and runs them, up to one per conversion slot."""
+
+    def __init__(self, client, scheduler, worker_id):
+        self.client = client
+        self.scheduler = scheduler
+        self.worker_id = worker_id
+        self.running = {}  # job_id -> cancel event
+        # Jobs requeued to another worker while this one stalled: aborted without a trace
+        self.lost = set()
+        self.wake = asyncio.Event()
+
+    def on_notify(self, channel, payload):
+        if channel == "job_cancel":
+            event = self.running.get(int(payload))
+            if event:
+                event.set()
+        else:
+            self.wake.set()
+
+    async def heartbeat_forever(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                cancelled, lost = await run_db(heartbeat_jobs, list(self.running), self.worker_id)
+                for job_id in lost:
+                    print(f"Job {job_id} was handed to another worker, aborting it here")
+                    self.lost.add(job_id)
+                for job_id in cancelled + lost:
+                    if job_id in self.running:
+                        self.running[job_id].set()
+                requeued = await run_db(requeue_stale_jobs, JOB_STALE_SECONDS)
+                if requeued:
+                    print(f"Requeued {requeued} jobs from unresponsive workers")
+            except Exception as e:
+                print(f"Job heartbeat error: {e}")
+
+    async def process(self, job):
+        job_id, user_id, chat_id = job["id"], job["user_id"], job["chat_id"]
+        cancel_event = self.running[job_id]
+        state, error, message = "error", None, None
+        track_task(user_id)
+        try:
+            message = await self.client.get_messages(chat_id, ids=job["message_id"])
+            if message is None or not message.file:
+                state, error = "failed", "source message is gone"
+                return
+            status_msg = None
+            if job["status_message_id"]:
+                status_msg = await self.client.get_messages(chat_id, ids=job["status_message_id"])
+            if status_msg is None:
+                status_msg = await self.client.send_message(chat_id, "⏳ Processing...", reply_to=message.id)
+            settings = await run_db(get_user_settings, user_id)
+            state = await run_conversion(
+                self.client, message, chat_id, user_id, status_msg, cancel_event, job["cache_key"],
+                settings=settings, job_id=job_id, stage=job["stage"]
+            )
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            error = str(e)
+        finally:
+            forget_task(user_id)
+            self.running.pop(job_id, None)
+            self.wake.set()
+            if job_id in self.lost:
+                # Its new worker refunds and finishes it
+                self.lost.discard(job_id)
+            else:
+                # The quota was charged when the job was accepted
+                if state != "done" and message is not None and message.file:
+                    refund_quota(user_id, [message])
+                try:
+                    await run_db(finish_job, job_id, user_id, state, error, self.worker_id)
+                except Exception as e:
+                    print(f"Could not finish job {job_id}: {e}")
+
+    async def run_forever(self):
+        print(f"Worker {self.worker_id} waiting for jobs...")
+        asyncio.create_task(listen(["new_job", "job_cancel"], self.on_notify))
+        asyncio.create_task(self.heartbeat_forever())
+        while True:
+            self.wake.clear()
+            try:
+                while len(self.running) < self.scheduler.workers:
+                    job = await run_db(claim_job, self.worker_id)
+                    if job is None:
+                        break
+                    self.running[job["id"]] = asyncio.Event()
+                    asyncio.create_task(self.process(job))
+            except Exception as e:
+                print(f"Job claim error: {e}")
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+async def run_worker():
+    # Only useful with a fixed WORKER_ID: the jobs come back here (or to a peer) right away
+    requeued = await run_db(requeue_worker_jobs, WORKER_ID)
+    if requeued:
+        print(f"Requeued {requeued} jobs left running by a previous run of {WORKER_ID}")
+    await JobWorker(client, conversion_scheduler, WORKER_ID).run_forever()
+
+async def resume_jobs(jobs):
+    """BOT_MODE=all: finishes the jobs an earlier run of the bot was killed in the middle of."""
+    worker = JobWorker(client, conversion_scheduler, WORKER_ID)
+
+    async def resume(job):
+        user_id = job["user_id"]
+        # Same per-user cancel flag the handlers use, so Cancel works on resumed jobs too
+        cancel_event = ongoing_tasks.setdefault(user_id, asyncio.Event())
+        worker.running[job["id"]] = cancel_event
+        await worker.process(job)
+        if user_id not in active_files and ongoing_tasks.get(user_id) is cancel_event:
+            del ongoing_tasks[user_id]
+
+    if jobs:
+        print(f"Resuming {len(jobs)} interrupted jobs")
+    await asyncio.gather(*(resume(job) for job in jobs))
+
+async def keep_jobs_alive():
+    """
+    BOT_MODE=all: heartbeats the jobs this process journaled and resumes the ones whose
+    process stopped heartbeating, e.g. one that crashed, or was stopped by a deploy after
+    this process had already started.
+    """
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await run_db(heartbeat_worker_jobs, WORKER_ID)
+            jobs = await run_db(claim_interrupted_jobs, WORKER_ID, JOB_STALE_SECONDS)
+            if jobs:
+                asyncio.create_task(resume_jobs(jobs))
+        except Exception as e:
+            print(f"Job heartbeat error: {e}")
@@ -0,0 +1,193 @@
+import os
+import time
+import shutil
+import asyncio
+import contextlib
+
+from core.converter import CancelledError
+
+# Keep at least this much free space in the download directory
+MIN_FREE_DISK_MB = int(os.getenv("MIN_FREE_DISK_MB", "200"))
+# Upper bound on input + estimated output bytes of all jobs in flight (0 = no limit)
+MAX_RESERVED_MB = int(os.getenv("MAX_RESERVED_MB", "2048"))
+# Memory of the bot plus its conversion/ffmpeg processes, and what one more job adds (0 = no limit)
+MAX_MEMORY_MB = int(os.getenv("MAX_MEMORY_MB", "450"))
+JOB_MEMORY_MB = int(os.getenv("JOB_MEMORY_MB", "60"))
+# memory_in_use() walks /proc, so waiting jobs share one reading this old at most
+MEMORY_SAMPLE_SECONDS = 1.0
+# How long a job may wait for resources before it is refused
+ADMISSION_WAIT_SECONDS = int(os.getenv("ADMISSION_WAIT_SECONDS", "600"))
+# Files in DOWNLOAD_DIR older than this that no job owns are removed by the sweep
+ORPHAN_FILE_SECONDS = int(os.getenv("ORPHAN_FILE_SECONDS", "3600"))
+
+MB = 1024 * 1024
+
+class AdmissionError(Exception):
+    """Raised when a job can't be given the disk or memory it needs. The message is user-facing."""
+    pass
+
+def estimate_job_bytes(input_size, duration=0):
+    """Input file plus a pessimistic MP4: transcoded 128 kbit/s audio (or a copy) + ~50 kbit/s video."""
+    audio_bytes = max(input_size, duration * 128_000 / 8)
+    return int(input_size + audio_bytes + duration * 50_000 / 8 + 64 * 1024)
+
+def _rss_bytes(pid):
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def memory_in_use():
+    """RSS of this process and all of its descendants (worker pool, ffmpeg), or None without /proc."""
+    if not os.path.isdir("/proc/self"):
+        return None
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields after it are fixed
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    pending = [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        try:
+            total += _rss_bytes(pid)
+        except OSError:
+            continue
+        pending.extend(children.get(pid, ()))
+    return total
+
+class AdmissionController:
+    """
+    Reserves disk space and memory for jobs before they download anything.
+    A job that would fit once others finish waits (up to ADMISSION_WAIT_SECONDS);
+    one that can never fit is refused straight away.
+    """
+
+    def __init__(self, directory, max_reserved=MAX_RESERVED_MB * MB, min_free=MIN_FREE_DISK_MB * MB,
+                 max_memory=MAX_MEMORY_MB * MB, job_memory=JOB_MEMORY_MB * MB):
+        self.directory = directory
+        self.max_reserved = max_reserved
+        self.min_free = min_free
+        self.max_memory = max_memory
+        self.job_memory = job_memory
+        self.reservations = {}
+        self.refused = 0
+        self._changed = asyncio.Event()
+        self._memory = None
+        self._memory_at = float("-inf")
+        # Checking now awaits the memory reading; no other job may reserve in between
+        self._check_lock = asyncio.Lock()
+
+    @property
+    def reserved(self):
+        return sum(self.reservations.values())
+
+    def free_disk(self):
+        return shutil.disk_usage(self.directory).free
+
+    def refusal(self, nbytes):
+        """Reason this job can never run here (even on an idle bot), or None."""
+        if self.max_reserved and nbytes > self.max_reserved:
+            return "This file is too large for the server to convert."
+        if self.free_disk() + self.reserved - nbytes < self.min_free:
+            return "The server is low on disk space, please try again later."
+        return None
+
+    async def memory_in_use(self):
+        """memory_in_use(), read on a thread and reused for MEMORY_SAMPLE_SECONDS."""
+        if time.monotonic() - self._memory_at >= MEMORY_SAMPLE_SECONDS:
+            self._memory = await asyncio.to_thread(memory_in_use)
+            self._memory_at = time.monotonic()
+        return self._memory
+
+    async def shortage(self, nbytes):
+        """What currently stops the job from starting, or None if it can start now."""
+        if self.max_reserved and self.reserved + nbytes > self.max_reserved:
+            return "disk"
+        # Reserved bytes may not be written yet, so count them as already used
+        if self.free_disk() - self.reserved - nbytes < self.min_free:
+            return "disk"
+        if self.max_memory and self.reservations:
+            in_use = await self.memory_in_use()
+            if in_use is not None and in_use + self.job_memory > self.max_memory:
+                return "memory"
+        return None
+
+    async def acquire(self, key, nbytes, on_wait=None, cancel_event=None):
+        reason = self.refusal(nbytes)
+        if reason:
+            self.refused += 1
+            raise AdmissionError(reason)
+        deadline = time.monotonic() + ADMISSION_WAIT_SECONDS
+        notified = False
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise CancelledError("Task cancelled.")
+            async with self._check_lock:
+                shortage = await self.shortage(nbytes)
+                if shortage is None:
+                    self.reservations[key] = nbytes
+                    return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.refused += 1
+                raise AdmissionError("The server is busy, please try again in a few minutes.")
+            if on_wait and not notified:
+                notified = True
+                await on_wait(shortage)
+            self._changed.clear()
+            try:
+                # Re-check when a job finishes, and every couple of seconds for memory/disk drift and cancels
+                await asyncio.wait_for(self._changed.wait(), timeout=min(remaining, 2))
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, key):
+        if self.reservations.pop(key, None) is not None:
+            self._changed.set()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, key, nbytes, on_wait=None, cancel_event=None):
+        """Holds `nbytes` for the duration of the block. `key` is the job's file stem."""
+        await self.acquire(key, nbytes, on_wait, cancel_event)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def sweep(self, max_age=ORPHAN_FILE_SECONDS, keep=()):
+        """
+        Deletes files in the directory that no reservation owns and that are older
+        than `max_age` seconds (0 at startup, when nothing can own them). Files whose
+        stem is in `keep` (unfinished journaled jobs) are left for their job to resume.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        cutoff = time.time() - max_age
+        # Keys are file stems; a job's input, output and temp files all start with one.
+        # Runs on a thread while jobs reserve on the loop, so iterate over a copy
+        owned = {os.path.basename(key) for key in list(self.reservations)} | set(keep)
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.split(".")[0] in owned or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def stats(self):
+        return {
+            "jobs": len(self.reservations),
+            "reserved_mb": round(self.reserved / MB, 1),
+            "free_disk_mb": round(self.free_disk() / MB, 1),
+            "refused": self.refused,
+        }
@@ -1,50 +1,478 @@
-from moviepy import AudioFileClip, ColorClip
+import os
+import re
+import math
+import shutil
+import hashlib
+import subprocess
+
+from core.formats import extra_output_args, fit_outputs
 
 class CancelledError(Exception):
     """Custom exception to handle task cancellation."""
     pass
 
-def convert_mp3_to_mp4(input_path, output_path, logger='bar', resolution=(144, 256), fps=1):
+class OutputTooLargeError(Exception):
+    """The video would be bigger than Telegram lets the bot upload, whatever the settings."""
+    pass
+
+# "ffmpeg" builds a single ffmpeg command, "moviepy" renders frames in Python.
+CONVERTER_BACKEND = os.getenv("CONVERTER_BACKEND", "ffmpeg")
+# Stream-copy the audio track when the input codec can go into MP4 as-is.
+COPY_AUDIO = os.getenv("COPY_AUDIO", "1") == "1"
+COPY_AUDIO_CODECS = {"aac"}
+# What Telegram reports for files that usually hold AAC, for guessing before the file is here
+COPY_AUDIO_MIME_TYPES = {"audio/aac", "audio/x-aac", "audio/mp4", "audio/m4a", "audio/x-m4a"}
+# Transcoded audio never gets a higher bitrate than this (or than the source had)
+AUDIO_BITRATE = 128_000
+# Below this an output that is too big is split into parts instead of sounding worse
+MIN_AUDIO_BITRATE = 48_000
+# Largest video the bot may upload (Telegram's limit for bots is 2000 MB); outputs are planned to fit
+MAX_OUTPUT_BYTES = int(os.getenv("MAX_OUTPUT_MB", "2000")) * 1024 * 1024
+# Audio longer than this is converted in parts that encode in parallel and are sent in order (0 = never)
+PART_MAX_SECONDS = int(os.getenv("PART_MAX_SECONDS", str(3 * 3600)))
+# Render settings for the still video track (width, height) and frame rate
+VIDEO_RESOLUTION = (144, 256)
+VIDEO_FPS = 1
+# Still-frame output reuses a pre-encoded segment (looped and stream-copied) instead of encoding video
+PREENCODED_VIDEO = os.getenv("PREENCODED_VIDEO", "1") == "1"
+SEGMENT_CACHE_DIR = os.getenv("SEGMENT_CACHE_DIR", "segments")
+SEGMENT_SECONDS = 60
+# Video encode settings; part of the segment cache key so a change rebuilds the segments
+VIDEO_BITRATE = 50_000
+VIDEO_CODEC_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-tune", "stillimage", "-pix_fmt", "yuv420p", "-b:v", f"{VIDEO_BITRATE // 1000}k"]
+# MP4 overhead on top of the two tracks: a fixed header plus a share of the payload
+CONTAINER_BYTES = 64 * 1024
+CONTAINER_OVERHEAD = 0.02
+
+def get_ffmpeg_exe():
+    """Return the ffmpeg binary, preferring FFMPEG_BINARY over the one bundled with imageio."""
+    exe = os.getenv("FFMPEG_BINARY")
+    if exe:
+        return exe
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+def _parse_timestamp(value):
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+# ffmpeg's named channel layouts; "5.1(side)" style ones are counted from their name
+CHANNEL_LAYOUTS = {"mono": 1, "stereo": 2, "downmix": 2, "quad": 4, "hexagonal": 6, "octagonal": 8, "hexadecagonal": 16}
+
+def layout_channels(layout):
+    """Channel count of an ffmpeg channel layout ("stereo", "5.1(side)", "7.1", "6 channels"); 2 if unknown."""
+    match = re.match(r"(\d+) channels", layout)
+    if match:
+        return int(match.group(1))
+    name = layout.split("(")[0]
+    if name in CHANNEL_LAYOUTS:
+        return CHANNEL_LAYOUTS[name]
+    match = re.fullmatch(r"(\d+)\.(\d+)", name)
+    if match:
+        return int(match.group(1)) + int(match.group(2))
+    return 2
+
+def probe_audio(input_path):
     """
-    Converts an MP3 file to an MP4 video with a black background.
-    Optimized for extremely fast processing (1 fps, low res).
+    Reads container, duration, codec, bitrate (bit/s), sample rate and channel count from
+    the ffmpeg banner. The bundled ffmpeg has no ffprobe, so we parse `ffmpeg -i` output instead.
     """
-    try:
-        # Load audio clip
-        audio = AudioFileClip(input_path)
-        
-        # Create a black background video clip with the same duration as audio
-        # Using 1 FPS drastically reduces encoding time for black-screen videos
-        video = ColorClip(size=resolution, color=(0, 0, 0)).with_duration(audio.duration)
-        video = video.with_audio(audio)
-        
-        # Write the resulting video to file
-        print(f"DEBUG: Starting ultra-fast write_videofile for {output_path}")
-        video.write_videofile(
-            output_path, 
-            fps=2, # 2 FPS is safer than 1 for many muxers
-            codec="libx264", 
-            audio_codec="aac",
-            audio_bitrate="128k", # Fixed bitrate for faster encoding
-            preset="ultrafast",
-            threads=1, 
-            ffmpeg_params=[
-                "-pix_fmt", "yuv420p", 
-                "-tune", "stillimage",
-                "-movflags", "+faststart", # Allow playing while downloading
-                "-shortest" # Ensure video ends with audio
-            ],
-            logger=logger,
-            bitrate="50k" # Extremely low video bitrate since it's just black
+    result = subprocess.run(
+        [get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-i", input_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace"
+    )
+    info = {"container": None, "duration": 0.0, "codec": None, "bitrate": None, "sample_rate": None, "channels": None}
+    # e.g. "Input #0, ogg, from 'voice.ogg':" (MP4 lists every name it goes by: "mov,mp4,m4a,...")
+    match = re.search(r"Input #0, ([\w,]+), from", result.stderr)
+    if match:
+        info["container"] = match.group(1).split(",")[0]
+    match = re.search(r"Duration: (\d+:\d+:\d+(?:\.\d+)?)", result.stderr)
+    if match:
+        info["duration"] = _parse_timestamp(match.group(1))
+    # Container bitrate; the stream's own bitrate below wins when ffmpeg reports one
+    match = re.search(r"Duration: .*?bitrate: (\d+) kb/s", result.stderr)
+    if match:
+        info["bitrate"] = int(match.group(1)) * 1000
+    # e.g. "Stream #0:0: Audio: mp3, 44100 Hz, stereo, fltp, 128 kb/s"
+    match = re.search(r"Stream #\S+.*?: Audio: (\w+)([^\n]*)", result.stderr)
+    if match:
+        info["codec"] = match.group(1)
+        details = match.group(2)
+        rate = re.search(r"(\d+) Hz", details)
+        if rate:
+            info["sample_rate"] = int(rate.group(1))
+        layout = re.search(r"Hz, ([^,]+)", details)
+        if layout:
+            info["channels"] = layout_channels(layout.group(1).strip())
+        stream_bitrate = re.search(r"(\d+) kb/s", details)
+        if stream_bitrate:
+            info["bitrate"] = int(stream_bitrate.group(1)) * 1000
+    return info
+
+def plan_encoding(info, copy_audio=None, threads=None):
+    """
+    Encoder settings for one input, from its probe_audio() info: whether the audio can
+    be stream-copied, the bitrate and channel count to transcode to, and ffmpeg threads.
+    """
+    if copy_audio is None:
+        copy_audio = COPY_AUDIO
+    copy_audio = bool(copy_audio and info["codec"] in COPY_AUDIO_CODECS)
+    bitrate = AUDIO_BITRATE
+    if info.get("bitrate"):
+        # Re-encoding a 64k podcast at 128k only makes the file bigger; round up to 16k steps
+        bitrate = min(AUDIO_BITRATE, max(32_000, -(-info["bitrate"] // 16_000) * 16_000))
+    channels = info.get("channels")
+    if threads and info["duration"] < 120:
+        # Short files finish before extra threads pay for themselves
+        threads = 1
+    return {
+        "copy_audio": copy_audio,
+        "audio_bitrate": f"{bitrate // 1000}k",
+        # Downmix surround, keep mono as mono
+        "channels": 2 if channels and channels > 2 else None,
+        "threads": threads,
+    }
+
+def predict_output_size(plan, info, duration):
+    """MP4 size in bytes for `duration` seconds of the input, encoded with a plan_encoding() plan."""
+    if plan["copy_audio"]:
+        audio_bitrate = info.get("bitrate") or AUDIO_BITRATE
+    else:
+        audio_bitrate = int(plan["audio_bitrate"].rstrip("k")) * 1000
+    return int(duration * (audio_bitrate + VIDEO_BITRATE) / 8 * (1 + CONTAINER_OVERHEAD) + CONTAINER_BYTES)
+
+def fit_plan(plan, info, duration, max_bytes=MAX_OUTPUT_BYTES):
+    """
+    The plan, changed as little as needed for the output to stay under `max_bytes`:
+    copied audio is transcoded, then the bitrate lowered down to MIN_AUDIO_BITRATE.
+    None when even that is too big and the file has to be split.
+    """
+    if not max_bytes or not duration or predict_output_size(plan, info, duration) <= max_bytes:
+        return plan
+    budget = ((max_bytes - CONTAINER_BYTES) / (1 + CONTAINER_OVERHEAD) * 8 / duration) - VIDEO_BITRATE
+    current = AUDIO_BITRATE if plan["copy_audio"] else int(plan["audio_bitrate"].rstrip("k")) * 1000
+    bitrate = min(current, int(budget // 16_000 * 16_000))
+    if bitrate < MIN_AUDIO_BITRATE:
+        return None
+    return dict(plan, copy_audio=False, audio_bitrate=f"{bitrate // 1000}k")
+
+def split_points(info, copy_audio=None, max_bytes=MAX_OUTPUT_BYTES, part_seconds=PART_MAX_SECONDS):
+    """
+    (start, length) of the equal parts a file is converted in: as few as keep each
+    part under `max_bytes` and `part_seconds`. A single part when the whole file fits.
+    """
+    duration = info["duration"]
+    if not duration:
+        return [(0.0, duration)]
+    parts = math.ceil(duration / part_seconds) if part_seconds else 1
+    plan = plan_encoding(info, copy_audio)
+    while fit_plan(plan, info, duration / parts, max_bytes) is None:
+        parts += 1
+    length = duration / parts
+    return [(index * length, length) for index in range(parts)]
+
+def get_still_segment(resolution=VIDEO_RESOLUTION, fps=VIDEO_FPS, image=None):
+    """
+    Path of a SEGMENT_SECONDS-long H.264 clip of a still frame (black, or `image`),
+    encoded on first use. Every frame is a keyframe so the looped clip can be cut at any frame.
+    """
+    width, height = resolution
+    params = " ".join(VIDEO_CODEC_ARGS)
+    source = "black"
+    if image:
+        with open(image, "rb") as f:
+            source = hashlib.sha1(f.read()).hexdigest()
+    digest = hashlib.sha1(f"{width}x{height}@{fps} {params} {source}".encode()).hexdigest()[:12]
+    path = os.path.join(SEGMENT_CACHE_DIR, f"{'still' if image else 'black'}_{width}x{height}_{fps}fps_{digest}.mp4")
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    os.makedirs(SEGMENT_CACHE_DIR, exist_ok=True)
+    # Several worker processes may race here; each writes its own file and the rename is atomic
+    tmp_path = f"{path}.{os.getpid()}.tmp.mp4"
+    if image:
+        source_args = ["-loop", "1", "-framerate", str(fps), "-i", image, "-vf", f"scale={width}:{height}"]
+    else:
+        source_args = ["-f", "lavfi", "-i", f"color=c=black:s={width}x{height}:r={fps}"]
+    cmd = [
+        get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-y", *source_args,
+        "-t", str(SEGMENT_SECONDS), *VIDEO_CODEC_ARGS, "-g", "1", "-r", str(fps),
+        "-an", tmp_path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(f"Could not build still segment: {result.stderr.strip()[-500:]}")
+    os.replace(tmp_path, path)
+    return path
+
+def get_ffprobe_exe():
+    """ffprobe next to the ffmpeg binary or on PATH, or None (imageio-ffmpeg ships without it)."""
+    ffmpeg = get_ffmpeg_exe()
+    sibling = os.path.join(os.path.dirname(ffmpeg), "ffprobe")
+    if os.path.dirname(ffmpeg) and os.path.exists(sibling):
+        return sibling
+    return shutil.which("ffprobe")
+
+def _stream_duration(path, stream):
+    """
+    Duration of one stream ("v" or "a") of a file. ffprobe reads it from the header;
+    without ffprobe the stream is remuxed to nowhere and the last timestamp taken.
+    """
+    ffprobe = get_ffprobe_exe()
+    if ffprobe:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-select_streams", f"{stream}:0",
+             "-show_entries", "stream=duration", "-of", "csv=p=0", path],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors="replace"
+        )
+        try:
+            return float(result.stdout.strip())
+        except ValueError:
+            pass
+    result = subprocess.run(
+        [get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-i", path, "-map", f"0:{stream}:0",
+         "-c", "copy", "-f", "null", "-progress", "pipe:1", "-nostats", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors="replace"
+    )
+    times = re.findall(r"^out_time_us=(\d+)$", result.stdout, re.M)
+    return int(times[-1]) / 1_000_000 if times else 0.0
+
+def validate_output(path, expected_duration, fps=VIDEO_FPS):
+    """
+    Checks that both tracks of a converted file match the source audio's length.
+    Raises RuntimeError when the audio is truncated or the video track is out of sync.
+    """
+    audio = _stream_duration(path, "a")
+    video = _stream_duration(path, "v")
+    # Stream copy can only cut the video on a frame boundary
+    tolerance = 1 / fps + 0.1
+    if abs(audio - expected_duration) > 0.5:
+        raise RuntimeError(f"Audio track is {audio:.2f}s, expected {expected_duration:.2f}s")
+    if abs(video - audio) > tolerance:
+        raise RuntimeError(f"Video track is {video:.2f}s but audio is {audio:.2f}s")
+    return {"audio": audio, "video": video}
+
+def _report(logger, **changes):
+    """Push progress into a proglog-style logger without going through its bar machinery."""
+    if hasattr(logger, "callback"):
+        logger.callback(**changes)
+
+def build_ffmpeg_command(input_path, output_path, resolution=VIDEO_RESOLUTION, fps=VIDEO_FPS, image=None, copy_audio=False, duration=None, fragmented=False, progress="pipe:1", video_segment=None, audio_bitrate="128k", channels=None, threads=None, extra_outputs=None, source_codec=None, start=None):
+    """
+    Builds one ffmpeg command that muxes a still video source with the input audio.
+    With `video_segment` the pre-encoded clip is looped and copied instead of encoding video.
+    With `fragmented=True` the output is a fragmented MP4 that can be written to a pipe;
+    without a `duration` too (streaming, where the input's length is unknown until it
+    ends), the black frames are drawn from the audio itself so the video ends with it.
+    `extra_outputs` ({format: path}, see core/formats.py) are written by the same
+    process from the same decoded audio. `start` skips into the audio, for one part of a file.
+    """
+    width, height = resolution
+    cmd = [get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-y"]
+    if fragmented and not duration:
+        # -shortest can't stop an endless video source in a fragmented MP4 (it overshoots
+        # by minutes), so a waveform blacked out by lutyuv gives a black frame per 1/fps of audio
+        cmd += [
+            "-i", input_path, "-filter_complex",
+            f"[0:a]showwaves=s={width}x{height}:mode=point:rate={fps},lutyuv=y=16:u=128:v=128,format=yuv420p[v]",
+            "-map", "[v]", "-map", "0:a"
+        ]
+        cmd += VIDEO_CODEC_ARGS + ["-g", str(max(int(fps * 2), 1))]
+    else:
+        if video_segment:
+            cmd += ["-stream_loop", "-1", "-i", video_segment]
+        elif image:
+            cmd += ["-loop", "1", "-framerate", str(fps), "-i", image]
+        else:
+            cmd += ["-f", "lavfi", "-i", f"color=c=black:s={width}x{height}:r={fps}"]
+        if start:
+            cmd += ["-ss", f"{start:.3f}"]
+        cmd += ["-i", input_path, "-map", "0:v:0", "-map", "1:a:0"]
+        if video_segment:
+            cmd += ["-c:v", "copy"]
+        else:
+            cmd += VIDEO_CODEC_ARGS + ["-vf", f"scale={width}:{height}", "-r", str(fps)]
+            if fragmented:
+                # Short GOPs so fragments (and upload parts) come out steadily
+                cmd += ["-g", str(max(int(fps * 2), 1))]
+    if copy_audio:
+        cmd += ["-c:a", "copy"]
+        if fragmented:
+            # Streamed AAC arrives as ADTS, which MP4 only takes repackaged (a no-op for MP4 input)
+            cmd += ["-bsf:a", "aac_adtstoasc"]
+    else:
+        cmd += ["-c:a", "aac", "-b:a", audio_bitrate]
+        if channels:
+            cmd += ["-ac", str(channels)]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    if duration:
+        # -shortest alone overshoots at low frame rates because of encoder buffering
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += ["-shortest"]
+    if fragmented:
+        cmd += ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-frag_duration", "2000000", "-f", "mp4"]
+    else:
+        cmd += ["-movflags", "+faststart"]
+    cmd += [
+        "-progress", progress,
+        "-nostats",
+        output_path
+    ]
+    for name, path in (extra_outputs or {}).items():
+        cmd += extra_output_args(
+            name, path, resolution, fps, codec=source_codec, copy_audio=copy_audio, audio_bitrate=audio_bitrate, channels=channels,
+            duration=duration, threads=threads, video_codec_args=VIDEO_CODEC_ARGS
         )
-        
-        # Close clips to release resources
-        audio.close()
-        video.close()
-        return True
-    except CancelledError:
-        # Propagate cancellation
+    return cmd
+
+def _convert_ffmpeg(input_path, output_path, logger, resolution, fps, image=None, copy_audio=None, threads=None, extra_outputs=None, start=None, length=None, max_bytes=None):
+    info = probe_audio(input_path)
+    if info["codec"] is None:
+        raise ValueError(f"No audio stream found in the file ({info['container'] or 'unknown format'}).")
+    duration = info["duration"]
+    if length:
+        duration = min(length, duration - (start or 0))
+    plan = fit_plan(plan_encoding(info, copy_audio, threads), info, duration, max_bytes)
+    if plan is None:
+        raise OutputTooLargeError(f"The video would be bigger than {max_bytes // (1024 * 1024)} MB even at a low bitrate.")
+    plan.update(start=start, extra_outputs=fit_outputs(extra_outputs or {}, duration), source_codec=info["codec"])
+    copy_audio = plan["copy_audio"]
+
+    if PREENCODED_VIDEO and duration:
+        try:
+            segment = get_still_segment(resolution, fps, image)
+            cmd = build_ffmpeg_command(input_path, output_path, resolution, fps, duration=duration, video_segment=segment, **plan)
+            _report(logger, message="Muxing pre-encoded video...")
+            _run_ffmpeg(cmd, logger, duration)
+            validate_output(output_path, duration, fps)
+            return True
+        except CancelledError:
+            raise
+        except Exception as e:
+            print(f"Pre-encoded segment path failed, encoding video instead: {e}")
+
+    cmd = build_ffmpeg_command(input_path, output_path, resolution, fps, image=image, duration=duration, **plan)
+    _report(logger, message="Encoding with FFmpeg...")
+    _run_ffmpeg(cmd, logger, duration)
+    return True
+
+def _run_ffmpeg(cmd, logger, duration):
+    """Runs an ffmpeg command, turning its -progress output into logger updates."""
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace")
+    try:
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            if key != "out_time_us":
+                continue
+            if value.isdigit() and duration > 0:
+                done = min(int(value) / 1_000_000, duration)
+                _report(logger, bars={"encode": {"index": int(done), "total": int(duration)}})
+            else:
+                # Still gives the logger a chance to raise on cancellation
+                _report(logger)
+        _, stderr = process.communicate()
+    except BaseException:
+        process.kill()
+        process.wait()
         raise
-    except Exception as e:
-        print(f"Error during conversion: {e}")
-        return False
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr.strip()[-500:]}")
+
+def _convert_moviepy(input_path, output_path, logger, resolution, fps, image=None, copy_audio=None, threads=None, extra_outputs=None, start=None, length=None, max_bytes=None):
+    # Fallback only: writes the MP4 and none of the extra formats, at a fixed bitrate
+    from moviepy import AudioFileClip, ColorClip, ImageClip
+
+    # Load audio clip
+    audio = AudioFileClip(input_path)
+    if length:
+        audio = audio.subclipped(start or 0, min((start or 0) + length, audio.duration))
+
+    # Create a black background video clip with the same duration as audio
+    # Using 1 FPS drastically reduces encoding time for black-screen videos
+    if image:
+        video = ImageClip(image).resized(new_size=resolution).with_duration(audio.duration)
+    else:
+        video = ColorClip(size=resolution, color=(0, 0, 0)).with_duration(audio.duration)
+    video = video.with_audio(audio)
+
+    # Write the resulting video to file
+    print(f"DEBUG: Starting ultra-fast write_videofile for {output_path}")
+    video.write_videofile(
+        output_path,
+        fps=2, # 2 FPS is safer than 1 for many muxers
+        codec="libx264",
+        audio_codec="aac",
+        audio_bitrate="128k", # Fixed bitrate for faster encoding
+        preset="ultrafast",
+        threads=threads or 1,
+        ffmpeg_params=[
+            "-pix_fmt", "yuv420p",
+            "-tune", "stillimage",
+            "-movflags", "+faststart", # Allow playing while downloading
+            "-shortest" # Ensure video ends with audio
+        ],
+        logger=logger,
+        bitrate="50k" # Extremely low video bitrate since it's just black
+    )
+
+    # Close clips to release resources
+    audio.close()
+    video.close()
+    return True
+
+BACKENDS = {
+    "ffmpeg": _convert_ffmpeg,
+    "moviepy": _convert_moviepy,
+}
+
+def warm_up():
+    """
+    Loads the conversion backend ahead of the first job: runs in each worker process at
+    startup, so the bot itself never imports numpy/Pillow (or MoviePy) and a user's
+    first conversion doesn't wait for them or for the black segment to be encoded.
+    """
+    import numpy, PIL.Image  # noqa: F401 (frames for the cover/waveform/image styles)
+    if CONVERTER_BACKEND == "moviepy":
+        import moviepy  # noqa: F401
+    elif PREENCODED_VIDEO:
+        get_still_segment()
+    return os.getpid()
+
+def convert_mp3_to_mp4(input_path, output_path, logger='bar', resolution=VIDEO_RESOLUTION, fps=VIDEO_FPS, backend=None, image=None, copy_audio=None, visual=None, threads=None, extra_outputs=None, start=None, length=None, max_bytes=None):
+    """
+    Converts an audio file (any format ffmpeg reads) to an MP4 video with a black
+    background (or a still image). `visual` ("cover" or "waveform") renders the still
+    frame from the audio itself, falling back to black when there is nothing to render.
+    The ffmpeg backend does it in one ffmpeg process, along with any `extra_outputs`;
+    MoviePy is kept as a fallback. `start`/`length` convert one part of the audio
+    (see split_points), and with `max_bytes` the settings are picked to stay under it.
+    """
+    if visual and not image:
+        from core.visuals import render_visual
+        try:
+            _report(logger, message="Rendering cover...")
+            image = render_visual(visual, input_path, resolution)
+        except Exception as e:
+            print(f"Could not render {visual} frame, using black: {e}")
+    backend = backend or CONVERTER_BACKEND
+    order = [backend] + [name for name in BACKENDS if name != backend]
+    for name in order:
+        try:
+            return BACKENDS[name](
+                input_path, output_path, logger, resolution, fps, image=image, copy_audio=copy_audio, threads=threads,
+                extra_outputs=extra_outputs, start=start, length=length, max_bytes=max_bytes
+            )
+        except (CancelledError, OutputTooLargeError):
+            # Propagate cancellation; another backend wouldn't make the video any smaller
+            raise
+        except Exception as e:
+            print(f"Error during conversion ({name}): {e}")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+    return False
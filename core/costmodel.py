@@ -0,0 +1,96 @@
+import os
+import time
+import socket
+from collections import deque
+
+# Timings are kept per host: a laptop and a 1-vCPU container encode at very different speeds
+COST_MODEL_HOST = os.getenv("COST_MODEL_HOST") or socket.gethostname()
+# Most recent samples per stage the fit uses, and how many it needs before trusting them
+COST_MODEL_SAMPLES = int(os.getenv("COST_MODEL_SAMPLES", "200"))
+COST_MODEL_MIN_SAMPLES = 5
+
+# stage -> (seconds of overhead, seconds per unit). Units are bytes for transfers and
+# seconds of audio for the encode stages. Used until a host has its own samples.
+PRIORS = {
+    "download": (1.0, 1 / 2e6),
+    "encode": (0.5, 1 / 1000),     # audio stream-copied, video pre-encoded
+    "transcode": (0.5, 1 / 80),    # audio re-encoded to AAC
+    "upload": (1.0, 1 / 1.5e6),
+}
+# A job's phases in order; "queued" (waiting for a worker) is estimated by the scheduler
+PHASES = ("download", "queued", "encode", "upload")
+
+class CostModel:
+    """
+    Predicts how long each stage of a job takes with a least-squares line
+    (seconds = overhead + per_unit * size) over the last samples of that stage.
+    """
+
+    def __init__(self, max_samples=COST_MODEL_SAMPLES):
+        self.samples = {stage: deque(maxlen=max_samples) for stage in PRIORS}
+        self._fits = {}
+
+    def add(self, stage, size, seconds):
+        if stage not in self.samples or size <= 0 or seconds < 0:
+            return
+        self.samples[stage].append((float(size), float(seconds)))
+        self._fits.pop(stage, None)
+
+    def fit(self, stage):
+        if stage in self._fits:
+            return self._fits[stage]
+        samples = self.samples[stage]
+        params = PRIORS[stage]
+        if len(samples) >= COST_MODEL_MIN_SAMPLES:
+            n = len(samples)
+            mean_x = sum(x for x, _ in samples) / n
+            mean_y = sum(y for _, y in samples) / n
+            var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+            if var_x > 0:
+                slope = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+                params = (mean_y - slope * mean_x, slope)
+            # All jobs the same size, or noise made bigger jobs look faster: a plain rate
+            if var_x == 0 or params[1] <= 0 or params[0] < 0:
+                params = (0.0, mean_y / mean_x)
+        self._fits[stage] = params
+        return params
+
+    def predict(self, stage, size):
+        overhead, per_unit = self.fit(stage)
+        return max(overhead + per_unit * max(size, 0), 0.0)
+
+    def stats(self):
+        return {stage: {"samples": len(self.samples[stage]), "fit": self.fit(stage)} for stage in PRIORS}
+
+cost_model = CostModel()
+
+class JobEstimate:
+    """
+    Remaining time for one job across its phases (download, encode, upload). The
+    current phase blends the model's prediction with the rate observed so far,
+    trusting the observation more the further the phase has got.
+    """
+
+    def __init__(self, download=0.0, encode=0.0, upload=0.0):
+        self.predicted = {"download": download, "queued": 0.0, "encode": encode, "upload": upload}
+        self.phase = None
+        self.phase_started = time.monotonic()
+
+    def start(self, phase):
+        if phase != self.phase:
+            self.phase = phase
+            self.phase_started = time.monotonic()
+
+    def remaining(self, fraction=0.0):
+        """Seconds until the job is done, given how far (0..1) the current phase is."""
+        if self.phase is None:
+            return sum(self.predicted.values())
+        fraction = min(max(fraction, 0.0), 1.0)
+        elapsed = time.monotonic() - self.phase_started
+        predicted = self.predicted[self.phase]
+        left = max(predicted * (1 - fraction), predicted - elapsed, 0.0)
+        if fraction > 0:
+            observed = elapsed * (1 - fraction) / fraction
+            left = fraction * observed + (1 - fraction) * left
+        later = PHASES[PHASES.index(self.phase) + 1:]
+        return left + sum(self.predicted[phase] for phase in later)
@@ -0,0 +1,80 @@
+import os
+
+# Outputs a job can produce besides the MP4: name -> (file suffix, description).
+# They are extra outputs of the MP4's own ffmpeg run, so the audio is decoded only once.
+EXTRA_FORMATS = {
+    "round": (".round.mp4", "Round video message"),
+    "webm": (".webm", "WebM (VP9/Opus)"),
+}
+# Telegram only accepts square video messages of up to a minute
+ROUND_VIDEO_SIZE = 240
+ROUND_VIDEO_MAX_SECONDS = 60
+# VP9 at realtime speed: a still frame costs next to nothing
+WEBM_VIDEO_ARGS = ["-c:v", "libvpx-vp9", "-b:v", "50k", "-deadline", "realtime", "-cpu-used", "8", "-row-mt", "1"]
+# Audio codecs WebM can take as they are; the rest go to Opus at a faster-than-default effort
+WEBM_COPY_CODECS = {"opus", "vorbis"}
+OPUS_ARGS = ["-c:a", "libopus", "-compression_level", "5"]
+
+# Download names by MIME type, for when Telegram's file name has no usable extension
+INPUT_EXTENSIONS = {
+    "audio/mpeg": ".mp3", "audio/mp3": ".mp3",
+    "audio/flac": ".flac", "audio/x-flac": ".flac",
+    "audio/ogg": ".ogg", "audio/opus": ".opus", "audio/webm": ".webm",
+    "audio/wav": ".wav", "audio/x-wav": ".wav", "audio/vnd.wave": ".wav",
+    "audio/mp4": ".m4a", "audio/m4a": ".m4a", "audio/x-m4a": ".m4a",
+    "audio/aac": ".aac", "audio/x-aac": ".aac",
+}
+# MP4/M4A may keep its index at the end of the file, so ffmpeg can't read it from a pipe
+UNSTREAMABLE_MIME_TYPES = {"audio/mp4", "audio/m4a", "audio/x-m4a"}
+
+def input_extension(mime_type, file_name=None):
+    """Extension for a downloaded audio file: the sender's, else one for its MIME type."""
+    ext = os.path.splitext(file_name or "")[1].lower()
+    if 1 < len(ext) <= 5 and ext[1:].isalnum():
+        return ext
+    return INPUT_EXTENSIONS.get((mime_type or "").lower(), ".audio")
+
+def is_streamable(mime_type):
+    return (mime_type or "").lower() not in UNSTREAMABLE_MIME_TYPES
+
+def parse_formats(value):
+    """Extra formats from a stored "mp4,round,webm" setting, in EXTRA_FORMATS order."""
+    names = {name.strip() for name in (value or "").split(",")}
+    return tuple(name for name in EXTRA_FORMATS if name in names)
+
+def format_paths(stem, formats):
+    """Output path of each extra format, next to the MP4 and named after the same stem."""
+    return {name: f"{stem}{EXTRA_FORMATS[name][0]}" for name in formats}
+
+def fit_outputs(outputs, duration):
+    """Drops the formats that can't hold `duration` seconds: no round video over a minute."""
+    return {name: path for name, path in outputs.items() if name != "round" or duration <= ROUND_VIDEO_MAX_SECONDS}
+
+def extra_output_args(name, path, resolution, fps, codec=None, copy_audio=False, audio_bitrate="128k", channels=None, duration=None, threads=None, video_codec_args=()):
+    """
+    ffmpeg output options for one extra format, appended after the MP4's output. Input 0
+    is the still video (re-encoded here even when the MP4 copies it), input 1 the audio,
+    which ffmpeg decodes once for every output that encodes it.
+    """
+    width, height = resolution
+    args = ["-map", "0:v:0", "-map", "1:a:0"]
+    if name == "round":
+        size = ROUND_VIDEO_SIZE
+        args += ["-vf", f"scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size},setsar=1", "-r", str(fps)]
+        args += list(video_codec_args) + (["-c:a", "copy"] if copy_audio else ["-c:a", "aac", "-b:a", audio_bitrate])
+        duration = min(duration, ROUND_VIDEO_MAX_SECONDS) if duration else ROUND_VIDEO_MAX_SECONDS
+    elif name == "webm":
+        args += ["-vf", f"scale={width}:{height}", "-r", str(fps)] + WEBM_VIDEO_ARGS
+        args += ["-c:a", "copy"] if codec in WEBM_COPY_CODECS else OPUS_ARGS + ["-b:a", audio_bitrate]
+    else:
+        raise ValueError(f"Unknown output format: {name}")
+    if channels and args[-2:] != ["-c:a", "copy"]:
+        args += ["-ac", str(channels)]
+    if threads:
+        args += ["-threads", str(threads)]
+    if duration:
+        args += ["-t", f"{duration:.3f}"]
+    args += ["-shortest"]
+    if name == "round":
+        args += ["-movflags", "+faststart"]
+    return args + [path]
@@ -0,0 +1,98 @@
+import asyncio
+import contextlib
+import functools
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Buckets cover anything from a cached re-send to a multi-hour podcast
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+JOB_STAGE_SECONDS = Histogram(
+    "bot_job_stage_seconds", "Wall time spent in each stage of a conversion job",
+    ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_THROUGHPUT = Histogram(
+    "bot_stage_throughput_bytes_per_second", "Bytes per second moved by each stage",
+    ["stage"], buckets=(64e3, 256e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6, 100e6)
+)
+ENCODE_REALTIME_FACTOR = Histogram(
+    "bot_encode_realtime_factor", "Seconds of audio encoded per wall-clock second",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+)
+JOBS_ACTIVE = Gauge("bot_jobs_active", "Conversions currently holding a worker slot")
+JOBS_QUEUED = Gauge("bot_jobs_queued", "Conversions waiting for a worker slot")
+DB_QUERY_SECONDS = Histogram(
+    "bot_db_query_seconds", "Latency of database helper calls",
+    ["function"], buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+TELEGRAM_EDITS = Counter("bot_telegram_edits_total", "Progress message edits sent to Telegram", ["result"])
+FLOOD_WAITS = Counter("bot_flood_waits_total", "FloodWait errors received from Telegram", ["source"])
+RATE_LIMITED = Counter("bot_rate_limited_total", "Conversions refused by a rate limit or the daily quota", ["limit"])
+FLOOD_WAIT_SECONDS = Counter("bot_flood_wait_seconds_total", "Seconds Telegram asked us to wait", ["source"])
+EVENT_LOOP_LAG = Histogram(
+    "bot_event_loop_lag_seconds", "How late the event loop woke up a periodic timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+LOOP_STALLS = Counter("bot_event_loop_stalls_total", "Times something blocked the event loop for longer than LOOP_STALL_MS")
+STARTUP_PHASE_SECONDS = Gauge("bot_startup_phase_seconds", "Time each startup phase took", ["phase"])
+
+# phase -> seconds, in the order the phases finished (reported on /status)
+startup_phases = {}
+
+def observe_stage(stage, seconds, nbytes=None):
+    JOB_STAGE_SECONDS.labels(stage).observe(seconds)
+    if nbytes and seconds > 0:
+        STAGE_THROUGHPUT.labels(stage).observe(nbytes / seconds)
+
+def observe_flood_wait(source, seconds):
+    FLOOD_WAITS.labels(source).inc()
+    FLOOD_WAIT_SECONDS.labels(source).inc(seconds)
+
+def timed_db(func):
+    """Decorator recording the latency of a blocking DB helper."""
+    histogram = DB_QUERY_SECONDS.labels(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+def register_scheduler(scheduler):
+    """Expose the scheduler's live counts as gauges (read at scrape time)."""
+    JOBS_ACTIVE.set_function(lambda: scheduler.running)
+    JOBS_QUEUED.set_function(lambda: scheduler.queued)
+
+async def monitor_event_loop(interval=0.5):
+    """Samples event-loop lag: how much later than requested a sleep returns."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(time.perf_counter() - start - interval, 0))
+
+def record_startup_phase(phase, seconds):
+    startup_phases[phase] = round(seconds, 3)
+    STARTUP_PHASE_SECONDS.labels(phase).set(seconds)
+    print(f"Startup: {phase} took {seconds:.2f}s")
+
+@contextlib.contextmanager
+def startup_phase(phase):
+    """Times the block as one phase of startup."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(phase, time.perf_counter() - start)
+
+async def timed_startup(phase, awaitable):
+    """Awaits one of the startup steps that run concurrently, timing it on its own."""
+    with startup_phase(phase):
+        return await awaitable
+
+def render_metrics():
+    """Returns (body, content_type) in the Prometheus text format."""
+    return generate_latest(), CONTENT_TYPE_LATEST
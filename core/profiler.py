@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import threading
+import traceback
+from collections import Counter
+
+from core.metrics import LOOP_STALLS
+
+# Log the event loop's stack when it hasn't run a callback for this long
+LOOP_STALL_MS = int(os.getenv("LOOP_STALL_MS", "250"))
+# /profile: longest run an admin may ask for, and the time between two samples
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Innermost frames in these files are threads waiting for work (or the loop for I/O), not using CPU
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py", "thread.py")
+
+class LoopWatchdog:
+    """
+    Notices when something blocks the event loop. The loop bumps a heartbeat every
+    `threshold / 4`; a thread of our own checks it and, once it is `threshold` late,
+    prints the loop thread's stack, i.e. the code that is blocking it right now.
+    """
+
+    def __init__(self, threshold_ms=LOOP_STALL_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = self.threshold / 4
+        self.loop = None
+        self.thread_id = None
+        self.last_beat = 0.0
+        self.reported = None
+
+    def start(self, loop):
+        """Call from the loop's thread, once the loop runs for good (startup blocks it on purpose)."""
+        if self.threshold <= 0:
+            return
+        self.loop = loop
+        self.thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        loop.call_soon(self._beat)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def _beat(self):
+        now = time.perf_counter()
+        if self.reported == self.last_beat:
+            print(f"Event loop unblocked after {(now - self.last_beat - self.interval) * 1000:.0f} ms")
+        self.last_beat = now
+        self.loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            beat = self.last_beat
+            # Between run_until_complete calls nothing is supposed to run on the loop
+            if not self.loop.is_running() or beat == self.reported:
+                continue
+            late = time.perf_counter() - beat - self.interval
+            if late < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.reported = beat
+            LOOP_STALLS.inc()
+            stack = "".join(traceback.format_stack(frame))
+            print(f"Event loop blocked for {late * 1000:.0f} ms, currently at:\n{stack}", end="")
+
+def _frame_name(code):
+    path = os.path.relpath(code.co_filename)
+    if path.startswith(".."):
+        # Libraries: "telethon/client.py" is enough to tell them apart
+        path = os.path.join(*code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL_MS / 1000):
+    """
+    Samples the stack of every thread of this process but the watchdog's (the
+    conversion worker processes are not included) for `seconds`. Returns a Counter
+    of stacks, each a tuple from the thread's name down to the innermost frame.
+    """
+    me = threading.get_ident()
+    counts = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me or names.get(ident) == "loop-watchdog":
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+def folded(counts):
+    """Stacks in the "a;b;c count" format flamegraph.pl, speedscope and inferno read."""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in counts.most_common())
+
+def hottest(counts, n=5):
+    """(frame, share of busy samples) of the innermost frames seen most, idle waits left out."""
+    leaves = Counter()
+    for stack, count in counts.items():
+        if not os.path.basename(stack[-1]).startswith(IDLE_FILES):
+            leaves[stack[-1]] += count
+    total = sum(leaves.values()) or 1
+    return [(frame, count / total) for frame, count in leaves.most_common(n)]
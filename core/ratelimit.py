@@ -0,0 +1,160 @@
+import os
+import asyncio
+import time
+from collections import deque
+
+from core.metrics import RATE_LIMITED
+
+# Conversions one user may start per RATE_LIMIT_WINDOW seconds (0 = no limit)
+RATE_LIMIT_JOBS = int(os.getenv("RATE_LIMIT_JOBS", "10"))
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "600"))
+# Conversions all users together may start per minute, and how many may arrive at once (0 = no limit)
+GLOBAL_JOBS_PER_MINUTE = int(os.getenv("GLOBAL_JOBS_PER_MINUTE", "60"))
+GLOBAL_JOBS_BURST = int(os.getenv("GLOBAL_JOBS_BURST", "20"))
+# Input megabytes and audio minutes one user may convert per day, kept in Postgres (0 = no limit)
+DAILY_QUOTA_MB = int(os.getenv("DAILY_QUOTA_MB", "2048"))
+DAILY_QUOTA_MINUTES = int(os.getenv("DAILY_QUOTA_MINUTES", "600"))
+# Users besides the owner who skip the limits and go to the front of the conversion queue
+VIP_USER_IDS = {int(user_id) for user_id in os.getenv("VIP_USER_IDS", "").replace(",", " ").split()}
+VIP_PRIORITY = 1
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, bursting up to `capacity`.
+    `pause()` stops all consumers until a deadline, e.g. after a FloodWait.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` without waiting. Returns 0 if it did, else the seconds until it could."""
+        # More than a full bucket would never fit; let it through once the bucket is full
+        tokens = min(tokens, self.capacity)
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def refund(self, tokens=1):
+        """Puts back tokens taken for work that didn't happen after all."""
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+class SlidingWindow:
+    """At most `limit` events per key in any `window` seconds."""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.events = {}  # key -> deque of event times
+
+    def retry_after(self, key, count=1):
+        """Seconds until `count` more events fit for `key` (0 if they fit now)."""
+        # More than `limit` at once (a big batch) would never fit; it has to wait for an empty window
+        count = min(count, self.limit)
+        events = self.events.get(key)
+        if not events:
+            return 0.0
+        now = time.monotonic()
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self.events[key]
+            return 0.0
+        excess = len(events) + count - self.limit
+        return 0.0 if excess <= 0 else events[excess - 1] + self.window - now
+
+    def hit(self, key, count=1):
+        events = self.events.setdefault(key, deque())
+        events.extend([time.monotonic()] * count)
+
+    def unhit(self, key, count=1):
+        """Forgets the `count` most recent events of `key`."""
+        events = self.events.get(key)
+        for _ in range(min(count, len(events or ()))):
+            events.pop()
+        if not events:
+            self.events.pop(key, None)
+
+class UserLimits:
+    """
+    In-memory limits on how often conversions may start: a sliding window per user
+    and a token bucket shared by everybody, so a burst (say, broadcast recipients all
+    replying at once) is spread out. VIPs skip both and get queue priority.
+    """
+
+    def __init__(self, vip_ids=()):
+        self.vip_ids = set(vip_ids) | VIP_USER_IDS
+        self.per_user = SlidingWindow(RATE_LIMIT_JOBS, RATE_LIMIT_WINDOW) if RATE_LIMIT_JOBS else None
+        self.shared = TokenBucket(GLOBAL_JOBS_PER_MINUTE / 60, GLOBAL_JOBS_BURST) if GLOBAL_JOBS_PER_MINUTE else None
+
+    def is_vip(self, user_id):
+        return user_id in self.vip_ids
+
+    def priority(self, user_id):
+        return VIP_PRIORITY if self.is_vip(user_id) else 0
+
+    def check(self, user_id, count=1):
+        """
+        Takes `count` conversions from the user's and the shared limit. Returns None
+        if they may start now, else ("user" or "global", seconds until they could).
+        """
+        if self.is_vip(user_id):
+            return None
+        if self.per_user:
+            wait = self.per_user.retry_after(user_id, count)
+            if wait > 0:
+                RATE_LIMITED.labels("user").inc()
+                return "user", wait
+        if self.shared:
+            wait = self.shared.try_acquire(count)
+            if wait > 0:
+                RATE_LIMITED.labels("global").inc()
+                return "global", wait
+        if self.per_user:
+            self.per_user.hit(user_id, count)
+        return None
+
+    def refund(self, user_id, count=1):
+        """Gives back what check() took for conversions that were refused or failed later on."""
+        if self.is_vip(user_id):
+            return
+        if self.per_user:
+            self.per_user.unhit(user_id, count)
+        if self.shared:
+            self.shared.refund(count)
+
+    def prune(self):
+        """Forgets users whose window has emptied."""
+        if self.per_user:
+            for user_id in list(self.per_user.events):
+                self.per_user.retry_after(user_id)
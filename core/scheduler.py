@@ -0,0 +1,241 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from core.converter import CancelledError
+
+# Pick the waiting job with the best (wait + cost) / cost ratio instead of plain round-robin
+SHORTEST_JOB_FIRST = os.getenv("SHORTEST_JOB_FIRST", "1") == "1"
+# Predicted seconds assumed for a job queued without a cost
+DEFAULT_JOB_COST = 30.0
+
+class QueueFullError(Exception):
+    """Raised when the conversion queue cannot take any more jobs."""
+    pass
+
+def _run_in_worker(fn, args, kwargs, logger_factory, progress, cancel_event):
+    """Entry point inside the worker process: rebuild the logger around the shared proxies."""
+    if logger_factory is not None:
+        kwargs = dict(kwargs, logger=logger_factory(progress, cancel_event))
+    return fn(*args, **kwargs)
+
+class _Job:
+    def __init__(self, user_id, on_position, cost=None, priority=0):
+        self.user_id = user_id
+        self.on_position = on_position
+        self.priority = priority
+        self.cost = max(cost or DEFAULT_JOB_COST, 0.1)
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.position = None
+        self.ready = asyncio.get_running_loop().create_future()
+
+    def response_ratio(self, now):
+        """Grows with waiting, fastest for short jobs, so a long job can't be passed over forever."""
+        return (now - self.queued_at + self.cost) / self.cost
+
+class ConversionScheduler:
+    """
+    Runs conversions on a fixed pool of worker processes.
+    Waiting jobs sit in a bounded queue. Only each user's oldest job competes for a free
+    worker, so one user with several files can't starve everybody else; among those,
+    the shortest predicted job goes first (highest response ratio), or plain
+    round-robin with SHORTEST_JOB_FIRST=0. Higher-priority jobs (VIPs) go before
+    all of them.
+    """
+
+    def __init__(self, workers=None, max_queue=20):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._queues = OrderedDict()
+        self._running = 0
+        self._active = set()
+        self._pool = None
+        self._manager = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def is_full(self):
+        return self._running >= self.workers and self.queued >= self.max_queue
+
+    def _get_pool(self):
+        # warm_up may be creating it on another thread while the first job arrives
+        with self._pool_lock:
+            if self._pool is None:
+                # fork keeps workers from re-importing main.py (and restarting the client)
+                context = multiprocessing.get_context("fork")
+                self._manager = context.Manager()
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._pool
+
+    def warm_up(self, fn, timeout=60):
+        """
+        Starts the worker processes now instead of on the first job and runs `fn`
+        (e.g. loading the converter backend) in them. Blocking; returns how many ran it.
+        """
+        pool = self._get_pool()
+        futures = [pool.submit(fn) for _ in range(self.workers)]
+        done, _ = wait(futures, timeout=timeout)
+        return sum(1 for future in done if future.exception() is None)
+
+    @property
+    def threads_per_job(self):
+        """ffmpeg threads a conversion may use without oversubscribing the CPUs."""
+        return max((os.cpu_count() or 1) // self.workers, 1)
+
+    @staticmethod
+    def _pick(queues, now):
+        """The user whose next job runs first. Ties keep round-robin order."""
+        top = max(queue[0].priority for queue in queues.values())
+        candidates = [user_id for user_id, queue in queues.items() if queue[0].priority == top]
+        if not SHORTEST_JOB_FIRST:
+            return candidates[0]
+        return max(candidates, key=lambda user_id: queues[user_id][0].response_ratio(now))
+
+    @staticmethod
+    def _take(queues, user_id):
+        queue = queues.pop(user_id)
+        job = queue.popleft()
+        if queue:
+            # Back of the line until every other user has had a turn
+            queues[user_id] = queue
+        return job
+
+    def _order(self):
+        """Waiting jobs in the order they will be dispatched, if nothing else arrives."""
+        queues = OrderedDict((user_id, deque(queue)) for user_id, queue in self._queues.items())
+        now = time.monotonic()
+        order = []
+        while queues:
+            order.append(self._take(queues, self._pick(queues, now)))
+        return order
+
+    def estimated_wait(self, position):
+        """Seconds until the job at `position` (1-based) gets a worker, from predicted costs."""
+        now = time.monotonic()
+        busy = sum(max(job.cost - (now - job.started_at), 0) for job in self._active)
+        ahead = sum(job.cost for job in self._order()[:max(position - 1, 0)])
+        if self._running < self.workers and position <= 1:
+            return 0.0
+        return (busy + ahead) / self.workers
+
+    async def _notify(self, job, position):
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            print(f"Queue position update failed: {e}")
+
+    def _notify_positions(self):
+        for position, job in enumerate(self._order(), start=1):
+            if job.position != position:
+                job.position = position
+                if job.on_position:
+                    asyncio.create_task(self._notify(job, position))
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._running < self.workers and self._queues:
+            job = self._take(self._queues, self._pick(self._queues, now))
+            self._running += 1
+            job.started_at = now
+            self._active.add(job)
+            job.ready.set_result(None)
+        self._notify_positions()
+
+    def _discard(self, job):
+        queue = self._queues.get(job.user_id)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.user_id]
+            self._notify_positions()
+
+    def _release(self, job):
+        self._running -= 1
+        self._active.discard(job)
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id, on_position=None, cost=None, priority=0):
+        """
+        Waits in the fair queue for a free worker slot and holds it for the block.
+        `cost` is the predicted seconds the job will hold the slot.
+        """
+        if self._running >= self.workers and self.queued >= self.max_queue:
+            raise QueueFullError("Conversion queue is full.")
+        job = _Job(user_id, on_position, cost, priority)
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._dispatch()
+        try:
+            await job.ready
+        except asyncio.CancelledError:
+            if job.ready.done() and not job.ready.cancelled() and job.ready.exception() is None:
+                self._release(job)
+            else:
+                self._discard(job)
+            raise
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    def cancel(self, user_id):
+        """Drops every job this user still has waiting in the queue."""
+        queue = self._queues.pop(user_id, None)
+        if not queue:
+            return 0
+        for job in queue:
+            job.ready.set_exception(CancelledError("Task cancelled while queued."))
+        self._notify_positions()
+        return len(queue)
+
+    async def _mirror(self, progress, shared_progress, cancel_event, shared_cancel):
+        """
+        Copies worker progress back into the caller's dict and forwards cancellation.
+        Every proxy call is a round trip to the Manager process, so they run off the loop.
+        """
+        forwarded = False
+        while True:
+            if not forwarded and cancel_event is not None and cancel_event.is_set():
+                await asyncio.to_thread(shared_cancel.set)
+                forwarded = True
+            if progress is not None:
+                progress.update(await asyncio.to_thread(shared_progress.copy))
+            await asyncio.sleep(1)
+
+    async def execute(self, fn, *args, cancel_event=None, progress=None, logger_factory=None, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` in a worker process; the caller must hold a slot.
+        `logger_factory(progress, cancel_event)` is called inside the worker with
+        process-shared proxies; `progress` is kept in sync from them.
+        """
+        pool = self._get_pool()
+        shared_progress = await asyncio.to_thread(self._manager.dict, progress or {})
+        shared_cancel = await asyncio.to_thread(self._manager.Event)
+        mirror = asyncio.create_task(self._mirror(progress, shared_progress, cancel_event, shared_cancel))
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                pool, _run_in_worker, fn, args, kwargs, logger_factory, shared_progress, shared_cancel
+            )
+        finally:
+            mirror.cancel()
+            if progress is not None:
+                progress.update(await asyncio.to_thread(shared_progress.copy))
+
+    async def run(self, user_id, fn, *args, on_position=None, cost=None, priority=0, **kwargs):
+        """Queues a job, then executes it once a worker slot frees up."""
+        async with self.slot(user_id, on_position, cost, priority):
+            return await self.execute(fn, *args, **kwargs)
@@ -0,0 +1,195 @@
+import os
+import io
+import hashlib
+import subprocess
+
+from core.converter import get_ffmpeg_exe
+
+# numpy and Pillow are imported by the functions that draw, so that importing this module
+# (the bot does at startup) stays cheap; only conversion workers end up loading them
+
+# Rendered still frames, named by a hash of what they were rendered from
+FRAME_CACHE_DIR = os.getenv("FRAME_CACHE_DIR", "frames")
+# Rendered frames and still segments kept on disk per directory; least recently used go first
+FRAME_CACHE_MAX_FILES = int(os.getenv("FRAME_CACHE_MAX_FILES", "500"))
+# The waveform only needs the envelope, so decode at a low sample rate
+WAVEFORM_SAMPLE_RATE = 4000
+# Decoded audio is reduced as it arrives, this many bytes at a time; the peaks kept per
+# pixel column are merged pairwise whenever they grow past it, whatever the duration
+WAVEFORM_CHUNK_BYTES = 64 * 1024
+WAVEFORM_BLOCKS_PER_COLUMN = 64
+WAVEFORM_COLOR = (255, 255, 255)
+
+def _frame_path(kind, digest):
+    return os.path.join(FRAME_CACHE_DIR, f"{kind}_{digest}.png")
+
+def cache_hit(path):
+    """True if a cached file exists; bumps its mtime so prune_cache keeps it."""
+    if not os.path.exists(path):
+        return False
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return True
+
+def _save_frame(image, path):
+    os.makedirs(FRAME_CACHE_DIR, exist_ok=True)
+    # Other worker processes may render the same frame; the rename is atomic
+    tmp_path = f"{path}.{os.getpid()}.tmp.png"
+    image.save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+    return path
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def photo_frame_path(photo_id, resolution):
+    """Cache path for a Telegram photo, so a repeat cover is found before downloading it."""
+    width, height = resolution
+    return _frame_path("photo", f"{photo_id}_{width}x{height}")
+
+def frame_from_image_bytes(data, resolution, path=None):
+    """Letterboxes an image onto a black frame of `resolution`. Cached by content hash (or `path`)."""
+    width, height = resolution
+    if path is None:
+        path = _frame_path("image", hashlib.sha1(data + f"{width}x{height}".encode()).hexdigest())
+    if cache_hit(path):
+        return path
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source).convert("RGB")
+        fitted = ImageOps.contain(source, (width, height))
+    frame = Image.new("RGB", (width, height))
+    frame.paste(fitted, ((width - fitted.width) // 2, (height - fitted.height) // 2))
+    return _save_frame(frame, path)
+
+def extract_cover(input_path):
+    """Returns the embedded album art (ID3 APIC etc.) as PNG bytes, or None."""
+    result = subprocess.run(
+        [get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-loglevel", "error", "-i", input_path,
+         "-map", "0:v:0", "-frames:v", "1", "-c:v", "png", "-f", "image2pipe", "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
+
+def cover_frame(input_path, resolution):
+    data = extract_cover(input_path)
+    return frame_from_image_bytes(data, resolution) if data else None
+
+def compute_peaks(samples, columns):
+    """Peak amplitude (0..1) of each of `columns` equal slices of `samples`, in one pass."""
+    import numpy as np
+    if len(samples) == 0:
+        return np.zeros(columns)
+    # Proportional slice starts, so the columns don't drift when `columns` doesn't divide the length
+    starts = np.arange(columns) * len(samples) // columns
+    peaks = np.maximum.reduceat(np.abs(samples.astype(np.float32)), starts)
+    top = peaks.max()
+    return peaks / top if top > 0 else peaks
+
+def stream_envelope(stream, limit, chunk_bytes=WAVEFORM_CHUNK_BYTES):
+    """
+    Peak amplitudes of equal runs of the s16le samples read from `stream`, at most
+    `limit` of them: when there are more, neighbours are merged and runs get twice as long.
+    Memory stays bounded by `limit` and `chunk_bytes` however long the audio is.
+    """
+    import numpy as np
+    block = 1
+    peaks = np.zeros(0, dtype=np.float32)
+    # The run still being filled: its peak and how many samples it has
+    partial, partial_count = 0.0, 0
+    leftover = b""
+    while True:
+        data = stream.read(chunk_bytes)
+        if not data:
+            break
+        data = leftover + data
+        usable = len(data) - len(data) % 2
+        leftover = data[usable:]
+        samples = np.abs(np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32))
+        if partial_count:
+            head = samples[:block - partial_count]
+            samples = samples[len(head):]
+            partial = max(partial, float(head.max())) if len(head) else partial
+            partial_count += len(head)
+            if partial_count < block:
+                continue
+            peaks = np.append(peaks, partial)
+            partial, partial_count = 0.0, 0
+        whole = len(samples) - len(samples) % block
+        peaks = np.concatenate((peaks, samples[:whole].reshape(-1, block).max(axis=1)))
+        if whole < len(samples):
+            partial, partial_count = float(samples[whole:].max()), len(samples) - whole
+        while len(peaks) > limit:
+            if len(peaks) % 2:
+                # Its samples become the start of the next, longer run
+                partial, partial_count = max(partial, float(peaks[-1])), partial_count + block
+                peaks = peaks[:-1]
+            peaks = peaks.reshape(-1, 2).max(axis=1)
+            block *= 2
+    if partial_count:
+        peaks = np.append(peaks, partial)
+    return peaks
+
+def render_waveform(peaks, resolution, color=WAVEFORM_COLOR):
+    """Draws mirrored bars for `peaks` (one per pixel column) on a black frame."""
+    import numpy as np
+    from PIL import Image
+    width, height = resolution
+    middle = height // 2
+    amplitude = np.maximum(peaks * height * 0.4, 1).astype(np.int32)
+    rows = np.abs(np.arange(height) - middle)[:, None]
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[rows <= amplitude[None, :]] = color
+    return Image.fromarray(pixels)
+
+def waveform_frame(input_path, resolution):
+    """Static waveform of the whole file, cached by a hash of the audio."""
+    width, height = resolution
+    path = _frame_path("waveform", f"{_file_digest(input_path)}_{width}x{height}")
+    if cache_hit(path):
+        return path
+    process = subprocess.Popen(
+        [get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-loglevel", "error", "-i", input_path,
+         "-vn", "-ac", "1", "-ar", str(WAVEFORM_SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        envelope = stream_envelope(process.stdout, width * WAVEFORM_BLOCKS_PER_COLUMN)
+    finally:
+        process.stdout.close()
+        process.wait()
+    if process.returncode != 0:
+        return None
+    return _save_frame(render_waveform(compute_peaks(envelope, width), resolution), path)
+
+def render_visual(visual, input_path, resolution):
+    """Still frame for a visual mode ("cover" or "waveform"), or None to fall back to black."""
+    if visual == "cover":
+        return cover_frame(input_path, resolution)
+    if visual == "waveform":
+        return waveform_frame(input_path, resolution)
+    return None
+
+def prune_cache(directory, max_files):
+    """Deletes the least recently used files once a cache directory holds more than `max_files`."""
+    if not os.path.isdir(directory):
+        return 0
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+    paths = [path for path in paths if os.path.isfile(path)]
+    if len(paths) <= max_files:
+        return 0
+    paths.sort(key=lambda path: os.stat(path).st_mtime)
+    for path in paths[:len(paths) - max_files]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return len(paths) - max_files
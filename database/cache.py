@@ -0,0 +1,74 @@
+import os
+from collections import OrderedDict
+
+from database.manager import get_cached_media, save_cached_media, delete_cached_media, evict_cached_media, run_db, write_behind
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_TTL_HOURS = int(os.getenv("CACHE_TTL_HOURS", "720"))
+# Hot entries kept in process so repeat forwards skip the DB round-trip too
+CACHE_MEMORY_ENTRIES = int(os.getenv("CACHE_MEMORY_ENTRIES", "512"))
+
+class ConversionCache:
+    """
+    Maps a source audio document (plus render settings) to the MP4 we already uploaded,
+    so a forwarded file can be answered by re-sending the existing Telegram media.
+    Postgres holds the index; a small in-memory LRU sits in front of it.
+    """
+
+    def __init__(self, memory_entries=CACHE_MEMORY_ENTRIES):
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(document_id, resolution, fps, variant="black"):
+        width, height = resolution
+        return f"{document_id}:{width}x{height}@{fps}:{variant}"
+
+    def _remember(self, key, media):
+        self._memory[key] = media
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key):
+        """Returns (media_id, access_hash, file_reference) or None."""
+        media = self._memory.get(key)
+        if media is None:
+            try:
+                media = await run_db(get_cached_media, key)
+            except Exception as e:
+                print(f"Cache lookup error: {e}")
+                media = None
+        if media is None:
+            self.misses += 1
+            return None
+        self._remember(key, media)
+        self.hits += 1
+        return media
+
+    def put(self, key, media_id, access_hash, file_reference):
+        media = (media_id, access_hash, file_reference)
+        self._remember(key, media)
+        write_behind(save_cached_media, key, *media)
+
+    def invalidate(self, key):
+        self._memory.pop(key, None)
+        write_behind(delete_cached_media, key)
+
+    async def evict(self):
+        """Applies the TTL and size limits to the persistent index."""
+        self._memory.clear()
+        return await run_db(evict_cached_media, CACHE_MAX_ENTRIES, CACHE_TTL_HOURS)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+conversion_cache = ConversionCache()
@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+import time
+
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_MS = int(os.getenv("LOG_FLUSH_MS", "2000"))
+LOG_MAX_BUFFER = int(os.getenv("LOG_MAX_BUFFER", "10000"))
+
+class UsageLogWriter:
+    """
+    Buffers usage-log events in memory and hands them to `write_rows` in bulk,
+    every `batch_size` events or every `flush_interval` seconds, whichever comes first.
+    The buffer is bounded: when it is full new events are dropped and counted.
+    """
+
+    def __init__(self, write_rows, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_MS / 1000, max_buffer=LOG_MAX_BUFFER):
+        self.write_rows = write_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="usage-log-writer", daemon=True)
+                    self._thread.start()
+
+    def log(self, user_id, action):
+        """Queue one event; never blocks the caller."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((user_id, action, time.time()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, rows, limit):
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        try:
+            self.write_rows(rows)
+            self.written += len(rows)
+            self.flushes += 1
+        except Exception as e:
+            # The DB is unavailable: the batch is lost rather than blocking new events
+            self.dropped += len(rows)
+            print(f"Usage log flush error ({len(rows)} events dropped): {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            rows = []
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or self._stop.is_set():
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                self._drain(rows, self.batch_size)
+            self._flush(rows)
+
+    def stop(self):
+        """Flush everything still buffered and stop the writer thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        while True:
+            rows = []
+            self._drain(rows, self.batch_size)
+            if not rows:
+                break
+            self._flush(rows)
+
+    def stats(self):
+        return {
+            "buffered": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+        }
@@ -1,34 +1,101 @@
 import os
+import time
+import asyncio
+import threading
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from database.log_writer import UsageLogWriter
+from core.metrics import timed_db
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+# Tasks older than this are considered stuck and dropped by cleanup_old_data
+STALE_TASK_SECONDS = 3600
+# How many files one user may have converting or queued at the same time
+USER_FILE_QUOTA = int(os.getenv("USER_FILE_QUOTA", "10"))
+# /status and friends are served from memory for this long
+STATS_CACHE_SECONDS = int(os.getenv("STATS_CACHE_SECONDS", "30"))
+# Stage timings kept per host and stage for the cost model
+JOB_TIMINGS_KEEP = 1000
 
 # Connection pool to manage connections efficiently
 postgreSQL_pool = None
+_pool_lock = threading.Lock()
+# The executors below are not its only users (the usage-log writer, a broadcast's
+# cursor, startup), and the pool raises PoolError when empty instead of waiting
+_pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+
+# Blocking psycopg2 calls run here instead of on the event loop.
+# Writes get their own single thread so they reach Postgres in the order they were issued.
+_read_executor = ThreadPoolExecutor(max_workers=max(DB_POOL_SIZE - 1, 1), thread_name_prefix="db-read")
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+_stats_cache = {"at": 0.0, "value": None}
+
+# In-process registry of active tasks (user_id -> start time).
+# It answers can_process without a query; the tasks table is only written through.
+active_tasks = {}
+# Files each user has in flight; can_process() allows up to USER_FILE_QUOTA at once
+active_files = {}
+
+async def run_db(func, *args):
+    """Run a blocking DB helper on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, func, *args)
+
+def _log_write_error(future):
+    error = future.exception()
+    if error:
+        print(f"Database write error: {error}")
+
+def write_behind(func, *args):
+    """Queue a DB write without waiting for it."""
+    _write_executor.submit(func, *args).add_done_callback(_log_write_error)
+
+def shutdown_db():
+    """Wait for queued writes to land, then close the pool."""
+    usage_log_writer.stop()
+    _write_executor.shutdown(wait=True)
+    _read_executor.shutdown(wait=True)
+    if postgreSQL_pool:
+        postgreSQL_pool.closeall()
 
 def init_pool():
     global postgreSQL_pool
-    try:
-        if not postgreSQL_pool:
-            postgreSQL_pool = psycopg2.pool.SimpleConnectionPool(1, 10, DATABASE_URL)
-            if postgreSQL_pool:
-                print("Connection pool created successfully")
-    except (Exception, psycopg2.DatabaseError) as error:
-        print("Error while connecting to PostgreSQL", error)
+    # Startup and the health probe may both get here first, from different threads
+    with _pool_lock:
+        try:
+            if not postgreSQL_pool:
+                postgreSQL_pool = psycopg2.pool.ThreadedConnectionPool(1, DB_POOL_SIZE, DATABASE_URL)
+                if postgreSQL_pool:
+                    print("Connection pool created successfully")
+        except (Exception, psycopg2.DatabaseError) as error:
+            print("Error while connecting to PostgreSQL", error)
 
 def get_connection():
+    """A pooled connection; waits for one to be returned when they are all in use."""
     if not postgreSQL_pool:
         init_pool()
-    return postgreSQL_pool.getconn()
+    _pool_slots.acquire()
+    try:
+        return postgreSQL_pool.getconn()
+    except BaseException:
+        _pool_slots.release()
+        raise
 
 def put_connection(conn):
-    if postgreSQL_pool:
-        postgreSQL_pool.putconn(conn)
+    try:
+        if postgreSQL_pool:
+            postgreSQL_pool.putconn(conn)
+    finally:
+        _pool_slots.release()
 
+@timed_db
 def init_db():
     init_pool()
     conn = get_connection()
@@ -50,92 +117,407 @@ def init_db():
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # Per-user aggregates, maintained incrementally as logs are flushed
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id BIGINT PRIMARY KEY,
+                    first_seen TIMESTAMP NOT NULL,
+                    last_seen TIMESTAMP NOT NULL,
+                    conversions INTEGER DEFAULT 0
+                )
+            """)
+            # Global counters; unlike usage_logs these are never cleaned up
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    name TEXT PRIMARY KEY,
+                    value BIGINT NOT NULL DEFAULT 0
+                )
+            """)
+            cur.execute("SELECT 1 FROM stats_counters LIMIT 1")
+            if cur.fetchone() is None:
+                # First run with counters: backfill from whatever history is left
+                cur.execute("""
+                    INSERT INTO users (user_id, first_seen, last_seen, conversions)
+                    SELECT user_id, MIN(timestamp), MAX(timestamp),
+                           COUNT(*) FILTER (WHERE action = 'CONVERSION_SUCCESS')
+                    FROM usage_logs GROUP BY user_id
+                    ON CONFLICT (user_id) DO NOTHING
+                """)
+                cur.execute("""
+                    INSERT INTO stats_counters (name, value) VALUES
+                        ('total_conversions', (SELECT COALESCE(SUM(conversions), 0) FROM users)),
+                        ('unique_users', (SELECT COUNT(*) FROM users))
+                    ON CONFLICT (name) DO NOTHING
+                """)
+            # Broadcast checkpoints so an interrupted broadcast can resume
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id SERIAL PRIMARY KEY,
+                    source_chat_id BIGINT NOT NULL,
+                    source_message_id BIGINT NOT NULL,
+                    status_chat_id BIGINT,
+                    status_message_id BIGINT,
+                    last_user_id BIGINT DEFAULT 0,
+                    sent INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'running',
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Per-user output preferences (still frame source)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_settings (
+                    user_id BIGINT PRIMARY KEY,
+                    visual_mode TEXT NOT NULL DEFAULT 'black',
+                    image_chat_id BIGINT,
+                    image_message_id BIGINT,
+                    image_id BIGINT,
+                    output_formats TEXT NOT NULL DEFAULT 'mp4'
+                )
+            """)
+            # Tables created before users could ask for extra output formats
+            cur.execute("ALTER TABLE user_settings ADD COLUMN IF NOT EXISTS output_formats TEXT NOT NULL DEFAULT 'mp4'")
+            # Shared job queue for split frontend/worker deployments.
+            # The tasks table stays the per-user admission lock; this holds the work itself.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id BIGSERIAL PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    chat_id BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    status_message_id BIGINT,
+                    cache_key TEXT,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    stage TEXT,
+                    priority SMALLINT NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    cancel_requested BOOLEAN DEFAULT FALSE,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    claimed_at TIMESTAMP,
+                    heartbeat_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """)
+            # Tables created before the job journal recorded stages, or before VIP jobs went first
+            cur.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS stage TEXT")
+            cur.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0")
+            cur.execute("DROP INDEX IF EXISTS jobs_queued_idx")
+            cur.execute("CREATE INDEX IF NOT EXISTS jobs_queued_priority_idx ON jobs (priority DESC, id) WHERE state = 'queued'")
+            # Input bytes and audio seconds each user converted per day, for the daily quota
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS daily_usage (
+                    user_id BIGINT NOT NULL,
+                    day DATE NOT NULL DEFAULT CURRENT_DATE,
+                    bytes BIGINT NOT NULL DEFAULT 0,
+                    seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, day)
+                )
+            """)
+            # How long each stage of past jobs took on each host (see core/costmodel.py)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS job_timings (
+                    id BIGSERIAL PRIMARY KEY,
+                    host TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    size DOUBLE PRECISION NOT NULL,
+                    seconds DOUBLE PRECISION NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS job_timings_host_idx ON job_timings (host, stage, id)")
+            # Already-uploaded MP4s, keyed by source document and render settings
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS conversion_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    media_id BIGINT NOT NULL,
+                    access_hash BIGINT NOT NULL,
+                    file_reference BYTEA,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    hits INTEGER DEFAULT 0
+                )
+            """)
             conn.commit()
     finally:
         put_connection(conn)
+    load_active_tasks()
 
-def add_task(user_id):
+@timed_db
+def ping_db():
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO tasks (user_id) VALUES (%s) ON CONFLICT (user_id) DO NOTHING", (user_id,))
-            conn.commit()
+            cur.execute("SELECT 1")
+            cur.fetchone()
     finally:
         put_connection(conn)
 
-def remove_task(user_id):
+@timed_db
+def load_active_tasks():
+    """Seed the in-memory registry from the tasks table (e.g. after a restart)."""
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM tasks WHERE user_id = %s", (user_id,))
+            cur.execute("SELECT user_id, EXTRACT(EPOCH FROM started_at) FROM tasks")
+            active_tasks.clear()
+            active_tasks.update({user_id: float(started_at) for user_id, started_at in cur.fetchall()})
+    finally:
+        put_connection(conn)
+
+@timed_db
+def _insert_task(user_id):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO tasks (user_id) VALUES (%s) ON CONFLICT (user_id) DO NOTHING", (user_id,))
             conn.commit()
     finally:
         put_connection(conn)
 
-def can_process(user_id):
+@timed_db
+def _delete_task(user_id):
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT user_id FROM tasks WHERE user_id = %s", (user_id,))
-            return cur.fetchone() is None
+            cur.execute("DELETE FROM tasks WHERE user_id = %s", (user_id,))
+            conn.commit()
     finally:
         put_connection(conn)
 
+def forget_task(user_id, files=1):
+    """Release files from the in-memory registry only (another process owns the DB row)."""
+    remaining = active_files.get(user_id, 1) - files
+    if remaining > 0:
+        active_files[user_id] = remaining
+    else:
+        active_files.pop(user_id, None)
+        active_tasks.pop(user_id, None)
+    return remaining
+
+def track_task(user_id, files=1):
+    """Count files in the in-memory registry only. Returns True if the user was idle."""
+    new = user_id not in active_tasks
+    if new:
+        active_tasks[user_id] = time.time()
+    active_files[user_id] = active_files.get(user_id, 0) + files
+    return new
+
+def add_task(user_id, files=1):
+    if track_task(user_id, files):
+        write_behind(_insert_task, user_id)
+
+def remove_task(user_id, files=1):
+    """Release files; returns how many the user still has in flight."""
+    remaining = forget_task(user_id, files)
+    if remaining <= 0:
+        write_behind(_delete_task, user_id)
+    return remaining
+
+def can_process(user_id, files=1):
+    """True if the user may start `files` more conversions within USER_FILE_QUOTA."""
+    if user_id in active_tasks and user_id not in active_files:
+        # Restored from the tasks table (restart or another node); count it as one
+        active_files[user_id] = 1
+    return active_files.get(user_id, 0) + files <= USER_FILE_QUOTA
+
+@timed_db
 def cleanup_old_data(hours=24):
-    """Cleanup stuck tasks and old logs."""
+    """Cleanup stuck tasks, old logs and finished jobs. Totals live in users/stats_counters and are kept."""
+    cutoff = time.time() - STALE_TASK_SECONDS
+    for user_id, started_at in list(active_tasks.items()):
+        if started_at < cutoff:
+            active_tasks.pop(user_id, None)
+            active_files.pop(user_id, None)
     conn = get_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM tasks WHERE started_at < NOW() - INTERVAL '1 hour'")
             cur.execute("DELETE FROM usage_logs WHERE timestamp < NOW() - INTERVAL '%s hours'", (hours,))
+            cur.execute("""
+                DELETE FROM jobs WHERE state NOT IN %s AND finished_at < NOW() - INTERVAL '%s hours'
+            """, (UNFINISHED_JOB_STATES, hours))
+            cur.execute("DELETE FROM daily_usage WHERE day < CURRENT_DATE - 7")
+            cur.execute("""
+                DELETE FROM job_timings WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY host, stage ORDER BY id DESC) AS rank
+                        FROM job_timings
+                    ) ranked WHERE rank > %s
+                )
+            """, (JOB_TIMINGS_KEEP,))
             conn.commit()
     finally:
         put_connection(conn)
 
-def log_action(user_id, action):
+@timed_db
+def _insert_logs(rows):
+    """
+    Bulk insert of (user_id, action, unix_time) rows, updating the users table and
+    global counters in the same transaction.
+    """
+    users = {}
+    for user_id, action, at in rows:
+        first_seen, last_seen, conversions = users.get(user_id, (at, at, 0))
+        if action == "CONVERSION_SUCCESS":
+            conversions += 1
+        users[user_id] = (min(first_seen, at), max(last_seen, at), conversions)
+    conversions = sum(user[2] for user in users.values())
+
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO usage_logs (user_id, action) VALUES (%s, %s)", (user_id, action))
+            execute_values(
+                cur,
+                "INSERT INTO usage_logs (user_id, action, timestamp) VALUES %s",
+                rows,
+                template="(%s, %s, to_timestamp(%s))",
+                page_size=len(rows)
+            )
+            inserted = execute_values(
+                cur,
+                """
+                INSERT INTO users (user_id, first_seen, last_seen, conversions) VALUES %s
+                ON CONFLICT (user_id) DO UPDATE SET
+                    last_seen = GREATEST(users.last_seen, EXCLUDED.last_seen),
+                    conversions = users.conversions + EXCLUDED.conversions
+                RETURNING (xmax = 0)
+                """,
+                [(user_id, *values) for user_id, values in users.items()],
+                template="(%s, to_timestamp(%s), to_timestamp(%s), %s)",
+                page_size=len(users),
+                fetch=True
+            )
+            new_users = sum(1 for (is_new,) in inserted if is_new)
+            cur.execute("""
+                INSERT INTO stats_counters (name, value) VALUES ('total_conversions', %s), ('unique_users', %s)
+                ON CONFLICT (name) DO UPDATE SET value = stats_counters.value + EXCLUDED.value
+            """, (conversions, new_users))
             conn.commit()
     finally:
         put_connection(conn)
 
+# Usage logs are buffered and flushed in batches by a background thread
+usage_log_writer = UsageLogWriter(_insert_logs)
+
+def log_action(user_id, action):
+    usage_log_writer.log(user_id, action)
+
+@timed_db
 def get_stats():
-    """Retrieve bot usage statistics."""
+    """
+    Retrieve bot usage statistics from the counter rows, cached for STATS_CACHE_SECONDS.
+    Blocking on a cache miss: call through run_db from async code.
+    """
+    now = time.time()
+    cached = _stats_cache["value"]
+    if cached is None or now - _stats_cache["at"] > STATS_CACHE_SECONDS:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT name, value FROM stats_counters")
+                counters = dict(cur.fetchall())
+        finally:
+            put_connection(conn)
+        cached = {
+            "total_conversions": counters.get("total_conversions", 0),
+            "unique_users": counters.get("unique_users", 0)
+        }
+        _stats_cache.update(at=now, value=cached)
+    return dict(cached, active_tasks=len(active_tasks))
+
+@timed_db
+def get_all_users():
+    """Retrieve all unique user IDs for broadcasting."""
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM tasks")
-            active_tasks = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM usage_logs WHERE action = 'CONVERSION_SUCCESS'")
-            total_conversions = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(DISTINCT user_id) FROM usage_logs")
-            unique_users = cur.fetchone()[0]
-            
-            return {
-                "active_tasks": active_tasks,
-                "total_conversions": total_conversions,
-                "unique_users": unique_users
-            }
+            cur.execute("SELECT user_id FROM users")
+            rows = cur.fetchall()
+            return [row[0] for row in rows]
     finally:
         put_connection(conn)
 
-def get_all_users():
-    """Retrieve all unique user IDs for broadcasting."""
+def iter_user_batches(after_user_id=0, batch_size=500):
+    """
+    Yield lists of user ids above `after_user_id`, in id order, through a server-side cursor
+    so the full user list is never held in memory. Each next() blocks: use run_db.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor(name="broadcast_users") as cur:
+            cur.itersize = batch_size
+            cur.execute("SELECT user_id FROM users WHERE user_id > %s ORDER BY user_id", (after_user_id,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+        conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def count_users():
     conn = get_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT DISTINCT user_id FROM usage_logs")
-            rows = cur.fetchall()
-            return [row[0] for row in rows]
+            cur.execute("SELECT value FROM stats_counters WHERE name = 'unique_users'")
+            row = cur.fetchone()
+            return row[0] if row else 0
+    finally:
+        put_connection(conn)
+
+@timed_db
+def create_broadcast(source_chat_id, source_message_id, status_chat_id, status_message_id):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO broadcasts (source_chat_id, source_message_id, status_chat_id, status_message_id)
+                VALUES (%s, %s, %s, %s) RETURNING id
+            """, (source_chat_id, source_message_id, status_chat_id, status_message_id))
+            broadcast_id = cur.fetchone()[0]
+            conn.commit()
+            return broadcast_id
+    finally:
+        put_connection(conn)
+
+@timed_db
+def checkpoint_broadcast(broadcast_id, last_user_id, sent, failed, status="running"):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE broadcasts SET last_user_id = %s, sent = %s, failed = %s, status = %s, updated_at = NOW()
+                WHERE id = %s
+            """, (last_user_id, sent, failed, status, broadcast_id))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def get_unfinished_broadcasts():
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, source_chat_id, source_message_id, status_chat_id, status_message_id, last_user_id, sent, failed
+                FROM broadcasts WHERE status = 'running' ORDER BY id
+            """)
+            return cur.fetchall()
     finally:
         put_connection(conn)
 
 def clear_all_tasks():
-    """Emergency: Clear all processing tasks from DB."""
+    """Emergency: Clear all processing tasks from memory and DB."""
+    active_tasks.clear()
+    active_files.clear()
+    write_behind(_truncate_tasks)
+
+@timed_db
+def _truncate_tasks():
     conn = get_connection()
     try:
         with conn.cursor() as cur:
@@ -143,3 +525,431 @@ def clear_all_tasks():
             conn.commit()
     finally:
         put_connection(conn)
+
+@timed_db
+def get_cached_media(cache_key):
+    """Look up an uploaded conversion and mark it as recently used."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE conversion_cache SET last_used = NOW(), hits = hits + 1
+                WHERE cache_key = %s
+                RETURNING media_id, access_hash, file_reference
+            """, (cache_key,))
+            row = cur.fetchone()
+            conn.commit()
+            if row is None:
+                return None
+            return (row[0], row[1], bytes(row[2]) if row[2] is not None else b"")
+    finally:
+        put_connection(conn)
+
+@timed_db
+def save_cached_media(cache_key, media_id, access_hash, file_reference):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO conversion_cache (cache_key, media_id, access_hash, file_reference)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    media_id = EXCLUDED.media_id,
+                    access_hash = EXCLUDED.access_hash,
+                    file_reference = EXCLUDED.file_reference,
+                    last_used = NOW()
+            """, (cache_key, media_id, access_hash, psycopg2.Binary(file_reference or b"")))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def delete_cached_media(cache_key):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM conversion_cache WHERE cache_key = %s", (cache_key,))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def evict_cached_media(max_entries, ttl_hours):
+    """Drop entries older than the TTL, then the least recently used ones above max_entries."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM conversion_cache WHERE created_at < NOW() - INTERVAL '%s hours'", (ttl_hours,))
+            expired = cur.rowcount
+            cur.execute("""
+                DELETE FROM conversion_cache WHERE cache_key IN (
+                    SELECT cache_key FROM conversion_cache
+                    ORDER BY last_used DESC OFFSET %s
+                )
+            """, (max_entries,))
+            conn.commit()
+            return expired + cur.rowcount
+    finally:
+        put_connection(conn)
+
+# User settings
+SETTINGS_COLUMNS = ("visual_mode", "image_chat_id", "image_message_id", "image_id", "output_formats")
+DEFAULT_SETTINGS = dict.fromkeys(SETTINGS_COLUMNS, None) | {"visual_mode": "black", "output_formats": "mp4"}
+
+@timed_db
+def get_user_settings(user_id):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {', '.join(SETTINGS_COLUMNS)} FROM user_settings WHERE user_id = %s", (user_id,))
+            row = cur.fetchone()
+            return dict(zip(SETTINGS_COLUMNS, row)) if row else dict(DEFAULT_SETTINGS)
+    finally:
+        put_connection(conn)
+
+@timed_db
+def save_user_settings(user_id, visual_mode, image_chat_id=None, image_message_id=None, image_id=None):
+    """Sets the visual mode; the custom image is only replaced when a new one is given."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO user_settings (user_id, visual_mode, image_chat_id, image_message_id, image_id)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    visual_mode = EXCLUDED.visual_mode,
+                    image_chat_id = COALESCE(EXCLUDED.image_chat_id, user_settings.image_chat_id),
+                    image_message_id = COALESCE(EXCLUDED.image_message_id, user_settings.image_message_id),
+                    image_id = COALESCE(EXCLUDED.image_id, user_settings.image_id)
+            """, (user_id, visual_mode, image_chat_id, image_message_id, image_id))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def save_output_formats(user_id, output_formats):
+    """Sets the formats each conversion produces, e.g. "mp4,round"."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO user_settings (user_id, output_formats) VALUES (%s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET output_formats = EXCLUDED.output_formats
+            """, (user_id, output_formats))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+# Job queue (BOT_MODE=frontend / worker) and job journal (BOT_MODE=all)
+JOB_COLUMNS = ("id", "user_id", "chat_id", "message_id", "status_message_id", "cache_key", "stage")
+ACTIVE_JOB_STATES = ("claimed", "running")
+UNFINISHED_JOB_STATES = ("queued",) + ACTIVE_JOB_STATES
+
+@timed_db
+def enqueue_job(user_id, chat_id, message_id, status_message_id, cache_key, priority=0):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO jobs (user_id, chat_id, message_id, status_message_id, cache_key, priority)
+                VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
+            """, (user_id, chat_id, message_id, status_message_id, cache_key, priority))
+            job_id = cur.fetchone()[0]
+            cur.execute("SELECT pg_notify('new_job', %s)", (str(job_id),))
+            conn.commit()
+            return job_id
+    finally:
+        put_connection(conn)
+
+@timed_db
+def claim_job(worker_id):
+    """
+    Atomically take the oldest queued job (VIP jobs first); concurrent workers
+    skip rows locked by each other.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                UPDATE jobs SET state = 'claimed', worker_id = %s, claimed_at = NOW(), heartbeat_at = NOW()
+                WHERE id = (
+                    SELECT id FROM jobs WHERE state = 'queued'
+                    ORDER BY priority DESC, id FOR UPDATE SKIP LOCKED LIMIT 1
+                )
+                RETURNING {", ".join(JOB_COLUMNS)}
+            """, (worker_id,))
+            row = cur.fetchone()
+            conn.commit()
+            return dict(zip(JOB_COLUMNS, row)) if row else None
+    finally:
+        put_connection(conn)
+
+@timed_db
+def heartbeat_jobs(job_ids, worker_id):
+    """
+    Marks this worker's jobs as alive. Returns (ids whose cancellation was requested,
+    ids that aren't ours any more: requeued while we stalled, maybe running elsewhere).
+    """
+    if not job_ids:
+        return [], []
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET heartbeat_at = NOW(), state = 'running'
+                WHERE id = ANY(%s) AND worker_id = %s RETURNING id, cancel_requested
+            """, (list(job_ids), worker_id))
+            rows = cur.fetchall()
+            conn.commit()
+            alive = {job_id for job_id, _ in rows}
+            return [job_id for job_id, cancel_requested in rows if cancel_requested], [job_id for job_id in job_ids if job_id not in alive]
+    finally:
+        put_connection(conn)
+
+@timed_db
+def finish_job(job_id, user_id, state, error=None, worker_id=None):
+    """
+    Records the final state, releases the user's task lock and tells the frontend.
+    With `worker_id`, a job that was handed to another worker meanwhile is left alone.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET state = %s, error = %s, finished_at = NOW()
+                WHERE id = %s AND (%s IS NULL OR worker_id = %s)
+            """, (state, error, job_id, worker_id, worker_id))
+            # The user may still have other jobs queued or running
+            cur.execute("""
+                DELETE FROM tasks WHERE user_id = %s AND NOT EXISTS (
+                    SELECT 1 FROM jobs WHERE user_id = %s AND state IN %s
+                )
+            """, (user_id, user_id, UNFINISHED_JOB_STATES))
+            cur.execute("SELECT pg_notify('job_done', %s)", (str(user_id),))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def request_job_cancel(user_id):
+    """
+    Cancels a user's jobs across processes. Queued jobs are cancelled here and their
+    (chat_id, status_message_id) returned; running ones are flagged and their worker notified.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET state = 'cancelled', finished_at = NOW()
+                WHERE user_id = %s AND state = 'queued' RETURNING chat_id, status_message_id
+            """, (user_id,))
+            cancelled = cur.fetchall()
+            cur.execute("""
+                UPDATE jobs SET cancel_requested = TRUE
+                WHERE user_id = %s AND state IN %s RETURNING id
+            """, (user_id, ACTIVE_JOB_STATES))
+            running = cur.fetchall()
+            for (job_id,) in running:
+                cur.execute("SELECT pg_notify('job_cancel', %s)", (str(job_id),))
+            if cancelled and not running:
+                cur.execute("DELETE FROM tasks WHERE user_id = %s", (user_id,))
+            conn.commit()
+            return cancelled
+    finally:
+        put_connection(conn)
+
+@timed_db
+def requeue_stale_jobs(stale_seconds):
+    """Puts jobs whose worker stopped heartbeating back in the queue."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET state = 'queued', worker_id = NULL
+                WHERE state IN %s AND heartbeat_at < NOW() - INTERVAL '%s seconds'
+                RETURNING id
+            """, (ACTIVE_JOB_STATES, stale_seconds))
+            requeued = cur.rowcount
+            if requeued:
+                cur.execute("SELECT pg_notify('new_job', 'requeued')")
+            conn.commit()
+            return requeued
+    finally:
+        put_connection(conn)
+
+@timed_db
+def journal_job(user_id, chat_id, message_id, status_message_id, cache_key, worker_id):
+    """BOT_MODE=all: records a job this process is already running, so a restart can resume it."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO jobs (user_id, chat_id, message_id, status_message_id, cache_key, state, worker_id, claimed_at, heartbeat_at)
+                VALUES (%s, %s, %s, %s, %s, 'running', %s, NOW(), NOW()) RETURNING id
+            """, (user_id, chat_id, message_id, status_message_id, cache_key, worker_id))
+            job_id = cur.fetchone()[0]
+            conn.commit()
+            return job_id
+    finally:
+        put_connection(conn)
+
+@timed_db
+def set_job_stage(job_id, stage):
+    """downloading / converting / uploading; tells a resumed job which files it can trust."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE jobs SET stage = %s, heartbeat_at = NOW() WHERE id = %s", (stage, job_id))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def heartbeat_worker_jobs(worker_id):
+    """BOT_MODE=all: marks every job this process journaled as alive."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET heartbeat_at = NOW() WHERE worker_id = %s AND state IN %s
+            """, (worker_id, ACTIVE_JOB_STATES))
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def claim_interrupted_jobs(worker_id, stale_seconds):
+    """
+    BOT_MODE=all: takes over the unfinished jobs whose process stopped heartbeating them
+    `stale_seconds` ago. During an overlapping deploy the old process's live jobs stay its own.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                UPDATE jobs SET state = 'claimed', worker_id = %s, claimed_at = NOW(), heartbeat_at = NOW()
+                WHERE state IN %s AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - INTERVAL '%s seconds')
+                RETURNING {", ".join(JOB_COLUMNS)}
+            """, (worker_id, UNFINISHED_JOB_STATES, stale_seconds))
+            jobs = [dict(zip(JOB_COLUMNS, row)) for row in cur.fetchall()]
+            conn.commit()
+    finally:
+        put_connection(conn)
+    return sorted(jobs, key=lambda job: job["id"])
+
+@timed_db
+def drop_orphaned_tasks(stale_seconds):
+    """
+    BOT_MODE=all, at startup: drops task locks left behind by jobs that were never
+    journaled. Only locks older than `stale_seconds`, so a process still running keeps its own.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM tasks WHERE started_at < NOW() - INTERVAL '%s seconds'
+                AND user_id NOT IN (SELECT user_id FROM jobs WHERE state IN %s)
+            """, (stale_seconds, UNFINISHED_JOB_STATES))
+            conn.commit()
+    finally:
+        put_connection(conn)
+    load_active_tasks()
+
+@timed_db
+def requeue_worker_jobs(worker_id):
+    """BOT_MODE=worker, at startup: hands back jobs a previous run under the same WORKER_ID left running."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET state = 'queued', worker_id = NULL
+                WHERE worker_id = %s AND state IN %s
+            """, (worker_id, ACTIVE_JOB_STATES))
+            requeued = cur.rowcount
+            if requeued:
+                cur.execute("SELECT pg_notify('new_job', 'requeued')")
+            conn.commit()
+            return requeued
+    finally:
+        put_connection(conn)
+
+@timed_db
+def unfinished_job_ids():
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM jobs WHERE state IN %s", (UNFINISHED_JOB_STATES,))
+            return [job_id for (job_id,) in cur.fetchall()]
+    finally:
+        put_connection(conn)
+
+@timed_db
+def save_job_timing(host, stage, size, seconds):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO job_timings (host, stage, size, seconds) VALUES (%s, %s, %s, %s)",
+                (host, stage, size, seconds)
+            )
+            conn.commit()
+    finally:
+        put_connection(conn)
+
+@timed_db
+def charge_daily_usage(user_id, nbytes, seconds, max_bytes=0, max_seconds=0):
+    """
+    Adds to the user's usage for today unless that would go over `max_bytes` or
+    `max_seconds` (0 = no limit), in one statement so concurrent jobs can't both
+    squeeze in. Returns False if it was refused. Negative amounts refund.
+    """
+    if (max_bytes and nbytes > max_bytes) or (max_seconds and seconds > max_seconds):
+        return False
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO daily_usage (user_id, bytes, seconds)
+                VALUES (%(user_id)s, GREATEST(%(bytes)s, 0), GREATEST(%(seconds)s, 0))
+                ON CONFLICT (user_id, day) DO UPDATE SET
+                    bytes = GREATEST(daily_usage.bytes + %(bytes)s, 0),
+                    seconds = GREATEST(daily_usage.seconds + %(seconds)s, 0)
+                WHERE (%(max_bytes)s = 0 OR daily_usage.bytes + %(bytes)s <= %(max_bytes)s)
+                  AND (%(max_seconds)s = 0 OR daily_usage.seconds + %(seconds)s <= %(max_seconds)s)
+                RETURNING bytes
+            """, {"user_id": user_id, "bytes": int(nbytes), "seconds": float(seconds),
+                  "max_bytes": int(max_bytes), "max_seconds": float(max_seconds)})
+            charged = cur.fetchone() is not None
+            conn.commit()
+            return charged
+    finally:
+        put_connection(conn)
+
+@timed_db
+def get_daily_usage(user_id):
+    """(bytes, seconds) the user has converted today."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT bytes, seconds FROM daily_usage WHERE user_id = %s AND day = CURRENT_DATE", (user_id,))
+            row = cur.fetchone()
+            return (int(row[0]), float(row[1])) if row else (0, 0.0)
+    finally:
+        put_connection(conn)
+
+@timed_db
+def load_job_timings(host, per_stage):
+    """The most recent `per_stage` (stage, size, seconds) samples of each stage on a host, oldest first."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT stage, size, seconds FROM (
+                    SELECT id, stage, size, seconds,
+                           ROW_NUMBER() OVER (PARTITION BY stage ORDER BY id DESC) AS rank
+                    FROM job_timings WHERE host = %s
+                ) ranked WHERE rank <= %s ORDER BY id
+            """, (host, per_stage))
+            return cur.fetchall()
+    finally:
+        put_connection(conn)
@@ -0,0 +1,42 @@
+import asyncio
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from database.manager import DATABASE_URL
+
+async def listen(channels, callback):
+    """
+    LISTENs on the given Postgres channels and calls `callback(channel, payload)` for
+    every NOTIFY. The connection is watched with loop.add_reader, so nothing blocks the
+    event loop while idle. Reconnects after errors.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        conn = None
+        try:
+            conn = await loop.run_in_executor(None, psycopg2.connect, DATABASE_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                for channel in channels:
+                    cur.execute(f"LISTEN {channel}")
+            readable = asyncio.Event()
+            loop.add_reader(conn.fileno(), readable.set)
+            try:
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            callback(notify.channel, notify.payload)
+                        except Exception as e:
+                            print(f"Notification handler error: {e}")
+            finally:
+                loop.remove_reader(conn.fileno())
+        except Exception as e:
+            print(f"LISTEN connection error: {e}")
+            await asyncio.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
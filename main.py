@@ -1,30 +1,70 @@
-import asyncio
-import threading
 import time
-from telethon.errors import FloodWaitError
+_started = time.perf_counter()
+import asyncio
+import signal
 
-# Import modular components
-from bot.client import client
-from bot.handlers import * # Ensures handlers are registered
-from database.manager import init_db, cleanup_old_data
-from web.health import run_health_check
+# Only what the health server and cleanup need is imported up front; Telethon and the
+# bot's handlers are imported after PORT is bound (see the bottom of this file)
+from database.manager import (
+    init_db, cleanup_old_data, run_db, shutdown_db, forget_task, claim_interrupted_jobs, drop_orphaned_tasks, unfinished_job_ids,
+    load_job_timings
+)
+from database.notify import listen
+from database.cache import conversion_cache
+from web.health import start_health_server, health_state
+from core.profiler import LoopWatchdog
+from core.metrics import monitor_event_loop, record_startup_phase, startup_phase, timed_startup
+from core.converter import SEGMENT_CACHE_DIR, warm_up
+from core.visuals import prune_cache, FRAME_CACHE_DIR, FRAME_CACHE_MAX_FILES
+from core.admission import ORPHAN_FILE_SECONDS
+from core.costmodel import cost_model, COST_MODEL_HOST, COST_MODEL_SAMPLES
 
 async def periodic_cleanup():
     """Run database and file cleanup periodically."""
     while True:
         try:
-            cleanup_old_data()
-            print("Database cleanup completed.")
+            # Rendered frames and segments live on each node's own disk
+            for directory in (FRAME_CACHE_DIR, SEGMENT_CACHE_DIR):
+                await asyncio.to_thread(prune_cache, directory, FRAME_CACHE_MAX_FILES)
+            # Downloads and videos left behind by jobs that died without cleaning up
+            keep = {job_file_stem(job_id) for job_id in await run_db(unfinished_job_ids)}
+            swept = await asyncio.to_thread(admission.sweep, ORPHAN_FILE_SECONDS, keep)
+            if swept:
+                print(f"Removed {swept} orphaned files from {DOWNLOAD_DIR}.")
+            limits.prune()
+            if BOT_MODE != "worker":
+                await run_db(cleanup_old_data)
+                evicted = await conversion_cache.evict()
+                print(f"Database cleanup completed. Evicted {evicted} cached conversions.")
         except Exception as e:
             print(f"Cleanup error: {e}")
         await asyncio.sleep(3600)  # Run every hour
 
+def on_job_done(channel, payload):
+    """Frontend mode: a worker finished a job, so the user may send the next file."""
+    forget_task(int(payload))
+
+def stop_on_signals(loop, worker_task=None):
+    """
+    SIGTERM (Render, docker stop) and Ctrl+C end the bot or the worker loop normally,
+    so shutdown_db still flushes buffered usage logs and queued writes.
+    """
+    def stop(name):
+        print(f"{name} received, shutting down...")
+        if worker_task is not None:
+            worker_task.cancel()
+        else:
+            loop.create_task(client.disconnect())
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop, sig.name)
+
 def start_bot():
     """Start the Telethon bot with retry logic."""
     print("Bot is starting...")
     while True:
         try:
-            # Telethon already started in bot/client.py
+            # Telethon was already started by prepare() below
             client.run_until_disconnected()
             break
         except FloodWaitError as e:
@@ -34,21 +74,95 @@ def start_bot():
             print(f"Bot crashed: {e}")
             time.sleep(10)
 
-if __name__ == "__main__":
-    # 1. Initialize Database
+def prepare_db():
+    """
+    Blocking database side of startup: schema, this host's past timings and, with a
+    single process, the jobs a previous run was killed in the middle of. Jobs of a run
+    that still heartbeats them (an overlapping deploy) are left to it, and taken over
+    by keep_jobs_alive if it stops.
+    """
     init_db()
-    
-    # 2. Start Health Check Server in a background thread
-    threading.Thread(target=run_health_check, daemon=True).start()
-    
-    # 3. Setup cleanup task in the event loop
+    # ETAs and shortest-job-first start from this host's past timings
+    for stage, size, seconds in load_job_timings(COST_MODEL_HOST, COST_MODEL_SAMPLES):
+        cost_model.add(stage, size, seconds)
+    interrupted = []
+    if BOT_MODE == "all":
+        interrupted = claim_interrupted_jobs(WORKER_ID, JOB_STALE_SECONDS)
+        drop_orphaned_tasks(JOB_STALE_SECONDS)
+
+    # Nothing was in flight before this, so anything left in DOWNLOAD_DIR is from a previous crash,
+    # except the partial files of unfinished jobs, which resume where they stopped. Files of
+    # jobs that start while this runs are newer than the cutoff and are left alone.
+    swept = admission.sweep(0, {job_file_stem(job_id) for job_id in unfinished_job_ids()})
+    if swept:
+        print(f"Removed {swept} leftover files from {DOWNLOAD_DIR}.")
+    return interrupted
+
+async def prepare():
+    """The Telegram login and the database setup both wait on the network, so run them together."""
+    _, interrupted = await asyncio.gather(
+        timed_startup("telegram", start_client()),
+        timed_startup("database", asyncio.to_thread(prepare_db)),
+    )
+    return interrupted
+
+if __name__ == "__main__":
+    record_startup_phase("import core", time.perf_counter() - _started)
+
+    # 1. Setup the event loop shared by Telethon and the health server
     try:
         loop = asyncio.get_event_loop()
     except RuntimeError:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        
+
+    # 2. Bind the health port before anything slow, so deploy probes find it open
+    loop.run_until_complete(start_health_server())
+
+    # 3. Import the bot; registering handlers doesn't need a connection yet
+    with startup_phase("import bot"):
+        from telethon.errors import FloodWaitError
+        from bot.client import (
+            client, start_client, conversion_scheduler, admission, limits, DOWNLOAD_DIR, BOT_MODE, WORKER_ID,
+            PREWARM_WORKERS
+        )
+        import bot.handlers  # noqa: F401 (registers the event handlers)
+        from bot.worker import run_worker, resume_jobs, keep_jobs_alive, JOB_STALE_SECONDS
+        from bot.pipeline import job_file_stem
+        from bot.broadcast import resume_broadcasts
+    health_state.attach(client, conversion_scheduler, admission)
+
+    # 4. Connect to Telegram and Postgres concurrently
+    interrupted = loop.run_until_complete(prepare())
+    record_startup_phase("total", time.perf_counter() - _started)
+
+    # 5. Background tasks. Frontends only enqueue, so only converting nodes start their workers early
+    loop.create_task(monitor_event_loop())
+    # Startup blocked the loop on purpose; from here on anything that does is logged
+    LoopWatchdog().start(loop)
     loop.create_task(periodic_cleanup())
-    
-    # 4. Start the Bot
-    start_bot()
+    if PREWARM_WORKERS and BOT_MODE != "frontend":
+        loop.create_task(timed_startup("warm workers", asyncio.to_thread(conversion_scheduler.warm_up, warm_up)))
+    if BOT_MODE != "worker":
+        loop.create_task(resume_broadcasts(client))
+    if interrupted:
+        loop.create_task(resume_jobs(interrupted))
+    if BOT_MODE == "all":
+        loop.create_task(keep_jobs_alive())
+    if BOT_MODE == "frontend":
+        loop.create_task(listen(["job_done"], on_job_done))
+
+    # 6. Start the Bot (or the job worker)
+    try:
+        if BOT_MODE == "worker":
+            worker_task = loop.create_task(run_worker())
+            stop_on_signals(loop, worker_task)
+            try:
+                loop.run_until_complete(worker_task)
+            except asyncio.CancelledError:
+                pass
+        else:
+            stop_on_signals(loop)
+            start_bot()
+    finally:
+        shutdown_db()
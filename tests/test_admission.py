@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from core import admission
+from core.admission import AdmissionController, AdmissionError
+
+MB = admission.MB
+
+@pytest.fixture
+def readings(monkeypatch):
+    """memory_in_use() replaced by a counter of how often /proc would be walked."""
+    calls = []
+
+    def fake_memory_in_use():
+        calls.append(1)
+        return 100 * MB
+    monkeypatch.setattr(admission, "memory_in_use", fake_memory_in_use)
+    return calls
+
+def controller(tmp_path, **kwargs):
+    kwargs = dict({"max_reserved": 100 * MB, "min_free": 0, "max_memory": 500 * MB, "job_memory": 60 * MB}, **kwargs)
+    return AdmissionController(str(tmp_path), **kwargs)
+
+def test_memory_reading_is_shared(tmp_path, readings):
+    async def run():
+        admissions = controller(tmp_path)
+        for index in range(5):
+            await admissions.acquire(f"job{index}", MB)
+        return admissions
+    admissions = asyncio.run(run())
+    assert len(admissions.reservations) == 5
+    # The first job needs no reading, the other four share one
+    assert len(readings) == 1
+
+def test_concurrent_jobs_dont_overcommit(tmp_path, readings, monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_WAIT_SECONDS", 0)
+
+    async def run():
+        admissions = controller(tmp_path)
+        await admissions.acquire("first", 10 * MB)
+        return await asyncio.gather(
+            *(admissions.acquire(f"job{index}", 40 * MB) for index in range(3)), return_exceptions=True
+        ), admissions
+    results, admissions = asyncio.run(run())
+    assert admissions.reserved == 90 * MB
+    assert [isinstance(result, AdmissionError) for result in results].count(True) == 1
+
+def test_memory_shortage(tmp_path, readings):
+    async def run():
+        admissions = controller(tmp_path, max_memory=150 * MB)
+        await admissions.acquire("first", MB)
+        return await admissions.shortage(MB)
+    assert asyncio.run(run()) == "memory"
@@ -0,0 +1,102 @@
+import subprocess
+
+import pytest
+
+from core import converter
+from core.converter import layout_channels, probe_audio, plan_encoding, predict_output_size, fit_plan, split_points
+
+def audio_info(duration, codec="mp3", bitrate=128_000, channels=2):
+    return {"container": codec, "duration": duration, "codec": codec, "bitrate": bitrate, "sample_rate": 44100, "channels": channels}
+
+@pytest.mark.parametrize("layout, channels", [
+    ("mono", 1),
+    ("stereo", 2),
+    ("quad", 4),
+    ("2.1", 3),
+    ("5.0(side)", 5),
+    ("5.1", 6),
+    ("5.1(side)", 6),
+    ("6.1", 7),
+    ("7.1(wide)", 8),
+    ("hexagonal", 6),
+    ("3 channels", 3),
+    ("12 channels", 12),
+    ("something new", 2),
+])
+def test_layout_channels(layout, channels):
+    assert layout_channels(layout) == channels
+
+@pytest.mark.parametrize("layout, channels", [("mono", 1), ("5.1", 6)])
+def test_probe_audio_channels(tmp_path, layout, channels):
+    path = str(tmp_path / "input.m4a")
+    subprocess.run(
+        [converter.get_ffmpeg_exe(), "-v", "error", "-f", "lavfi", "-i", f"anullsrc=channel_layout={layout}:sample_rate=48000",
+         "-t", "1", "-c:a", "aac", path],
+        check=True,
+    )
+    info = probe_audio(path)
+    assert info["codec"] == "aac"
+    assert info["channels"] == channels
+    assert info["duration"] == pytest.approx(1, abs=0.1)
+
+def test_plan_downmixes_surround_only():
+    assert plan_encoding(audio_info(600, channels=6))["channels"] == 2
+    assert plan_encoding(audio_info(600, channels=1))["channels"] is None
+
+def test_plan_follows_source_bitrate_and_length():
+    # A 56k podcast is re-encoded at 64k rather than 128k, a 320k song at 128k
+    assert plan_encoding(audio_info(600, bitrate=56_000))["audio_bitrate"] == "64k"
+    assert plan_encoding(audio_info(600, bitrate=320_000))["audio_bitrate"] == "128k"
+    assert plan_encoding(audio_info(60), threads=4)["threads"] == 1
+    assert plan_encoding(audio_info(600), threads=4)["threads"] == 4
+
+def test_fit_plan_keeps_a_plan_that_fits():
+    plan = plan_encoding(audio_info(600))
+    assert fit_plan(plan, audio_info(600), 600, max_bytes=100 * 1024 * 1024) is plan
+
+def test_fit_plan_transcodes_copied_audio_first():
+    info = audio_info(3600, codec="aac", bitrate=256_000)
+    plan = plan_encoding(info, copy_audio=True)
+    assert plan["copy_audio"]
+    max_bytes = predict_output_size(dict(plan, copy_audio=False), info, 3600) + 1024
+    fitted = fit_plan(plan, info, 3600, max_bytes=max_bytes)
+    assert not fitted["copy_audio"]
+    assert fitted["audio_bitrate"] == "128k"
+    assert predict_output_size(fitted, info, 3600) <= max_bytes
+
+def test_fit_plan_lowers_bitrate_to_fit():
+    info = audio_info(3600)
+    plan = plan_encoding(info)
+    max_bytes = 45 * 1024 * 1024
+    fitted = fit_plan(plan, info, 3600, max_bytes=max_bytes)
+    bitrate = int(fitted["audio_bitrate"].rstrip("k")) * 1000
+    assert converter.MIN_AUDIO_BITRATE <= bitrate < 128_000
+    assert bitrate % 16_000 == 0
+    assert predict_output_size(fitted, info, 3600) <= max_bytes
+
+def test_fit_plan_gives_up_below_min_bitrate():
+    info = audio_info(3600)
+    assert fit_plan(plan_encoding(info), info, 3600, max_bytes=10 * 1024 * 1024) is None
+
+def test_split_points_single_part_when_it_fits():
+    assert split_points(audio_info(600), max_bytes=100 * 1024 * 1024, part_seconds=3600) == [(0.0, 600)]
+
+def test_split_points_by_part_seconds():
+    points = split_points(audio_info(7200), max_bytes=0, part_seconds=3000)
+    assert points == [(0.0, 2400.0), (2400.0, 2400.0), (4800.0, 2400.0)]
+
+def test_split_points_by_size():
+    info = audio_info(10 * 3600)
+    max_bytes = 100 * 1024 * 1024
+    points = split_points(info, max_bytes=max_bytes, part_seconds=0)
+    assert len(points) > 1
+    starts = [start for start, _ in points]
+    assert starts == sorted(starts)
+    assert sum(length for _, length in points) == pytest.approx(info["duration"])
+    for _, length in points:
+        assert fit_plan(plan_encoding(info), info, length, max_bytes) is not None
+    # One part fewer would not fit
+    assert fit_plan(plan_encoding(info), info, info["duration"] / (len(points) - 1), max_bytes) is None
+
+def test_split_points_unknown_duration():
+    assert split_points(audio_info(0.0)) == [(0.0, 0.0)]
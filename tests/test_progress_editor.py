@@ -0,0 +1,64 @@
+import asyncio
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import InputPeerUser
+
+from bot.ui import ProgressEditor
+
+class FakeClient:
+    def __init__(self, delay=0.0, flood=0):
+        self.delay = delay
+        self.flood = flood
+        self.sent = []
+        self.thresholds = []
+
+    async def __call__(self, request, flood_sleep_threshold=None):
+        self.thresholds.append(flood_sleep_threshold)
+        await asyncio.sleep(self.delay)
+        if self.flood:
+            self.flood -= 1
+            raise FloodWaitError(request=request, capture=3)
+        self.sent.append(request.message)
+
+    def build_reply_markup(self, buttons):
+        return None
+
+class FakeMessage:
+    def __init__(self, client, chat_id=1, message_id=1):
+        self.client = client
+        self.chat_id = chat_id
+        self.id = message_id
+
+    async def get_input_chat(self):
+        return InputPeerUser(self.chat_id, 0)
+
+def test_flood_wait_reaches_the_editor():
+    async def run():
+        client = FakeClient(flood=1)
+        editor = ProgressEditor(rate=100, min_interval=0)
+        editor.update(FakeMessage(client), "10%")
+        await asyncio.sleep(0.1)
+        return client, editor
+    client, editor = asyncio.run(run())
+    assert client.thresholds == [0]
+    assert editor.flood_waits == 1
+    assert editor.backoff == 2.0
+    assert editor.bucket.try_acquire() > 2
+    # Kept for after the pause
+    assert list(editor._pending) == [(1, 1)]
+
+def test_forget_waits_for_the_edit_in_flight():
+    async def run():
+        client = FakeClient(delay=0.2)
+        editor = ProgressEditor(rate=100, min_interval=0)
+        message = FakeMessage(client)
+        editor.update(message, "50%")
+        await asyncio.sleep(0.05)
+        await editor.forget(message)
+        # The caller's final text goes out only now
+        client.sent.append("done")
+        await asyncio.sleep(0.3)
+        return client, editor
+    client, editor = asyncio.run(run())
+    assert client.sent == ["50%", "done"]
+    assert editor._last_text == {} and editor._last_edit == {}
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from core import ratelimit
+from core.ratelimit import TokenBucket, SlidingWindow, UserLimits
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A time.monotonic() the test moves forward by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+def test_bucket_bursts_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(1.0)
+
+def test_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.try_acquire(2)
+    clock[0] += 0.5
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+def test_bucket_lets_oversized_request_through_when_full(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.try_acquire(5) == 0.0
+    assert bucket.tokens == 0
+
+def test_bucket_pause_blocks_until_deadline(clock):
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.pause(5)
+    bucket.pause(2)  # a shorter pause doesn't cut the longer one short
+    assert bucket.try_acquire() == pytest.approx(5.0)
+    clock[0] += 5
+    assert bucket.try_acquire() == 0.0
+
+def test_bucket_acquire_waits_for_tokens():
+    async def run():
+        bucket = TokenBucket(rate=50, capacity=1)
+        await bucket.acquire()
+        started = asyncio.get_running_loop().time()
+        await bucket.acquire()
+        return asyncio.get_running_loop().time() - started
+    assert asyncio.run(run()) >= 0.015
+
+def test_window_limits_events_per_key(clock):
+    window = SlidingWindow(limit=2, window=60)
+    window.hit("a", 2)
+    assert window.retry_after("a") == pytest.approx(60)
+    assert window.retry_after("b") == 0.0
+    clock[0] += 60
+    assert window.retry_after("a") == 0.0
+    assert "a" not in window.events
+
+def test_window_waits_for_the_oldest_events_to_expire(clock):
+    window = SlidingWindow(limit=3, window=60)
+    window.hit("a")
+    clock[0] += 10
+    window.hit("a", 2)
+    assert window.retry_after("a") == pytest.approx(50)
+    assert window.retry_after("a", 2) == pytest.approx(60)
+    # More than the limit at once waits for an empty window instead of forever
+    assert window.retry_after("a", 10) == pytest.approx(60)
+
+def test_user_limits_per_user_then_shared(clock):
+    limits = UserLimits()
+    limits.per_user = SlidingWindow(2, 60)
+    limits.shared = TokenBucket(rate=1, capacity=3)
+    assert limits.check(1, 2) is None
+    reason, wait = limits.check(1)
+    assert reason == "user" and wait == pytest.approx(60)
+    assert limits.check(2) is None
+    reason, wait = limits.check(3)
+    assert reason == "global" and wait == pytest.approx(1)
+
+def test_user_limits_rejected_check_takes_nothing(clock):
+    limits = UserLimits()
+    limits.per_user = SlidingWindow(5, 60)
+    limits.shared = TokenBucket(rate=1, capacity=1)
+    limits.shared.try_acquire()
+    assert limits.check(1)[0] == "global"
+    assert 1 not in limits.per_user.events
+
+def test_user_limits_refund_gives_back_what_check_took(clock):
+    # A job refused by the daily quota, or refunded after failing, doesn't count
+    limits = UserLimits()
+    limits.per_user = SlidingWindow(2, 60)
+    limits.shared = TokenBucket(rate=1, capacity=2)
+    assert limits.check(1, 2) is None
+    limits.refund(1, 2)
+    assert 1 not in limits.per_user.events
+    assert limits.shared.tokens == 2
+    assert limits.check(1, 2) is None
+    assert limits.check(1)[0] == "user"
+
+def test_window_unhit_forgets_the_latest_events(clock):
+    window = SlidingWindow(limit=3, window=60)
+    window.hit("a")
+    clock[0] += 10
+    window.hit("a", 2)
+    window.unhit("a")
+    assert list(window.events["a"]) == [1000.0, 1010.0]
+    window.unhit("a", 5)
+    assert "a" not in window.events
+    window.unhit("b")
+
+def test_user_limits_vips_skip_limits(clock):
+    limits = UserLimits(vip_ids=[7])
+    limits.per_user = SlidingWindow(1, 60)
+    limits.shared = TokenBucket(rate=1, capacity=1)
+    for _ in range(5):
+        assert limits.check(7) is None
+    assert limits.priority(7) == ratelimit.VIP_PRIORITY
+    assert limits.priority(8) == 0
+
+def test_user_limits_prune_forgets_idle_users(clock):
+    limits = UserLimits()
+    limits.per_user = SlidingWindow(5, 60)
+    limits.per_user.hit(1)
+    clock[0] += 61
+    limits.prune()
+    assert limits.per_user.events == {}
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from core import scheduler
+from core.converter import CancelledError
+from core.scheduler import ConversionScheduler, QueueFullError
+
+def dispatch_order(jobs, workers=1):
+    """
+    Queues (user_id, cost, priority) jobs behind a busy worker, frees it and returns
+    the order in which they got a slot, as indexes into `jobs`.
+    """
+    async def run():
+        conversions = ConversionScheduler(workers=workers)
+        order = []
+
+        async def job(index, user_id, cost, priority):
+            async with conversions.slot(user_id, cost=cost, priority=priority):
+                order.append(index)
+                await asyncio.sleep(0)
+
+        blocker = conversions.slot("busy")
+        await blocker.__aenter__()
+        tasks = []
+        for index, (user_id, cost, priority) in enumerate(jobs):
+            tasks.append(asyncio.create_task(job(index, user_id, cost, priority)))
+            await asyncio.sleep(0)
+        await blocker.__aexit__(None, None, None)
+        await asyncio.gather(*tasks)
+        return order
+    return asyncio.run(run())
+
+@pytest.fixture
+def round_robin(monkeypatch):
+    monkeypatch.setattr(scheduler, "SHORTEST_JOB_FIRST", False)
+
+def test_round_robin_between_users(round_robin):
+    jobs = [("a", 30, 0), ("a", 30, 0), ("a", 30, 0), ("b", 30, 0), ("c", 30, 0)]
+    assert dispatch_order(jobs) == [0, 3, 4, 1, 2]
+
+def test_shortest_job_first_among_users():
+    jobs = [("a", 300, 0), ("b", 5, 0), ("c", 60, 0)]
+    assert dispatch_order(jobs) == [1, 2, 0]
+
+def test_shortest_job_first_only_looks_at_each_users_oldest_job():
+    # b's short second file waits for b's turn instead of jumping ahead of a
+    jobs = [("a", 60, 0), ("b", 300, 0), ("b", 1, 0)]
+    assert dispatch_order(jobs) == [0, 1, 2]
+
+def test_priority_goes_first(round_robin):
+    jobs = [("a", 30, 0), ("b", 30, 0), ("vip", 30, 1), ("vip", 30, 1)]
+    assert dispatch_order(jobs) == [2, 3, 0, 1]
+
+def test_response_ratio_lets_long_jobs_catch_up():
+    async def run():
+        long, short = scheduler._Job("a", None, cost=100), scheduler._Job("b", None, cost=1)
+        long.queued_at = 0.0
+        short.queued_at = 900.0
+        queues = {"a": [long], "b": [short]}
+        return ConversionScheduler._pick(queues, now=901.0)
+    # (900 + 100) / 100 = 10 beats (1 + 1) / 1 = 2
+    assert asyncio.run(run()) == "a"
+
+def test_queue_full_and_cancel():
+    async def run():
+        conversions = ConversionScheduler(workers=1, max_queue=2)
+        blocker = conversions.slot("busy")
+        await blocker.__aenter__()
+        waiting = []
+
+        async def job(user_id):
+            async with conversions.slot(user_id):
+                pass
+
+        for user_id in ("a", "a"):
+            waiting.append(asyncio.create_task(job(user_id)))
+            await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            async with conversions.slot("b"):
+                pass
+        assert conversions.cancel("a") == 2
+        results = await asyncio.gather(*waiting, return_exceptions=True)
+        assert all(isinstance(result, CancelledError) for result in results)
+        assert conversions.queued == 0
+        await blocker.__aexit__(None, None, None)
+        assert conversions.running == 0
+    asyncio.run(run())
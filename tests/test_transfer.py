@@ -0,0 +1,56 @@
+import asyncio
+import multiprocessing
+import os
+
+from benchmarks.transfer_bench import MockFileAPI, MockSender, MockTransferrer
+from bot.transfer import PART_SIZE
+
+class CrashingSender(MockSender):
+    """Kills the process, as a crash or a deploy would, after `parts` parts."""
+
+    def __init__(self, api, parts):
+        super().__init__(api)
+        self.parts = parts
+
+    async def send(self, request):
+        if self.api.requests >= self.parts:
+            os._exit(1)
+        return await super().send(request)
+
+class CrashingTransferrer(MockTransferrer):
+    async def _init_senders(self, count):
+        self.senders = [CrashingSender(self.api, 5) for _ in range(count)]
+
+def crash_midway(data, target):
+    api = MockFileAPI(data, latency=0, bandwidth=1e12)
+    asyncio.run(CrashingTransferrer(api, 1).download(None, len(data), target))
+
+def test_download_resumes_finished_parts(tmp_path):
+    data = os.urandom(12 * PART_SIZE + 1234)
+    target = str(tmp_path / "job1.mp3")
+    child = multiprocessing.get_context("fork").Process(target=crash_midway, args=(data, target))
+    child.start()
+    child.join()
+    assert child.exitcode == 1
+    assert not os.path.exists(target)
+
+    api = MockFileAPI(data, latency=0, bandwidth=1e12)
+    existing = asyncio.run(MockTransferrer(api, 3).download(None, len(data), target, resume=True))
+    assert existing == 5 * PART_SIZE
+    assert api.requests == 13 - 5
+    with open(target, "rb") as f:
+        assert f.read() == data
+    assert sorted(os.listdir(tmp_path)) == ["job1.mp3"]
+
+def test_download_without_resume_starts_over(tmp_path):
+    data = os.urandom(3 * PART_SIZE)
+    target = str(tmp_path / "job1.mp3")
+    with open(target + ".part", "wb") as f:
+        f.write(b"\0" * len(data))
+    with open(target + ".parts", "wb") as f:
+        f.write(b"\1\1\1")
+    api = MockFileAPI(data, latency=0, bandwidth=1e12)
+    assert asyncio.run(MockTransferrer(api, 2).download(None, len(data), target)) == 0
+    assert api.requests == 3
+    with open(target, "rb") as f:
+        assert f.read() == data
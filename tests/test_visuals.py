@@ -0,0 +1,36 @@
+import io
+
+import numpy as np
+import pytest
+
+from core.visuals import stream_envelope, compute_peaks
+
+def pcm(samples):
+    return io.BytesIO(np.asarray(samples, dtype=np.int16).tobytes())
+
+def test_envelope_keeps_short_audio_as_is():
+    samples = [3, -7, 2, 9, -1]
+    assert list(stream_envelope(pcm(samples), limit=10)) == [3, 7, 2, 9, 1]
+
+@pytest.mark.parametrize("chunk_bytes", [3, 64, 4096])
+def test_envelope_is_exact_and_bounded(chunk_bytes):
+    samples = np.random.default_rng(0).integers(-32768, 32767, 10_001)
+    envelope = stream_envelope(pcm(samples), limit=100, chunk_bytes=chunk_bytes)
+    assert len(envelope) <= 100
+    # Runs of equal length from the start, the last one possibly shorter
+    run = 1
+    while -(-len(samples) // run) > 100:
+        run *= 2
+    padded = np.zeros(run * len(envelope))
+    padded[:len(samples)] = np.abs(samples)
+    assert np.array_equal(envelope, padded.reshape(-1, run).max(axis=1))
+
+def test_peaks_from_envelope_match_the_samples():
+    samples = np.random.default_rng(1).integers(-32768, 32767, 200_000)
+    envelope = stream_envelope(pcm(samples), limit=144 * 64)
+    assert np.abs(compute_peaks(envelope, 144) - compute_peaks(samples, 144)).max() < 0.1
+
+def test_peaks_are_normalized():
+    peaks = compute_peaks(np.array([0, 100, -200, 50]), 2)
+    assert list(peaks) == [0.5, 1.0]
+    assert list(compute_peaks(np.array([], dtype=np.int16), 3)) == [0, 0, 0]
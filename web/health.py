@@ -1,18 +1,141 @@
 import os
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import time
+import asyncio
+from core.metrics import render_metrics, startup_phases
+from database.manager import run_db, ping_db, get_stats, active_tasks
+from core.admission import MIN_FREE_DISK_MB, MB
+from core.costmodel import cost_model
 
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"Bot is running!")
+# How often the background probe refreshes DB reachability and stats
+HEALTH_REFRESH_SECONDS = int(os.getenv("HEALTH_REFRESH_SECONDS", "15"))
 
-    def do_HEAD(self):
-        self.send_response(200)
-        self.end_headers()
+class HealthState:
+    """
+    Everything the HTTP endpoints report, refreshed in the background so that
+    load balancer probes and dashboards never wait on Postgres.
+    The server is bound before the bot is imported and connected; until
+    `attach` hands it the bot's parts it only reports that it is starting.
+    """
 
-def run_health_check():
+    def __init__(self):
+        self.client = None
+        self.scheduler = None
+        self.admission = None
+        self.started_at = time.time()
+        self.db_ok = False
+        self.db_checked_at = 0.0
+        self.stats = {}
+
+    def attach(self, client, scheduler, admission):
+        self.client = client
+        self.scheduler = scheduler
+        self.admission = admission
+
+    async def refresh_forever(self):
+        while True:
+            try:
+                await run_db(ping_db)
+                self.db_ok = True
+            except Exception as e:
+                self.db_ok = False
+                print(f"Health DB check failed: {e}")
+            self.db_checked_at = time.time()
+            if self.db_ok:
+                try:
+                    self.stats = await run_db(get_stats)
+                except Exception as e:
+                    print(f"Health stats refresh failed: {e}")
+            await asyncio.sleep(HEALTH_REFRESH_SECONDS)
+
+    def checks(self):
+        if self.client is None:
+            return {"started": False}, None
+        free_mb = self.admission.free_disk() / MB
+        return {
+            "telegram_connected": bool(self.client.is_connected()),
+            "database_reachable": self.db_ok,
+            "queue_not_saturated": not self.scheduler.is_full(),
+            "disk_space_ok": free_mb >= MIN_FREE_DISK_MB,
+        }, free_mb
+
+    def status(self):
+        checks, free_mb = self.checks()
+        status = {
+            "ready": all(checks.values()),
+            "checks": checks,
+            "uptime_seconds": int(time.time() - self.started_at),
+            "startup": startup_phases,
+        }
+        if self.client is None:
+            return status
+        status.update({
+            "total_conversions": self.stats.get("total_conversions"),
+            "unique_users": self.stats.get("unique_users"),
+            "active_tasks": len(active_tasks),
+            "running_jobs": self.scheduler.running,
+            "queued_jobs": self.scheduler.queued,
+            "workers": self.scheduler.workers,
+            "free_disk_mb": round(free_mb, 1),
+            "admission": self.admission.stats(),
+            "cost_model": cost_model.stats(),
+            "db_checked_at": self.db_checked_at,
+        })
+        return status
+
+health_state = HealthState()
+
+def _response(writer, status, body, content_type="text/plain; charset=utf-8", head=False):
+    if isinstance(body, str):
+        body = body.encode()
+    reason = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}[status]
+    writer.write(
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n".encode()
+    )
+    if not head:
+        writer.write(body)
+
+async def _handle(state, reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain headers; we never need them
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode(errors="replace").split()
+        if len(parts) < 2:
+            return
+        method, path = parts[0], parts[1].split("?")[0]
+        head = method == "HEAD"
+        if method not in ("GET", "HEAD"):
+            _response(writer, 405, "Method not allowed")
+        elif path == "/":
+            _response(writer, 200, "Bot is running!", head=head)
+        elif path == "/ready":
+            checks, _ = state.checks()
+            _response(writer, 200 if all(checks.values()) else 503, json.dumps(checks), "application/json", head)
+        elif path == "/status":
+            _response(writer, 200, json.dumps(state.status()), "application/json", head)
+        elif path == "/metrics":
+            body, content_type = render_metrics()
+            _response(writer, 200, body, content_type, head)
+        else:
+            _response(writer, 404, "Not found", head=head)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_health_server():
+    """
+    Serves /, /ready, /status and /metrics on PORT from the bot's own event loop.
+    Runs first at startup so the port is open (and / answers) while the rest loads.
+    """
     port = int(os.environ.get("PORT", 8080))
-    server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
+    server = await asyncio.start_server(lambda r, w: _handle(health_state, r, w), "0.0.0.0", port)
+    asyncio.create_task(health_state.refresh_forever())
     print(f"Health check server started on port {port}")
-    server.serve_forever()
+    return server